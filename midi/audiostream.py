@@ -0,0 +1,300 @@
+#!/usr/bin/python
+
+from array import array
+import ctypes, ctypes.util, os, sys, threading, time
+
+"""A ring of depth blocks of blockSize signed 16 bit samples, all allocated up front, passing rendered
+blocks from one thread that writes them to one that reads them. Each side only advances its own count,
+so neither waits on the other except when the ring is full (the writer) or empty (the reader)."""
+class RingBuffer:
+	def __init__(self, depth, blockSize):
+		self.depth = depth
+		self.blockSize = blockSize
+		self.slots = [array("h", [0]) * blockSize for i in xrange(0, depth)]
+		self.lengths = [0] * depth
+		# the time each block was started to be rendered, for the latency
+		self.times = [0.0] * depth
+		self.written = 0
+		self.read = 0
+		self.closed = False
+		self.changed = threading.Condition()
+
+	"""Returns the number of blocks written and not yet read."""
+	def Fill(self):
+		return self.written - self.read
+
+	"""Copies block (up to blockSize samples) into the next free slot, waiting for one if the ring is full."""
+	def Write(self, block, time):
+		if self.written - self.read == self.depth:
+			self.changed.acquire()
+			while self.written - self.read == self.depth:
+				self.changed.wait()
+			self.changed.release()
+		i = self.written % self.depth
+		self.slots[i][:len(block)] = block
+		self.lengths[i] = len(block)
+		self.times[i] = time
+		self.written += 1
+		self._notify()
+
+	"""Marks the end of the blocks, once the last has been written."""
+	def Close(self):
+		self.closed = True
+		self._notify()
+
+	"""Returns the next block as (slot, number of samples, time), or None if there are none yet (or
+	none to come, if closed). The block stays in the ring until Release is called."""
+	def Peek(self):
+		if self.written == self.read:
+			return None
+		i = self.read % self.depth
+		return (self.slots[i], self.lengths[i], self.times[i])
+
+	"""Frees the slot of the block returned by Peek."""
+	def Release(self):
+		self.read += 1
+		self._notify()
+
+	"""Waits until there is a block to read, or there are no more to come."""
+	def WaitForBlock(self):
+		if self.written == self.read and not self.closed:
+			self.changed.acquire()
+			while self.written == self.read and not self.closed:
+				self.changed.wait()
+			self.changed.release()
+
+	"""Waits until the ring is full, or there are no more blocks to come."""
+	def WaitUntilFull(self):
+		if self.written - self.read < self.depth and not self.closed:
+			self.changed.acquire()
+			while self.written - self.read < self.depth and not self.closed:
+				self.changed.wait()
+			self.changed.release()
+
+	def _notify(self):
+		self.changed.acquire()
+		self.changed.notify_all()
+		self.changed.release()
+
+"""A sink writing raw little endian 16 bit samples to a pipe, such as stdout read by aplay or sox, which
+takes them at the rate it plays them, or to a file. It isn't real time: the stream waits for each block
+to be rendered (the player will run short if it waits too long), so it gets exactly the samples rendered."""
+class PipeSink:
+	realtime = False
+
+	def __init__(self, file):
+		self.file = file
+		self.underruns = 0
+
+	def write(self, samples):
+		if sys.byteorder == "big":
+			samples = array("h", samples)
+			samples.byteswap()
+		samples.tofile(self.file)
+		self.file.flush()
+
+	"""Returns the time in seconds from a block being written to it being heard, as far as is known."""
+	def Latency(self):
+		return 0.0
+
+	def close(self):
+		self.file.close()
+
+"""A stand-in for an audio device, writing raw little endian 16 bit samples to a file no faster than they
+would be played at sampleRate, holding one block while it plays the one before. So the stream behaves as
+it would with a device, including running short of blocks if they aren't rendered in time."""
+class FileSink(PipeSink):
+	realtime = True
+
+	def __init__(self, file, sampleRate=44100):
+		PipeSink.__init__(self, file)
+		self.sampleRate = sampleRate
+		# the time when the samples written so far will have been played
+		self.playedBy = None
+
+	def write(self, samples):
+		PipeSink.write(self, samples)
+		now = time.time()
+		if self.playedBy == None or self.playedBy < now:
+			if self.playedBy != None:
+				# the device would have run out of samples to play
+				self.underruns += 1
+			self.playedBy = now
+		duration = float(len(samples)) / self.sampleRate
+		self.playedBy += duration
+		wait = self.playedBy - duration - now
+		if wait > 0:
+			time.sleep(wait)
+
+	def Latency(self):
+		if self.playedBy == None:
+			return 0.0
+		return max(0.0, self.playedBy - time.time())
+
+class _PaStreamParameters(ctypes.Structure):
+	_fields_ = [("device", ctypes.c_int), ("channelCount", ctypes.c_int), ("sampleFormat", ctypes.c_ulong),
+		("suggestedLatency", ctypes.c_double), ("hostApiSpecificStreamInfo", ctypes.c_void_p)]
+
+class _PaDeviceInfo(ctypes.Structure):
+	_fields_ = [("structVersion", ctypes.c_int), ("name", ctypes.c_char_p), ("hostApi", ctypes.c_int),
+		("maxInputChannels", ctypes.c_int), ("maxOutputChannels", ctypes.c_int),
+		("defaultLowInputLatency", ctypes.c_double), ("defaultLowOutputLatency", ctypes.c_double),
+		("defaultHighInputLatency", ctypes.c_double), ("defaultHighOutputLatency", ctypes.c_double),
+		("defaultSampleRate", ctypes.c_double)]
+
+class _PaStreamInfo(ctypes.Structure):
+	_fields_ = [("structVersion", ctypes.c_int), ("inputLatency", ctypes.c_double),
+		("outputLatency", ctypes.c_double), ("sampleRate", ctypes.c_double)]
+
+paInt16 = 0x00000008
+paOutputUnderflowed = -9980
+
+"""Loads the PortAudio library: the one installed, or else the one built in the vendored portaudio/."""
+def LoadPortAudio():
+	path = ctypes.util.find_library("portaudio")
+	if path == None:
+		path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "portaudio", "lib", ".libs", "libportaudio.so")
+		if not os.path.exists(path):
+			raise OSError("the PortAudio library isn't installed or built in portaudio/ (./configure && make)")
+	pa = ctypes.CDLL(path)
+	pa.Pa_GetErrorText.restype = ctypes.c_char_p
+	pa.Pa_GetDeviceInfo.restype = ctypes.POINTER(_PaDeviceInfo)
+	pa.Pa_GetStreamInfo.restype = ctypes.POINTER(_PaStreamInfo)
+	pa.Pa_WriteStream.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_ulong]
+	pa.Pa_OpenStream.argtypes = [ctypes.POINTER(ctypes.c_void_p), ctypes.c_void_p, ctypes.POINTER(_PaStreamParameters),
+		ctypes.c_double, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_void_p, ctypes.c_void_p]
+	return pa
+
+"""A sink playing mono 16 bit samples through the default output device with PortAudio's blocking
+API, which takes them at the rate they are played. latency is the output latency to ask for, in
+seconds (default: the device's low latency); the device may give more."""
+class PortAudioSink:
+	realtime = True
+
+	def __init__(self, sampleRate=44100, blockSize=256, latency=None):
+		self.pa = LoadPortAudio()
+		self._check(self.pa.Pa_Initialize())
+		self.underruns = 0
+		device = self.pa.Pa_GetDefaultOutputDevice()
+		if device < 0:
+			self.pa.Pa_Terminate()
+			raise IOError("no default audio output device")
+		if latency == None:
+			latency = self.pa.Pa_GetDeviceInfo(device).contents.defaultLowOutputLatency
+		parameters = _PaStreamParameters(device, 1, paInt16, latency, None)
+		self.stream = ctypes.c_void_p()
+		self._check(self.pa.Pa_OpenStream(ctypes.byref(self.stream), None, ctypes.byref(parameters), float(sampleRate), blockSize, 0, None, None))
+		self.outputLatency = self.pa.Pa_GetStreamInfo(self.stream).contents.outputLatency
+		self._check(self.pa.Pa_StartStream(self.stream))
+
+	def _check(self, error):
+		if error < 0:
+			raise IOError("PortAudio: %s" % self.pa.Pa_GetErrorText(error))
+
+	def write(self, samples):
+		(address, length) = samples.buffer_info()
+		error = self.pa.Pa_WriteStream(self.stream, address, length)
+		if error == paOutputUnderflowed:
+			self.underruns += 1
+		else:
+			self._check(error)
+
+	def Latency(self):
+		return self.outputLatency
+
+	def close(self):
+		self.pa.Pa_StopStream(self.stream)
+		self.pa.Pa_CloseStream(self.stream)
+		self.pa.Pa_Terminate()
+
+"""Plays blocks of signed 16 bit samples (as from RenderBlocks, RenderPolyphonic or RenderWavetable) through
+sink as they are rendered. A thread renders the blocks into a RingBuffer of depth blocks of blockSize
+samples, which is filled before playing starts, while the sink is fed from the ring. When the ring runs empty
+(an underrun), a real time sink is given a block of silence in place of the one not yet rendered, while any
+other waits for it.
+It records the time to render each block, the fill level of the ring as each block is played, the underruns,
+and the latency from a block starting to be rendered to it being heard."""
+class AudioStream:
+	def __init__(self, sink, blockSize=256, depth=4, sampleRate=44100):
+		self.sink = sink
+		self.blockSize = blockSize
+		self.sampleRate = sampleRate
+		self.ring = RingBuffer(depth, blockSize)
+		self.silence = array("h", [0]) * blockSize
+		# instrumentation
+		self.blocks = 0
+		self.renderSeconds = 0.0
+		self.maxRenderSeconds = 0.0
+		self.blocksPlayed = 0
+		self.fillSum = 0
+		self.minFill = depth
+		self.underruns = 0
+		self.latencySum = 0.0
+		self.maxLatency = 0.0
+		self.error = None
+
+	def _render(self, blocks):
+		try:
+			blocks = iter(blocks)
+			while True:
+				start = time.time()
+				try:
+					block = blocks.next()
+				except StopIteration:
+					break
+				elapsed = time.time() - start
+				self.blocks += 1
+				self.renderSeconds += elapsed
+				self.maxRenderSeconds = max(self.maxRenderSeconds, elapsed)
+				self.ring.Write(block, start)
+		except Exception, e:
+			self.error = e
+		finally:
+			self.ring.Close()
+
+	"""Plays blocks through the sink, returning once the last has been written to it."""
+	def Play(self, blocks):
+		renderer = threading.Thread(target=self._render, args=(blocks,))
+		renderer.daemon = True
+		renderer.start()
+		ring = self.ring
+		ring.WaitUntilFull()
+		while True:
+			if not self.sink.realtime and ring.Fill() == 0 and not ring.closed:
+				self.underruns += 1
+				ring.WaitForBlock()
+			fill = ring.Fill()
+			next = ring.Peek()
+			if next == None:
+				if ring.closed:
+					# the last block may have been written since the ring was looked at
+					if ring.Fill() == 0:
+						break
+					continue
+				self.underruns += 1
+				self.sink.write(self.silence)
+				continue
+			(slot, length, started) = next
+			self.blocksPlayed += 1
+			self.fillSum += fill
+			self.minFill = min(self.minFill, fill)
+			if length < self.blockSize:
+				self.sink.write(slot[:length])
+			else:
+				self.sink.write(slot)
+			latency = time.time() - started + self.sink.Latency()
+			self.latencySum += latency
+			self.maxLatency = max(self.maxLatency, latency)
+			ring.Release()
+		renderer.join()
+		if self.error != None:
+			raise self.error
+
+	"""Returns a line summarising the instrumentation."""
+	def Report(self):
+		if self.blocksPlayed == 0:
+			return "nothing played"
+		return "%d blocks: render %.3f ms/block (max %.3f, %.3f ms of audio), fill %.1f/%d blocks on average (min %d), %d underruns (%d in the sink), latency %.1f ms on average (max %.1f)" % (
+			self.blocksPlayed, 1000*self.renderSeconds/self.blocks, 1000*self.maxRenderSeconds, 1000.0*self.blockSize/self.sampleRate,
+			float(self.fillSum)/self.blocksPlayed, self.ring.depth, self.minFill, self.underruns, self.sink.underruns,
+			1000*self.latencySum/self.blocksPlayed, 1000*self.maxLatency)
@@ -0,0 +1,523 @@
+#!/usr/bin/python
+
+from mididecode import FindRiffChunks, DecodeHeader, DecodeTrack, MapFile, FindRiffChunksFromBuffer, DecodeHeaderFromBuffer, DecodeTrackFromBuffer, FilterEventsByChannel, GetTempoChangeEvents, IterTrack, IterChannelEvents, IterTempoChangeEvents, FindTrackChannels, DecodeAllTracks, IndexTrack, IterTrackFrom, GetTempoChangeEventsFromBuffer
+from midicolumns import DecodeTrackColumnar, FilterColumnarByChannel
+from midicache import MIDICache
+from simplesynth import LE16, GenerateWaveform, RenderBlocks, RenderSquare, RenderTrack, WriteBlocksLE16, ExtractMonophonicNotes, TrackTimeToMillis, TrackTimeToSamples
+from smfgen import WriteCorpus
+from tempomap import TempoMap
+from mixdown import MixTracks, SynthesisedTracks
+from notecache import NoteCache
+from polysynth import EngineCommands
+from schedule import CompileSchedule, Schedule
+from wavetable import SHAPES, OctaveHarmonics, BuildWavetables, WavetableBank, WavetableOscillator, RenderWavetable
+from wavwriter import WAVWriter
+
+from collections import OrderedDict
+from itertools import islice
+import argparse, json, multiprocessing, os, pickle, platform, resource, shutil, sys, tempfile, time
+
+"""Returns the best wall clock time in seconds over repeat calls of fn()."""
+def BestTime(fn, repeat=3):
+	best = None
+	for i in xrange(0, repeat):
+		start = time.time()
+		fn()
+		elapsed = time.time() - start
+		if best == None or elapsed < best:
+			best = elapsed
+	return best
+
+"""The measurements made for one MIDI file, each printed as it is recorded. A measurement is a time in
+seconds along with the rates and sizes derived from it, keyed by name, as written by --json."""
+class Results:
+	def __init__(self):
+		self.measurements = OrderedDict()
+
+	"""Records a measurement of the given number of seconds. Where a number of events is given, the events per
+	second are added, and for a number of samples at sampleRate, the samples per second and the real-time factor
+	(the length of the audio over the time taken to render it). Any other keyword arguments are recorded as is."""
+	def Record(self, name, seconds, events=None, samples=None, sampleRate=44100, **metrics):
+		measurement = OrderedDict([("seconds", seconds)])
+		if events != None:
+			measurement["events"] = events
+			measurement["events_per_sec"] = events/seconds
+		if samples != None:
+			measurement["samples"] = samples
+			measurement["samples_per_sec"] = samples/seconds
+			measurement["realtime_factor"] = float(samples)/sampleRate/seconds
+		for key in sorted(metrics.keys()):
+			measurement[key] = metrics[key]
+		self.measurements[name] = measurement
+		details = ["%s=%s" % (key, FormatMetric(value)) for (key, value) in measurement.items()[1:]]
+		print "  %-36s %9.4fs  %s" % (name, seconds, "  ".join(details))
+
+def FormatMetric(value):
+	if isinstance(value, float):
+		return "%.4g" % value
+	return str(value)
+
+"""Decodes every track of the file with the seek and read based decoder. Returns the number of events."""
+def DecodeAllWithFile(path):
+	file = open(path, "r")
+	chunkIdx = FindRiffChunks(file)
+	hdr = DecodeHeader(file, chunkIdx)
+	count = 0
+	for trackNum in xrange(0, hdr["numTracks"]):
+		count += len(DecodeTrack(file, chunkIdx, trackNum))
+	file.close()
+	return count
+
+"""Decodes every track of the file with the buffer based decoder. Returns the number of events."""
+def DecodeAllWithBuffer(path):
+	file = open(path, "r")
+	data = MapFile(file)
+	file.close()
+	chunkIdx = FindRiffChunksFromBuffer(data)
+	hdr = DecodeHeaderFromBuffer(data, chunkIdx)
+	count = 0
+	for trackNum in xrange(0, hdr["numTracks"]):
+		count += len(DecodeTrackFromBuffer(data, chunkIdx, trackNum))
+	return count
+
+"""Measures chunk indexing and the file and buffer based decoders."""
+def BenchmarkDecode(path, results, repeat=3):
+	events = DecodeAllWithBuffer(path)
+	assert events == DecodeAllWithFile(path)
+	file = open(path, "r")
+	results.Record("FindRiffChunks", BestTime(lambda: FindRiffChunks(file), repeat))
+	file.close()
+	fileTime = BestTime(lambda: DecodeAllWithFile(path), repeat)
+	bufferTime = BestTime(lambda: DecodeAllWithBuffer(path), repeat)
+	results.Record("DecodeTrack", fileTime, events=events)
+	results.Record("DecodeTrackFromBuffer", bufferTime, events=events, speedup=fileTime/bufferTime)
+
+"""Decodes every track of the file into ColumnarTracks. Returns the list of tracks."""
+def DecodeAllColumnar(path):
+	file = open(path, "r")
+	data = MapFile(file)
+	file.close()
+	chunkIdx = FindRiffChunksFromBuffer(data)
+	hdr = DecodeHeaderFromBuffer(data, chunkIdx)
+	return [DecodeTrackColumnar(data, chunkIdx, trackNum) for trackNum in xrange(0, hdr["numTracks"])]
+
+"""Measures decoding and channel filtering with the columnar store against (time, MIDIEvent) lists,
+along with the bytes held per event by the columns."""
+def BenchmarkColumnar(path, results, repeat=3):
+	tracks = DecodeAllColumnar(path)
+	events = sum([len(track) for track in tracks])
+	columnBytes = 0
+	for track in tracks:
+		for column in (track.time, track.status, track.channel, track.data1, track.data2, track.payloadEvent, track.payloadOffset, track.payloadLength):
+			columnBytes += len(column) * column.itemsize
+	decodeTime = BestTime(lambda: DecodeAllColumnar(path), repeat)
+	results.Record("DecodeTrackColumnar", decodeTime, events=events, bytes_per_event=float(columnBytes)/events)
+	eventLists = [list(track.Events()) for track in tracks]
+	filterTime = BestTime(lambda: [FilterEventsByChannel(eventList) for eventList in eventLists], repeat)
+	columnarFilterTime = BestTime(lambda: [FilterColumnarByChannel(track) for track in tracks], repeat)
+	results.Record("FilterEventsByChannel", filterTime, events=events)
+	results.Record("FilterColumnarByChannel", columnarFilterTime, events=events, speedup=filterTime/columnarFilterTime)
+
+"""Runs fn() in a child process. Returns its result and the peak resident set size of the child in kB."""
+def RunMeasuringPeakRSS(fn):
+	(r, w) = os.pipe()
+	pid = os.fork()
+	if pid == 0:
+		os.close(r)
+		result = fn()
+		os.write(w, pickle.dumps((result, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)))
+		os._exit(0)
+	os.close(w)
+	reply = ""
+	while True:
+		buf = os.read(r, 4096)
+		if buf == "":
+			break
+		reply += buf
+	os.close(r)
+	os.waitpid(pid, 0)
+	return pickle.loads(reply)
+
+"""Synthesises the first second of the first track (or channel, for a format 0 file) of the MIDI file at path,
+decoding with either whole track lists or the streaming decoder. Returns the time taken to the first sample."""
+def RenderFirstSecond(path, streaming, sampleRate=44100):
+	start = time.time()
+	file = open(path, "r")
+	data = MapFile(file)
+	chunkIdx = FindRiffChunksFromBuffer(data)
+	hdr = DecodeHeaderFromBuffer(data, chunkIdx)
+	if streaming:
+		tempoChangeEvents = IterTempoChangeEvents(IterTrack(data, chunkIdx, 0))
+		if hdr["formatType"] == 0:
+			channelEvents = IterChannelEvents(IterTrack(data, chunkIdx, 0), FindTrackChannels(data, chunkIdx, 0)[0])
+		else:
+			channelEvents = IterTrack(data, chunkIdx, 1)
+	else:
+		track0 = DecodeTrackFromBuffer(data, chunkIdx, 0)
+		tempoChangeEvents = GetTempoChangeEvents(track0)
+		if hdr["formatType"] == 0:
+			eventsPerChannel = FilterEventsByChannel(track0)
+			channelEvents = eventsPerChannel[min(eventsPerChannel.keys())]
+		else:
+			channelEvents = DecodeTrackFromBuffer(data, chunkIdx, 1)
+	waveform = GenerateWaveform(ExtractMonophonicNotes(TrackTimeToMillis(hdr, channelEvents, tempoChangeEvents)), 1000.0/sampleRate)
+	waveform.next()
+	firstSample = time.time() - start
+	for sample in islice(waveform, sampleRate - 1):
+		pass
+	file.close()
+	return firstSample
+
+"""Measures the time to first sample and peak memory use of synthesis from whole track lists and from the streaming decoder.
+Each run is in a new process, so that the memory used by one run doesn't count towards the next."""
+def BenchmarkStreaming(path, results, repeat=3):
+	for (name, streaming) in (("DecodeTrackFromBuffer", False), ("IterTrack", True)):
+		runs = [RunMeasuringPeakRSS(lambda: RenderFirstSecond(path, streaming)) for i in xrange(0, repeat)]
+		results.Record("first sample, %s" % name, min([firstSample for (firstSample, peakRSS) in runs]),
+			peak_rss_kb=max([peakRSS for (firstSample, peakRSS) in runs]))
+
+"""Measures DecodeAllTracks with 1 up to maxWorkers (by default, the number of CPUs) worker processes."""
+def BenchmarkParallelDecode(path, results, maxWorkers=None, repeat=3):
+	if maxWorkers == None:
+		maxWorkers = multiprocessing.cpu_count()
+	serialTime = None
+	for workers in xrange(1, maxWorkers + 1):
+		elapsed = BestTime(lambda: DecodeAllTracks(path, workers), repeat)
+		if serialTime == None:
+			serialTime = elapsed
+		results.Record("DecodeAllTracks -j%d" % workers, elapsed, speedup=serialTime/elapsed)
+
+"""Measures the memory held per MIDIEvent (excluding messageData), and the cost of the accessors used by the synth pipeline."""
+def BenchmarkEvents(path, results, repeat=3):
+	events = [event for track in DecodeAllTracks(path, 1) for (time, event) in track.Events()]
+	eventBytes = 0
+	for event in events:
+		eventBytes += sys.getsizeof(event)
+		if hasattr(event, "__dict__"):
+			eventBytes += sys.getsizeof(event.__dict__)
+	channelEvents = [event for event in events if event.Type() < 0xF0]
+	def readAccessors():
+		for event in channelEvents:
+			event.Type()
+			event.Channel()
+			event.Param1()
+			event.Param2()
+	elapsed = BestTime(readAccessors, repeat)
+	results.Record("MIDIEvent accessors", elapsed, events=len(channelEvents), ns_per_call=1e9*elapsed/(4*len(channelEvents)),
+		bytes_per_event=float(eventBytes)/len(events))
+
+"""Measures loading the file through a MIDICache when it isn't cached (a full decode) and when it is."""
+def BenchmarkCache(path, results, repeat=3):
+	directory = tempfile.mkdtemp()
+	try:
+		def coldLoad():
+			MIDICache(directory).Load(path)
+			for name in os.listdir(directory):
+				os.remove(os.path.join(directory, name))
+		coldTime = BestTime(coldLoad, repeat)
+		cache = MIDICache(directory)
+		cache.Load(path)
+		warmTime = BestTime(lambda: cache.Load(path), repeat)
+		assert cache.hits == repeat
+	finally:
+		shutil.rmtree(directory)
+	results.Record("MIDICache cold load", coldTime)
+	results.Record("MIDICache warm load", warmTime, speedup=coldTime/warmTime)
+
+"""Measures building a TrackIndex for the longest track of the file, and the time taken to reach the first
+event at points through the track with and without it."""
+def BenchmarkSeek(path, results, repeat=3):
+	file = open(path, "r")
+	data = MapFile(file)
+	file.close()
+	chunkIdx = FindRiffChunksFromBuffer(data)
+	trackNum = max(xrange(0, len(chunkIdx["MTrk"])), key=lambda trackNum: chunkIdx["MTrk"][trackNum]["length"])
+	indexTime = BestTime(lambda: IndexTrack(data, chunkIdx, trackNum), repeat)
+	index = IndexTrack(data, chunkIdx, trackNum)
+	results.Record("IndexTrack", indexTime, checkpoints=len(index.checkpoints))
+	endTime = DecodeTrackFromBuffer(data, chunkIdx, trackNum)[-1][0]
+	for fraction in (0.25, 0.5, 0.9):
+		startTime = int(endTime * fraction)
+		def seekByDecoding():
+			for (time, event) in IterTrack(data, chunkIdx, trackNum):
+				if time >= startTime:
+					break
+		unindexedTime = BestTime(seekByDecoding, repeat)
+		indexedTime = BestTime(lambda: IterTrackFrom(data, chunkIdx, index, startTime).next(), repeat)
+		results.Record("seek to %d%%" % (100*fraction), unindexedTime)
+		results.Record("seek to %d%%, indexed" % (100*fraction), indexedTime, speedup=unindexedTime/indexedTime)
+
+"""A file that discards whatever is written to it."""
+class NullFile:
+	def write(self, buf):
+		pass
+
+"""Returns (hdr, tempoChangeEvents, channelEvents) for the first track synthesised from the MIDI file at path:
+the first channel of a format 0 file, or track 1 of any other."""
+def DecodeFirstSynthesisedTrack(path):
+	file = open(path, "r")
+	data = MapFile(file)
+	file.close()
+	chunkIdx = FindRiffChunksFromBuffer(data)
+	hdr = DecodeHeaderFromBuffer(data, chunkIdx)
+	track0 = DecodeTrackFromBuffer(data, chunkIdx, 0)
+	tempoChangeEvents = GetTempoChangeEvents(track0)
+	if hdr["formatType"] == 0:
+		eventsPerChannel = FilterEventsByChannel(track0)
+		channelEvents = eventsPerChannel[min(eventsPerChannel.keys())]
+	else:
+		channelEvents = DecodeTrackFromBuffer(data, chunkIdx, 1)
+	return (hdr, tempoChangeEvents, channelEvents)
+
+"""Measures each stage of the synth pipeline after decoding, for the first track synthesised from the file,
+rendering no more than the given number of seconds of audio. Then measures the whole pipeline, from opening
+the file to writing the WAV file, in a child process for its peak memory use."""
+def BenchmarkSynth(path, results, seconds=10, sampleRate=44100, repeat=3):
+	(hdr, tempoChangeEvents, channelEvents) = DecodeFirstSynthesisedTrack(path)
+	tempoMap = TempoMap(hdr, tempoChangeEvents)
+	timeToMillis = lambda: list(TrackTimeToMillis(hdr, channelEvents, tempoMap))
+	results.Record("TrackTimeToMillis", BestTime(timeToMillis, repeat), events=len(channelEvents))
+	timedEvents = timeToMillis()
+	results.Record("ExtractMonophonicNotes", BestTime(lambda: list(ExtractMonophonicNotes(timedEvents)), repeat), events=len(timedEvents))
+	timedNotes = list(ExtractMonophonicNotes(timedEvents))
+	maxSamples = seconds * sampleRate
+	generateWaveform = lambda: list(islice(GenerateWaveform(timedNotes, 1000.0/sampleRate), maxSamples))
+	waveform = generateWaveform()
+	results.Record("GenerateWaveform", BestTime(generateWaveform, repeat), samples=len(waveform), sampleRate=sampleRate)
+	results.Record("LE16", BestTime(lambda: LE16(waveform, NullFile()), repeat), samples=len(waveform), sampleRate=sampleRate)
+	# RenderBlocks renders whole blocks, so is stopped at the block that reaches maxSamples
+	maxBlocks = (maxSamples + 4095) / 4096
+	renderBlocks = lambda: list(islice(RenderBlocks(timedNotes, 1000.0/sampleRate, 4096), maxBlocks))
+	blocks = renderBlocks()
+	blockSamples = sum([len(block) for block in blocks])
+	results.Record("RenderBlocks", BestTime(renderBlocks, repeat), samples=blockSamples, sampleRate=sampleRate)
+	timeToSamples = lambda: list(TrackTimeToSamples(hdr, channelEvents, tempoMap, sampleRate))
+	results.Record("TrackTimeToSamples", BestTime(timeToSamples, repeat), events=len(channelEvents))
+	sampledNotes = list(ExtractMonophonicNotes(timeToSamples()))
+	renderSquare = lambda: list(islice(RenderSquare(sampledNotes, sampleRate, 4096), maxBlocks))
+	results.Record("RenderSquare", BestTime(renderSquare, repeat), samples=sum([len(block) for block in renderSquare()]), sampleRate=sampleRate)
+	(handle, wavPath) = tempfile.mkstemp(suffix=".wav")
+	os.close(handle)
+	try:
+		def writeWAV(bufferSize):
+			wavFile = WAVWriter(open(wavPath, "wb"), SampleRate=sampleRate, bufferSize=bufferSize)
+			LE16(waveform, wavFile)
+			wavFile.close()
+		# with no buffer, each sample is passed straight to the file, as WAVWriter did before it had one
+		unbufferedTime = BestTime(lambda: writeWAV(0), repeat)
+		results.Record("LE16 to WAVWriter, unbuffered", unbufferedTime, samples=len(waveform), sampleRate=sampleRate)
+		bufferedTime = BestTime(lambda: writeWAV(64*1024), repeat)
+		results.Record("LE16 to WAVWriter", bufferedTime, samples=len(waveform), sampleRate=sampleRate, speedup=unbufferedTime/bufferedTime)
+		def writeBlocksWAV():
+			wavFile = WAVWriter(open(wavPath, "wb"), SampleRate=sampleRate)
+			WriteBlocksLE16(blocks, wavFile)
+			wavFile.close()
+		blocksTime = BestTime(writeBlocksWAV, repeat)
+		results.Record("WriteBlocksLE16 to WAVWriter", blocksTime, samples=blockSamples, sampleRate=sampleRate,
+			speedup=(unbufferedTime/len(waveform))/(blocksTime/blockSamples))
+		def render(blockRenderer):
+			start = time.time()
+			(hdr, tempoChangeEvents, channelEvents) = DecodeFirstSynthesisedTrack(path)
+			wavFile = WAVWriter(open(wavPath, "wb"), SampleRate=sampleRate)
+			timedNotes = ExtractMonophonicNotes(TrackTimeToMillis(hdr, channelEvents, tempoChangeEvents))
+			if blockRenderer:
+				WriteBlocksLE16(islice(RenderBlocks(timedNotes, 1000.0/sampleRate, 4096), maxBlocks), wavFile)
+			else:
+				LE16(islice(GenerateWaveform(timedNotes, 1000.0/sampleRate), maxSamples), wavFile)
+			wavFile.close()
+			return time.time() - start
+		for (name, blockRenderer, samples) in (("GenerateWaveform", False, len(waveform)), ("RenderBlocks", True, blockSamples)):
+			runs = [RunMeasuringPeakRSS(lambda: render(blockRenderer)) for i in xrange(0, repeat)]
+			results.Record("render to WAV, %s" % name, min([elapsed for (elapsed, peakRSS) in runs]), samples=samples, sampleRate=sampleRate,
+				peak_rss_kb=max([peakRSS for (elapsed, peakRSS) in runs]))
+	finally:
+		os.remove(wavPath)
+
+"""Measures rendering the first synthesised track with each wavetable shape, against the plain square wave of
+GenerateWaveform and LE16 (the speedup is per sample), and building each shape's tables."""
+def BenchmarkWavetable(path, results, seconds=10, sampleRate=44100, repeat=3):
+	(hdr, tempoChangeEvents, channelEvents) = DecodeFirstSynthesisedTrack(path)
+	timedNotes = list(ExtractMonophonicNotes(TrackTimeToSamples(hdr, channelEvents, TempoMap(hdr, tempoChangeEvents), sampleRate)))
+	maxSamples = seconds * sampleRate
+	millisNotes = list(ExtractMonophonicNotes(TrackTimeToMillis(hdr, channelEvents, TempoMap(hdr, tempoChangeEvents))))
+	squareSamples = len(list(islice(GenerateWaveform(millisNotes, 1000.0/sampleRate), maxSamples)))
+	squareTime = BestTime(lambda: LE16(islice(GenerateWaveform(millisNotes, 1000.0/sampleRate), maxSamples), NullFile()), repeat)
+	results.Record("GenerateWaveform and LE16", squareTime, samples=squareSamples, sampleRate=sampleRate)
+	maxBlocks = (maxSamples + 4095) / 4096
+	for shape in SHAPES:
+		results.Record("BuildWavetables, %s" % shape, BestTime(lambda: BuildWavetables(shape, OctaveHarmonics(sampleRate)), repeat))
+		bank = WavetableBank(shape, sampleRate)
+		renderWavetable = lambda: WriteBlocksLE16(islice(RenderWavetable(timedNotes, WavetableOscillator(bank), 4096), maxBlocks), NullFile())
+		samples = sum([len(block) for block in islice(RenderWavetable(timedNotes, WavetableOscillator(bank), 4096), maxBlocks)])
+		elapsed = BestTime(renderWavetable, repeat)
+		results.Record("RenderWavetable, %s" % shape, elapsed, samples=samples, sampleRate=sampleRate,
+			speedup=(squareTime/squareSamples)/(elapsed/samples))
+
+"""Measures rendering seconds of every synthesised track and mixing them with MixTracks, with 1 up to maxWorkers
+(by default, the number of CPUs) worker processes, checking that the mix is the same with any number."""
+def BenchmarkMixdown(path, results, seconds=10, sampleRate=44100, maxWorkers=None, repeat=3):
+	if maxWorkers == None:
+		maxWorkers = multiprocessing.cpu_count()
+	tracks = SynthesisedTracks(path)
+	(handle, wavPath) = tempfile.mkstemp(suffix=".wav")
+	os.close(handle)
+	try:
+		def mix(workers):
+			wavFile = WAVWriter(open(wavPath, "wb"), SampleRate=sampleRate)
+			MixTracks(path, wavFile, tracks, workers=workers, maxSamples=seconds*sampleRate, sampleRate=sampleRate)
+			wavFile.close()
+		serialTime = None
+		serialMix = None
+		for workers in xrange(1, maxWorkers + 1):
+			elapsed = BestTime(lambda: mix(workers), repeat)
+			file = open(wavPath, "rb")
+			output = file.read()
+			file.close()
+			if serialTime == None:
+				(serialTime, serialMix) = (elapsed, output)
+			assert output == serialMix, "the mix with %d workers differs from that with 1" % workers
+			results.Record("MixTracks -j%d" % workers, elapsed, samples=(len(output) - 44) / 2, sampleRate=sampleRate,
+				tracks=len(tracks), speedup=serialTime/elapsed)
+	finally:
+		os.remove(wavPath)
+
+"""Measures rendering the first synthesised track with a NoteCache, which starts empty for each run, so only
+notes repeated within the track come from it, against rendering every note, for the square wave and a wavetable."""
+def BenchmarkNoteCache(path, results, seconds=10, sampleRate=44100, repeat=3):
+	(hdr, tempoChangeEvents, channelEvents) = DecodeFirstSynthesisedTrack(path)
+	timedEvents = list(TrackTimeToSamples(hdr, channelEvents, TempoMap(hdr, tempoChangeEvents), sampleRate))
+	maxBlocks = (seconds * sampleRate + 4095) / 4096
+	for waveform in (None, "saw"):
+		name = waveform or "square"
+		render = lambda cache: list(islice(RenderTrack(timedEvents, sampleRate, waveform=waveform, cache=cache), maxBlocks))
+		samples = sum([len(block) for block in render(None)])
+		uncachedTime = BestTime(lambda: render(None), repeat)
+		results.Record("RenderTrack, %s" % name, uncachedTime, samples=samples, sampleRate=sampleRate)
+		cachedTime = BestTime(lambda: render(NoteCache()), repeat)
+		cache = NoteCache()
+		render(cache)
+		results.Record("RenderTrack, %s, NoteCache" % name, cachedTime, samples=samples, sampleRate=sampleRate,
+			hits=cache.hits, misses=cache.misses, hit_rate=float(cache.hits)/max(1, cache.hits + cache.misses), speedup=uncachedTime/cachedTime)
+
+"""Returns, for each track synthesised from the MIDI file at path, its commands from EngineCommands and monophonic
+notes from ExtractMonophonicNotes, decoding the file afresh, as simplesynth does to play it."""
+def DecodeSchedule(path, sampleRate=44100):
+	file = open(path, "r")
+	data = MapFile(file)
+	file.close()
+	chunkIdx = FindRiffChunksFromBuffer(data)
+	hdr = DecodeHeaderFromBuffer(data, chunkIdx)
+	tempoMap = TempoMap(hdr, GetTempoChangeEventsFromBuffer(data, chunkIdx, 0))
+	if hdr["formatType"] == 0:
+		trackEvents = lambda track: IterChannelEvents(IterTrack(data, chunkIdx, 0), track)
+		tracks = FindTrackChannels(data, chunkIdx, 0)
+	else:
+		trackEvents = lambda track: IterTrack(data, chunkIdx, track)
+		tracks = xrange(1, hdr["numTracks"])
+	return [(list(EngineCommands(TrackTimeToSamples(hdr, trackEvents(track), tempoMap, sampleRate))),
+		list(ExtractMonophonicNotes(TrackTimeToSamples(hdr, trackEvents(track), tempoMap, sampleRate)))) for track in tracks]
+
+"""Measures compiling the file into a Schedule, and getting what is played from it, both up to the first command of
+every track (the time to start playing) and for the whole file, against decoding the file afresh."""
+def BenchmarkSchedule(path, results, repeat=3):
+	directory = tempfile.mkdtemp()
+	try:
+		schedulePath = os.path.join(directory, "schedule")
+		compileTime = BestTime(lambda: CompileSchedule(path, schedulePath), repeat)
+		decoded = DecodeSchedule(path)
+		events = sum([len(commands) + len(notes) for (commands, notes) in decoded])
+		decodeTime = BestTime(lambda: DecodeSchedule(path), repeat)
+		def readAll():
+			schedule = Schedule(schedulePath)
+			played = [(list(schedule.Commands(track)), list(schedule.Notes(track))) for track in schedule.Tracks()]
+			schedule.close()
+			return played
+		assert readAll() == decoded
+		def start():
+			schedule = Schedule(schedulePath)
+			for track in schedule.Tracks():
+				schedule.Commands(track).next()
+			schedule.close()
+		startTime = BestTime(start, repeat)
+		readTime = BestTime(readAll, repeat)
+		size = os.path.getsize(schedulePath)
+	finally:
+		shutil.rmtree(directory)
+	results.Record("CompileSchedule", compileTime, events=events, bytes=size)
+	results.Record("decode for playing", decodeTime, events=events)
+	results.Record("Schedule, first commands", startTime, speedup=decodeTime/startTime)
+	results.Record("Schedule, all commands and notes", readTime, events=events, speedup=decodeTime/readTime)
+
+# each takes (path, results, repeat=3)
+BENCHMARKS = OrderedDict([
+	("decode", BenchmarkDecode),
+	("columnar", BenchmarkColumnar),
+	("cache", BenchmarkCache),
+	("events", BenchmarkEvents),
+	("streaming", BenchmarkStreaming),
+	("parallel", BenchmarkParallelDecode),
+	("seek", BenchmarkSeek),
+	("synth", BenchmarkSynth),
+	("wavetable", BenchmarkWavetable),
+	("mixdown", BenchmarkMixdown),
+	("notecache", BenchmarkNoteCache),
+	("schedule", BenchmarkSchedule),
+])
+
+"""Prints the ratio of the time of each measurement to that of the same measurement in baseline, where
+both report and baseline are as written by --json."""
+def CompareReports(report, baseline):
+	print "compared with the baseline (time / baseline time):"
+	for (name, measurements) in report["files"].items():
+		if name not in baseline["files"]:
+			continue
+		print name
+		for (measurementName, measurement) in measurements.items():
+			if measurementName in baseline["files"][name]:
+				ratio = measurement["seconds"] / baseline["files"][name][measurementName]["seconds"]
+				print "  %-36s x%.2f%s" % (measurementName, ratio, "  slower" if ratio > 1.1 else "")
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmarks the MIDI decoder and synth pipeline.")
+	parser.add_argument("files", nargs="*", help="MIDI files to benchmark (default: the corpus generated by smfgen.py)")
+	parser.add_argument("--only", action="append", choices=BENCHMARKS.keys(), help="run only this benchmark (may be repeated)")
+	parser.add_argument("--repeat", type=int, default=3, help="runs of each measurement, of which the best is taken")
+	parser.add_argument("--seconds", type=int, default=10, help="seconds of audio rendered by the synth benchmark")
+	parser.add_argument("--json", help="write the results to this file")
+	parser.add_argument("--compare", help="compare the results with those written by an earlier --json")
+	args = parser.parse_args()
+	corpusDirectory = None
+	if args.files:
+		files = [(os.path.basename(path), path) for path in args.files]
+	else:
+		corpusDirectory = tempfile.mkdtemp()
+		files = WriteCorpus(corpusDirectory)
+	report = OrderedDict([
+		("python", platform.python_version()),
+		("platform", platform.platform()),
+		("cpus", multiprocessing.cpu_count()),
+		("date", time.strftime("%Y-%m-%d %H:%M:%S")),
+		("files", OrderedDict()),
+	])
+	try:
+		for (name, path) in files:
+			print "%s (%d bytes)" % (name, os.path.getsize(path))
+			results = Results()
+			for (benchmarkName, benchmark) in BENCHMARKS.items():
+				if args.only == None or benchmarkName in args.only:
+					if benchmark in (BenchmarkSynth, BenchmarkWavetable, BenchmarkMixdown, BenchmarkNoteCache):
+						benchmark(path, results, seconds=args.seconds, repeat=args.repeat)
+					else:
+						benchmark(path, results, repeat=args.repeat)
+			report["files"][name] = results.measurements
+	finally:
+		if corpusDirectory != None:
+			shutil.rmtree(corpusDirectory)
+	if args.json:
+		file = open(args.json, "w")
+		json.dump(report, file, indent=1)
+		file.close()
+	if args.compare:
+		file = open(args.compare, "r")
+		CompareReports(report, json.load(file))
+		file.close()
@@ -0,0 +1,367 @@
+#!/usr/bin/python
+
+from audiostream import AudioStream, PipeSink, PortAudioSink
+from mididecode import EncodeVariableLengthNumber, MIDIEvent, PrintEvent
+from pitch import MIN_FREQ, MAX_FREQ, ClosestNote, SyntheticTone
+from polysynth import MIDINoteFrequencyHz, VoiceEngine
+from simplesynth import RenderTrack, WriteBlocksLE16
+from tuner import StreamingTuner, ReadRawBlocks, ReadWAVBlocks
+from wavreader import WAVReader
+from wavetable import SHAPES
+from wavwriter import WAVWriter
+
+import numpy
+
+from array import array
+import argparse, math, struct, sys, time
+
+"""Returns the MIDI velocity for a level of levelDb, in decibels from full scale, scaled between floorDb and 0."""
+def LevelToVelocity(levelDb, floorDb):
+	return max(1, min(127, int(round(127 * (levelDb - floorDb) / -floorDb))))
+
+"""Turns the samples of a guitar, arriving hop samples at a time at sampleRate, into the Note On and Note Off events
+of a monophonic line on channel, as the blocks arrive. A note is plucked (an onset) where the spectrum of the last
+two hops rises from that of the two before (the spectral flux: the mean rise in the log of the magnitude of each
+bin) by onsetFlux, and by fluxRatio times the median of the hops before; or where the level of a hop is onsetDb
+above that of either of the two before. It must be above floorDb, and refractorySeconds after the last onset. The
+tuner is then reset, so that the pitch of the new note isn't confused with the last, and the note is played once
+the tuner has found the same note with minClarity for confirmHops hops running; its velocity is from its level. A note played without being plucked, by
+a hammer-on or a slide, is played once it has been found for changeHops hops. A note is released once its level
+falls releaseDb below its peak or below floorDb, or no pitch is found for releaseHops hops.
+The events are timed at the end of the hop in which they are decided, which is when a synth playing along would
+hear them. The time from each onset to its note being played, and the time taken by each hop, are recorded."""
+class NoteTracker:
+	def __init__(self, sampleRate=44100, hop=256, window=1024, channel=0, minFreq=MIN_FREQ, maxFreq=MAX_FREQ,
+			onsetFlux=0.3, fluxRatio=1.5, onsetDb=9.0, floorDb=-50.0, releaseDb=30.0, minClarity=0.8,
+			confirmHops=2, changeHops=4, releaseHops=8, refractorySeconds=0.08):
+		self.tuner = StreamingTuner(sampleRate, hop, window, minFreq, maxFreq)
+		self.sampleRate = sampleRate
+		self.hop = hop
+		self.channel = channel
+		self.onsetFlux = onsetFlux
+		self.fluxRatio = fluxRatio
+		self.onsetDb = onsetDb
+		self.floorDb = floorDb
+		self.releaseDb = releaseDb
+		self.minClarity = minClarity
+		self.confirmHops = confirmHops
+		self.changeHops = changeHops
+		self.releaseHops = releaseHops
+		# an onset whose note hasn't been found in this many hops is given up on
+		self.maxOnsetHops = max(confirmHops, int(0.1 * sampleRate / hop))
+		self.refractoryHops = int(refractorySeconds * sampleRate / hop)
+		self.position = 0
+		self.levels = [-numpy.inf, -numpy.inf]
+		# the last two hops, windowed, for the rise in the log magnitude of their spectrum from the two before
+		self.frame = numpy.zeros(2 * hop)
+		self.taper = numpy.hanning(2 * hop)
+		self.spectrum = numpy.zeros(hop + 1)
+		self.fluxes = numpy.zeros(8)
+		self.sinceOnset = self.refractoryHops
+		# the note playing, the peak level since it was plucked, and the hops since its pitch was last found
+		self.note = None
+		self.peakDb = -numpy.inf
+		self.lostHops = 0
+		# the onset waiting for its note, if any, and the note found in the latest hops, with the hops it has been
+		self.onsetAt = None
+		self.candidate = None
+		self.candidateHops = 0
+		# instrumentation
+		self.hops = 0
+		self.onsets = 0
+		self.notes = 0
+		self.latencies = []
+		self.totalSeconds = 0.0
+		self.maxSeconds = 0.0
+		self.lastSeconds = 0.0
+
+	def _noteOn(self, events, note, levelDb):
+		self.note = note
+		self.lostHops = 0
+		self.notes += 1
+		events.append((self.position, MIDIEvent(chr(0x90 | self.channel) + chr(note) + chr(LevelToVelocity(levelDb, self.floorDb)))))
+
+	def _noteOff(self, events):
+		if self.note != None:
+			events.append((self.position, MIDIEvent(chr(0x80 | self.channel) + chr(self.note) + chr(64))))
+			self.note = None
+
+	"""Adds block, an array of hop samples between -1 and 1, returning a list of the (sample position, MIDIEvent)
+	tuples decided in it, most often none."""
+	def Process(self, block):
+		start = time.clock()
+		events = []
+		levelDb = 10 * math.log10(numpy.dot(block, block) / len(block) + 1e-20)
+		frame = self.frame
+		frame[:self.hop] = frame[self.hop:]
+		frame[self.hop:] = block
+		spectrum = numpy.log1p(10 * abs(numpy.fft.rfft(frame * self.taper)))
+		flux = numpy.maximum(spectrum - self.spectrum, 0).mean()
+		self.spectrum = spectrum
+		# the flux must also stand out from that of the hops before, which is high while the spectrum is noisy
+		fluxOnset = flux >= self.onsetFlux and flux >= self.fluxRatio * numpy.median(self.fluxes)
+		self.fluxes[self.hops % len(self.fluxes)] = flux
+		self.sinceOnset += 1
+		if levelDb > self.floorDb and self.sinceOnset > self.refractoryHops and (fluxOnset or levelDb - min(self.levels) >= self.onsetDb):
+			self.sinceOnset = 0
+			self.tuner.Reset()
+			self.onsetAt = self.position
+			self.onsets += 1
+			self.peakDb = levelDb
+			self.candidate = None
+		self.levels = [self.levels[1], levelDb]
+		self.peakDb = max(self.peakDb, levelDb)
+		(frequency, clarity) = self.tuner.Process(block)
+		self.position += self.hop
+		note = ClosestNote(frequency)[0] if frequency > 0 and clarity >= self.minClarity else None
+		if note == self.candidate:
+			self.candidateHops += 1
+		else:
+			self.candidate = note
+			self.candidateHops = 1
+		if self.onsetAt != None:
+			if note != None and self.candidateHops >= self.confirmHops:
+				self._noteOff(events)
+				self._noteOn(events, note, self.peakDb)
+				self.latencies.append(self.position - self.onsetAt)
+				self.onsetAt = None
+			elif self.position - self.onsetAt >= self.maxOnsetHops * self.hop:
+				# plucked, but with no pitch: a muted string
+				self._noteOff(events)
+				self.onsetAt = None
+		elif levelDb < self.floorDb or (self.note != None and levelDb < self.peakDb - self.releaseDb):
+			self._noteOff(events)
+		elif note != None and note != self.note and self.candidateHops >= self.changeHops:
+			self._noteOff(events)
+			self._noteOn(events, note, levelDb)
+		elif self.note != None:
+			self.lostHops = 0 if note == self.note else self.lostHops + 1
+			if self.lostHops >= self.releaseHops:
+				self._noteOff(events)
+		self.hops += 1
+		self.lastSeconds = time.clock() - start
+		self.totalSeconds += self.lastSeconds
+		self.maxSeconds = max(self.maxSeconds, self.lastSeconds)
+		return events
+
+	"""Returns the events ending the stream: a Note Off for the note playing, if any, and an End Of Track."""
+	def Flush(self):
+		events = []
+		self._noteOff(events)
+		events.append((self.position, MIDIEvent("\xff\x2f\x00")))
+		return events
+
+	"""Returns a line summarising the notes played, the time from their onsets to their being played, and the time
+	taken by each hop against the time it lasts."""
+	def Report(self):
+		if self.hops == 0:
+			return "nothing processed"
+		hopLength = float(self.hop) / self.sampleRate
+		mean = self.totalSeconds / self.hops
+		latency = "-"
+		if len(self.latencies) > 0:
+			latencies = 1000.0 * numpy.array(self.latencies) / self.sampleRate
+			latency = "%.1f ms on average, max %.1f ms" % (latencies.mean(), latencies.max())
+		return "%d onsets, %d notes; onset to note on %s; %d hops of %.2f ms: %.3f ms/hop on average, max %.3f ms, load %.1f%%" % (
+			self.onsets, self.notes, latency, self.hops, 1000 * hopLength, 1000 * mean, 1000 * self.maxSeconds, 100 * mean / hopLength)
+
+"""Yields the (sample position, MIDIEvent) tuples that tracker, a NoteTracker, finds in blocks, ending with an
+End Of Track, as TrackTimeToSamples does for a track of a MIDI file; so they can be rendered with RenderTrack."""
+def GuitarEvents(blocks, tracker):
+	for block in blocks:
+		for event in tracker.Process(block):
+			yield event
+	for event in tracker.Flush():
+		yield event
+
+"""Plays along with blocks through engine, a VoiceEngine: yields an array of signed 16 bit samples for each block,
+in which the notes that tracker, a NoteTracker, has found up to the end of it are played."""
+def RenderLive(blocks, tracker, engine):
+	for block in blocks:
+		for (at, event) in tracker.Process(block):
+			if event.Type() == MIDIEvent.NOTE_ON:
+				engine.NoteOn(event.Channel(), event.Param1(), event.Param2())
+			else:
+				engine.NoteOff(event.Channel(), event.Param1())
+		samples = array("h")
+		engine.Render(len(block), samples)
+		yield samples
+
+"""Writes the (sample position, MIDIEvent) tuples, as from GuitarEvents, at sampleRate to file as a format 0 Standard
+MIDI File of ticksPerBeat at a tempo of tempo microseconds per quarter note, adding an End Of Track if there
+isn't one. Returns the number of events written."""
+def WriteSMF(timedEvents, file, sampleRate=44100, ticksPerBeat=480, tempo=500000):
+	ticksPerSample = ticksPerBeat * 1000000.0 / (tempo * sampleRate)
+	track = [EncodeVariableLengthNumber(0) + "\xff\x51\x03" + struct.pack(">I", tempo)[1:]]
+	previousTick = 0
+	count = 0
+	ended = False
+	for (at, event) in timedEvents:
+		tick = int(round(at * ticksPerSample))
+		track.append(EncodeVariableLengthNumber(tick - previousTick) + str(event.messageData))
+		previousTick = tick
+		count += 1
+		if event.Type() == MIDIEvent.META_EVENT and event.MetaEventType() == MIDIEvent.END_OF_TRACK:
+			ended = True
+			break
+	if not ended:
+		track.append(EncodeVariableLengthNumber(0) + "\xff\x2f\x00")
+	data = "".join(track)
+	file.write("MThd" + struct.pack(">LHHH", 6, 0, 1, ticksPerBeat) + "MTrk" + struct.pack(">L", len(data)) + data)
+	return count
+
+"""Returns (samples, notes) for a guitar line of count plucked notes between lowest and highest, at sampleRate: each
+held for a random time from minSeconds to maxSeconds at a random level, sometimes repeated, sometimes after a rest,
+with noise at noiseLevel. notes is a list of (start sample, end sample, midiNote)."""
+def SyntheticGuitarLine(count=40, sampleRate=44100, lowest=40, highest=84, minSeconds=0.12, maxSeconds=0.6, noiseLevel=0.01, seed=0):
+	rng = numpy.random.RandomState(seed)
+	parts = [numpy.zeros(int(0.2 * sampleRate))]
+	position = len(parts[0])
+	notes = []
+	note = rng.randint(lowest, highest + 1)
+	for i in xrange(0, count):
+		if rng.random_sample() >= 0.2:
+			note = rng.randint(lowest, highest + 1)
+		if rng.random_sample() < 0.2:
+			rest = numpy.zeros(int(rng.uniform(0.05, 0.3) * sampleRate))
+			parts.append(rest)
+			position += len(rest)
+		tone = rng.uniform(0.2, 1.0) * SyntheticTone(MIDINoteFrequencyHz(note), sampleRate, rng.uniform(minSeconds, maxSeconds), "pluck")
+		parts.append(tone)
+		notes.append((position, position + len(tone), note))
+		position += len(tone)
+	parts.append(numpy.zeros(int(0.2 * sampleRate)))
+	samples = numpy.concatenate(parts)
+	samples += noiseLevel * rng.standard_normal(len(samples))
+	return (samples, notes)
+
+"""Runs tracker, a NoteTracker, over samples, hop by hop, and matches the notes it plays with notes, as from
+SyntheticGuitarLine. Returns a dict of:
+	latencies	milliseconds from the start of each note found to the end of the hop in which it was
+			played, plus the time taken to process that hop
+	found		notes played with the right pitch
+	wrong		notes played with the wrong pitch first
+	missed		notes not played before the next started
+	extra		notes played beyond those"""
+def MeasureLatency(tracker, samples, notes):
+	hop = tracker.hop
+	played = []
+	for start in xrange(0, len(samples) - hop + 1, hop):
+		for (at, event) in tracker.Process(samples[start:start + hop]):
+			if event.Type() == MIDIEvent.NOTE_ON:
+				played.append((at, event.Param1(), tracker.lastSeconds))
+	latencies = []
+	wrong = 0
+	missed = 0
+	matched = 0
+	i = 0
+	for (n, (start, end, note)) in enumerate(notes):
+		nextStart = notes[n + 1][0] if n + 1 < len(notes) else len(samples)
+		while i < len(played) and played[i][0] <= start:
+			i += 1
+		if i == len(played) or played[i][0] > nextStart:
+			missed += 1
+			continue
+		(at, playedNote, seconds) = played[i]
+		matched += 1
+		if playedNote == note:
+			latencies.append(1000.0 * (at - start) / tracker.sampleRate + 1000 * seconds)
+		else:
+			wrong += 1
+	return {"latencies": numpy.array(latencies), "found": len(latencies), "wrong": wrong, "missed": missed, "extra": len(played) - matched}
+
+"""Prints the latency of NoteTrackers made by makeTracker() on synthetic guitar lines of count notes at sampleRate,
+with noise at noiseLevel, for each of the seeds, and the latency over them all."""
+def Benchmark(makeTracker, count, sampleRate=44100, noiseLevel=0.01, seeds=(0, 1, 2)):
+	allLatencies = []
+	for seed in seeds:
+		(samples, notes) = SyntheticGuitarLine(count, sampleRate, noiseLevel=noiseLevel, seed=seed)
+		tracker = makeTracker()
+		result = MeasureLatency(tracker, samples, notes)
+		latencies = result["latencies"]
+		allLatencies.extend(latencies)
+		print "seed %d: %d notes, %d found, %d wrong, %d missed, %d extra; latency %s" % (seed, len(notes), result["found"],
+			result["wrong"], result["missed"], result["extra"],
+			"%.1f ms median, %.1f ms 95%%, %.1f ms max" % (numpy.median(latencies), numpy.percentile(latencies, 95), latencies.max()) if len(latencies) > 0 else "-")
+		print "  %s" % tracker.Report()
+	if len(allLatencies) > 0:
+		print "overall latency %.1f ms on average, %.1f ms 95%%, %.1f ms max" % (numpy.mean(allLatencies), numpy.percentile(allLatencies, 95), max(allLatencies))
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Turns a guitar, played into a live stream of samples, into MIDI notes as they are played.")
+	parser.add_argument("file", nargs="?", help="WAV file standing in for the stream, or - for raw 16 bit little endian mono PCM on stdin")
+	parser.add_argument("--sample-rate", type=int, default=44100, help="sample rate of the raw PCM on stdin")
+	parser.add_argument("--hop", type=int, default=256, help="samples taken at a time")
+	parser.add_argument("--window", type=int, default=1024, help="samples the tuner compares with those a period before")
+	parser.add_argument("--min-freq", type=float, default=MIN_FREQ)
+	parser.add_argument("--max-freq", type=float, default=MAX_FREQ)
+	parser.add_argument("--channel", type=int, default=0, help="MIDI channel of the notes")
+	parser.add_argument("--onset-flux", type=float, default=0.3, help="spectral flux taken as a note being plucked")
+	parser.add_argument("--onset-db", type=float, default=9.0, help="rise in level, in decibels, also taken as a note being plucked")
+	parser.add_argument("--floor-db", type=float, default=-50.0, help="level, in decibels from full scale, below which there is silence")
+	parser.add_argument("--realtime", action="store_true", help="read the WAV file no faster than it would be recorded")
+	parser.add_argument("-o", "--output", default=None, help="write the notes to this Standard MIDI File")
+	parser.add_argument("--wav", default=None, help="render the notes with simplesynth to this WAV file")
+	parser.add_argument("--voices", type=int, default=0, help="with --wav, play up to this many notes at once (default: only the latest, as a square wave)")
+	parser.add_argument("--waveform", default=None, choices=SHAPES, help="with --wav, play the latest note with a band-limited wavetable of this shape")
+	parser.add_argument("--play", default=None, choices=("stdout", "portaudio"), help="play along as the notes are found: as raw 16 bit little endian PCM to stdout, or through PortAudio")
+	parser.add_argument("--benchmark", type=int, default=None, metavar="NOTES", help="measure the latency on synthetic plucked string lines of this many notes")
+	parser.add_argument("--noise", type=float, default=0.01, help="level of the noise added to the lines played by --benchmark")
+	args = parser.parse_args()
+	makeTracker = lambda sampleRate: NoteTracker(sampleRate, args.hop, args.window, args.channel, args.min_freq, args.max_freq,
+		onsetFlux=args.onset_flux, onsetDb=args.onset_db, floorDb=args.floor_db)
+	if args.benchmark != None:
+		try:
+			Benchmark(lambda: makeTracker(args.sample_rate), args.benchmark, args.sample_rate, args.noise)
+		except ValueError, e:
+			parser.error(str(e))
+		sys.exit(0)
+	if args.file == None:
+		parser.error("a WAV file, - or --benchmark is needed")
+	if [args.output, args.wav, args.play].count(None) < 2:
+		parser.error("only one of --output, --wav and --play can be given")
+	if args.waveform and args.voices > 0:
+		parser.error("--waveform can't be used with --voices")
+	if args.waveform and not args.wav:
+		parser.error("--waveform can only be used with --wav")
+	try:
+		if args.file == "-":
+			sampleRate = args.sample_rate
+			blocks = ReadRawBlocks(sys.stdin, args.hop)
+		else:
+			reader = WAVReader(args.file)
+			sampleRate = reader.SampleRate
+			blocks = ReadWAVBlocks(reader, args.hop, args.realtime)
+		tracker = makeTracker(sampleRate)
+	except ValueError, e:
+		parser.error(str(e))
+	# raw samples played to stdout leave only stderr for messages
+	log = sys.stderr if args.play == "stdout" else sys.stdout
+	if args.play:
+		if args.play == "stdout":
+			sink = PipeSink(sys.stdout)
+		else:
+			try:
+				sink = PortAudioSink(sampleRate, args.hop)
+			except (IOError, OSError), e:
+				parser.error(str(e))
+		stream = AudioStream(sink, args.hop, 2, sampleRate)
+		try:
+			stream.Play(RenderLive(blocks, tracker, VoiceEngine(max(1, args.voices), sampleRate)))
+		finally:
+			sink.close()
+		print >>log, stream.Report()
+	elif args.wav:
+		wavFile = WAVWriter(open(args.wav, "wb"), SampleRate=sampleRate)
+		WriteBlocksLE16(RenderTrack(GuitarEvents(blocks, tracker), sampleRate, args.voices, waveform=args.waveform), wavFile)
+		wavFile.close()
+		print >>log, "wrote %s" % args.wav
+	elif args.output:
+		file = open(args.output, "wb")
+		count = WriteSMF(GuitarEvents(blocks, tracker), file, sampleRate)
+		file.close()
+		print >>log, "wrote %d events to %s" % (count, args.output)
+	else:
+		for (at, event) in GuitarEvents(blocks, tracker):
+			PrintEvent(at, event)
+	print >>log, tracker.Report()
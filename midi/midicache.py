@@ -0,0 +1,152 @@
+#!/usr/bin/python
+
+from mididecode import MapFile, FindRiffChunksFromBuffer, DecodeHeaderFromBuffer
+from midicolumns import ColumnarTrack, DecodeTrackColumnar
+
+from array import array
+import hashlib, marshal, os, struct, sys, time
+
+# the columns of a ColumnarTrack, in the order they are stored in a cache file
+COLUMNS = ColumnarTrack.COLUMNS
+# the item size of "L" arrays differs between platforms, so is part of the file signature
+CACHE_MAGIC = "MIDC0001" + struct.pack("B", array("L").itemsize)
+CACHE_SUFFIX = ".midc"
+# a temporary file older than this was left by a writer that died before renaming it into place
+TEMP_EXPIRY_SECONDS = 60*60
+
+"""Returns the default cache directory, following the XDG base directory convention."""
+def DefaultCacheDirectory():
+	base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+	return os.path.join(base, "raspiguitar")
+
+"""A directory of decoded MIDI files, each stored as the header, chunk index and ColumnarTrack columns of
+every track, named by the SHA-1 of the MIDI file contents, so an edited file is never served stale data.
+A hit is loaded with a single read. Least recently used entries are removed to keep the directory within
+maxBytes. Payloads of Meta and SysEx events are not stored; they are read from the MIDI file itself.
+An entry that can't be read (truncated or corrupt) is deleted and the file decoded again."""
+class MIDICache:
+	def __init__(self, directory=None, maxBytes=64*1024*1024):
+		if directory == None:
+			directory = DefaultCacheDirectory()
+		self.directory = directory
+		self.maxBytes = maxBytes
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.discarded = 0
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+	"""Returns (data, hdr, chunkIdx, tracks) for the MIDI file at path, where data is the file as returned
+	by MapFile, hdr and chunkIdx are as from DecodeHeader and FindRiffChunks, and tracks is a ColumnarTrack
+	for each track. Decodes the file and adds it to the cache if it isn't already there."""
+	def Load(self, path):
+		file = open(path, "r")
+		data = MapFile(file)
+		file.close()
+		cachePath = os.path.join(self.directory, hashlib.sha1(data).hexdigest() + CACHE_SUFFIX)
+		loaded = self._read(cachePath, data)
+		if loaded != None:
+			self.hits += 1
+			# the modification time records when an entry was last used, for eviction
+			os.utime(cachePath, None)
+			return loaded
+		if os.path.exists(cachePath):
+			# there is an entry, but it can't be used
+			self.discarded += 1
+			try:
+				os.remove(cachePath)
+			except EnvironmentError:
+				pass
+		self.misses += 1
+		chunkIdx = FindRiffChunksFromBuffer(data)
+		hdr = DecodeHeaderFromBuffer(data, chunkIdx)
+		tracks = [DecodeTrackColumnar(data, chunkIdx, trackNum) for trackNum in xrange(0, len(chunkIdx.get("MTrk", [])))]
+		self._write(cachePath, hdr, chunkIdx, tracks)
+		self.Evict()
+		return (data, hdr, chunkIdx, tracks)
+
+	"""Removes the least recently used entries until the cache is no larger than maxBytes, and any temporary
+	files left by writers that didn't finish."""
+	def Evict(self):
+		entries = []
+		total = 0
+		now = time.time()
+		for name in os.listdir(self.directory):
+			entryPath = os.path.join(self.directory, name)
+			try:
+				st = os.stat(entryPath)
+			except EnvironmentError:
+				# removed by another process since it was listed
+				continue
+			if name.endswith(CACHE_SUFFIX):
+				entries.append((st.st_mtime, st.st_size, entryPath))
+				total += st.st_size
+			elif name.endswith(".tmp") and CACHE_SUFFIX in name and now - st.st_mtime > TEMP_EXPIRY_SECONDS:
+				try:
+					os.remove(entryPath)
+				except EnvironmentError:
+					pass
+		entries.sort()
+		for (mtime, size, entryPath) in entries:
+			if total <= self.maxBytes:
+				break
+			os.remove(entryPath)
+			total -= size
+			self.evictions += 1
+
+	"""Returns the cached (data, hdr, chunkIdx, tracks) from cachePath, or None if it isn't there or isn't usable."""
+	def _read(self, cachePath, data):
+		try:
+			file = open(cachePath, "rb")
+		except EnvironmentError:
+			return None
+		blob = file.read()
+		file.close()
+		if not blob.startswith(CACHE_MAGIC):
+			return None
+		try:
+			offset = len(CACHE_MAGIC)
+			(indexLength,) = struct.unpack_from("<I", blob, offset)
+			offset += 4
+			(hdr, chunkIdx, columnLengths) = marshal.loads(blob[offset:offset + indexLength])
+			offset += indexLength
+			tracks = []
+			for lengths in columnLengths:
+				track = ColumnarTrack(data)
+				if len(lengths) != len(COLUMNS) or len(set(lengths[:5])) != 1 or len(set(lengths[5:])) != 1:
+					return None
+				for (name, length) in zip(COLUMNS, lengths):
+					column = getattr(track, name)
+					size = length * column.itemsize
+					if offset + size > len(blob):
+						return None
+					column.fromstring(blob[offset:offset + size])
+					offset += size
+				tracks.append(track)
+		except (struct.error, EOFError, ValueError, TypeError):
+			# a truncated or corrupt entry
+			return None
+		return (data, hdr, chunkIdx, tracks)
+
+	"""Stores hdr, chunkIdx and the columns of tracks at cachePath."""
+	def _write(self, cachePath, hdr, chunkIdx, tracks):
+		index = marshal.dumps((hdr, chunkIdx, [[len(getattr(track, name)) for name in COLUMNS] for track in tracks]))
+		# write to a temporary file and rename, so that a reader never sees a partly written entry
+		tempPath = "%s.%d.tmp" % (cachePath, os.getpid())
+		file = open(tempPath, "wb")
+		file.write(CACHE_MAGIC)
+		file.write(struct.pack("<I", len(index)))
+		file.write(index)
+		for track in tracks:
+			for name in COLUMNS:
+				file.write(getattr(track, name).tostring())
+		file.close()
+		os.rename(tempPath, cachePath)
+
+if __name__ == "__main__":
+	cache = MIDICache()
+	for path in sys.argv[1:]:
+		(data, hdr, chunkIdx, tracks) = cache.Load(path)
+		print "%s: %d tracks, %d events" % (path, len(tracks), sum([len(track) for track in tracks]))
+	print "%d hits, %d misses, %d evictions, %d unusable entries discarded" % (cache.hits, cache.misses, cache.evictions, cache.discarded)
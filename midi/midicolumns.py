@@ -0,0 +1,240 @@
+#!/usr/bin/python
+
+from mididecode import MIDIEvent, EncodeVariableLengthNumber, ScanTrackFromBuffer, MapFile, FindRiffChunksFromBuffer, DecodeHeaderFromBuffer
+
+from array import array
+from bisect import bisect_left
+from itertools import compress, count, izip
+from operator import itemgetter
+import operator, struct, sys
+
+"""Returns a 256 byte translation table mapping each byte in the selected set onto 1, and all others onto 0.
+Translating a column with this (see ColumnarTrack.Mask) produces a mask for use with itertools.compress."""
+def ByteMaskTable(selected):
+	return "".join([chr(b in selected) for b in xrange(0, 256)])
+
+ALL_CHANNEL_EVENTS = ByteMaskTable(set(xrange(0x80, 0xF0)))
+NOTE_ON_EVENTS = ByteMaskTable(set(xrange(0x90, 0xA0)))
+NOTE_OFF_EVENTS = ByteMaskTable(set(xrange(0x80, 0x90)))
+ZERO_BYTES = ByteMaskTable(set([0]))
+
+"""A track held as parallel packed arrays (columns) rather than a list of (time, MIDIEvent),
+costing 8-12 bytes per event. Row i of the columns describes event i:
+	time[i]		absolute time in ticks
+	status[i]	event type and channel byte, with running status resolved (0xFF for Meta, 0xF0 for SysEx)
+	channel[i]	channel number of a channel event, 0 otherwise
+	data1[i]	first parameter of a channel event, or the meta event type of a Meta event
+	data2[i]	second parameter of a channel event, 0 where there isn't one
+Meta and SysEx payloads are left in the buffer that the track was decoded from. The payload table
+(payloadEvent, payloadOffset, payloadLength) has one row per Meta or SysEx event, in track order, giving
+its event row number and the location of its payload in the buffer."""
+class ColumnarTrack:
+	def __init__(self, data=None):
+		self.data = data
+		self.time = array("L")
+		self.status = array("B")
+		self.channel = array("B")
+		self.data1 = array("B")
+		self.data2 = array("B")
+		self.payloadEvent = array("L")
+		self.payloadOffset = array("L")
+		self.payloadLength = array("L")
+
+	# the names of the columns, in the order Columns() packs them
+	COLUMNS = ("time", "status", "channel", "data1", "data2", "payloadEvent", "payloadOffset", "payloadLength")
+
+	def __len__(self):
+		return len(self.time)
+
+	"""Returns the columns packed as a tuple of strings, in the order of COLUMNS, for sending to another process."""
+	def Columns(self):
+		return tuple([getattr(self, name).tostring() for name in ColumnarTrack.COLUMNS])
+
+	"""Returns a ColumnarTrack over data (which must hold the same file) from the packed strings returned by Columns()."""
+	@staticmethod
+	def FromColumns(data, columns):
+		ret = ColumnarTrack(data)
+		for (name, packed) in izip(ColumnarTrack.COLUMNS, columns):
+			getattr(ret, name).fromstring(packed)
+		return ret
+
+	"""Returns a mask over the rows, 1 where translating the column through table gives 1."""
+	def Mask(self, column, table):
+		return bytearray(column.tostring().translate(table))
+
+	"""Returns a new ColumnarTrack holding only the rows selected by mask. The payload table is carried across."""
+	def Select(self, mask):
+		ret = ColumnarTrack(self.data)
+		ret.time = array("L", compress(self.time, mask))
+		ret.status = array("B", compress(self.status, mask))
+		ret.channel = array("B", compress(self.channel, mask))
+		ret.data1 = array("B", compress(self.data1, mask))
+		ret.data2 = array("B", compress(self.data2, mask))
+		payloadMask = [mask[i] for i in self.payloadEvent]
+		ret.payloadOffset = array("L", compress(self.payloadOffset, payloadMask))
+		ret.payloadLength = array("L", compress(self.payloadLength, payloadMask))
+		# renumber the payload rows to match the selected rows
+		rowNumbers = array("L", compress(xrange(0, len(mask)), mask))
+		ret.payloadEvent = array("L", [bisect_left(rowNumbers, i) for i in compress(self.payloadEvent, payloadMask)])
+		return ret
+
+	"""Returns a new ColumnarTrack holding only the given rows, a sorted sequence of row numbers. The payload table
+	is carried across. Unlike Select, this costs nothing for the rows left out."""
+	def Take(self, rows):
+		ret = ColumnarTrack(self.data)
+		if len(rows) == 0:
+			return ret
+		take = itemgetter(*rows)
+		if len(rows) == 1:
+			# itemgetter of one item returns it rather than a tuple
+			take = lambda column, get=take: (get(column),)
+		ret.time = array("L", take(self.time))
+		ret.status = array("B", take(self.status))
+		ret.channel = array("B", take(self.channel))
+		ret.data1 = array("B", take(self.data1))
+		ret.data2 = array("B", take(self.data2))
+		selected = set(rows)
+		for (row, offset, length) in izip(self.payloadEvent, self.payloadOffset, self.payloadLength):
+			if row in selected:
+				ret.payloadEvent.append(bisect_left(rows, row))
+				ret.payloadOffset.append(offset)
+				ret.payloadLength.append(length)
+		return ret
+
+	"""Returns a mask selecting the channel events on the given channel."""
+	def ChannelMask(self, channel):
+		return self.Mask(self.status, ByteMaskTable(set(xrange(0x80 | channel, 0xF0, 0x10))))
+
+	"""Returns a mask selecting Note On events with a non-zero velocity."""
+	def NoteOnMask(self):
+		noteOn = self.Mask(self.status, NOTE_ON_EVENTS)
+		nonZero = self.Mask(self.data2, ZERO_BYTES)
+		return bytearray(map(operator.gt, noteOn, nonZero))
+
+	"""Returns a mask selecting Note Off events, including Note On events with a velocity of 0."""
+	def NoteOffMask(self):
+		noteOn = self.Mask(self.status, NOTE_ON_EVENTS)
+		zero = self.Mask(self.data2, ZERO_BYTES)
+		return bytearray(map(operator.or_, self.Mask(self.status, NOTE_OFF_EVENTS), map(operator.and_, noteOn, zero)))
+
+	"""Returns a mask selecting Meta events of the given meta event type."""
+	def MetaEventMask(self, metaEventType):
+		isMeta = self.Mask(self.status, ByteMaskTable(set([MIDIEvent.META_EVENT])))
+		isType = self.Mask(self.data1, ByteMaskTable(set([metaEventType])))
+		return bytearray(map(operator.and_, isMeta, isType))
+
+	"""Returns the payload of the Meta or SysEx event in the given row, as a string."""
+	def Payload(self, row):
+		i = bisect_left(self.payloadEvent, row)
+		assert i < len(self.payloadEvent) and self.payloadEvent[i] == row
+		offset = self.payloadOffset[i]
+		return self.data[offset:offset + self.payloadLength[i]]
+
+	"""Returns the row as a MIDIEvent, for passing to code that works on (time, MIDIEvent) lists."""
+	def Event(self, row):
+		status = self.status[row]
+		if status == MIDIEvent.META_EVENT or status == MIDIEvent.SYSEX_EVENT:
+			payload = self.Payload(row)
+			if status == MIDIEvent.META_EVENT:
+				header = chr(status) + chr(self.data1[row])
+			else:
+				header = chr(status)
+			return MIDIEvent(header + EncodeVariableLengthNumber(len(payload)) + payload)
+		elif status >> 4 == 0xC or status >> 4 == 0xD:
+			return MIDIEvent(chr(status) + chr(self.data1[row]))
+		else:
+			return MIDIEvent(chr(status) + chr(self.data1[row]) + chr(self.data2[row]))
+
+	"""Iterates over the rows as (time, MIDIEvent) tuples, as DecodeTrack would have returned them."""
+	def Events(self):
+		row = 0
+		for (time, status, data1, data2) in izip(self.time, self.status, self.data1, self.data2):
+			if status < 0xF0:
+				# channel events are the bulk of a track, so are built here rather than by Event()
+				if status >> 4 == 0xC or status >> 4 == 0xD:
+					yield (time, MIDIEvent(chr(status) + chr(data1)))
+				else:
+					yield (time, MIDIEvent(chr(status) + chr(data1) + chr(data2)))
+			else:
+				yield (time, self.Event(row))
+			row += 1
+
+"""Decodes track trackNum from a buffer returned by MapFile into a ColumnarTrack."""
+def DecodeTrackColumnar(data, chunkIdx, trackNum):
+	ret = ColumnarTrack(data)
+	# bind the appends once, this loop runs for every event
+	appendTime = ret.time.append
+	appendStatus = ret.status.append
+	appendChannel = ret.channel.append
+	appendData1 = ret.data1.append
+	appendData2 = ret.data2.append
+	row = 0
+	for (time, status, start, dataStart, end) in ScanTrackFromBuffer(data, chunkIdx, trackNum):
+		appendTime(time)
+		appendStatus(status)
+		if status >= 0xF0:
+			appendChannel(0)
+			if status == MIDIEvent.META_EVENT:
+				appendData1(ord(data[start + 1]))
+			else:
+				appendData1(0)
+			appendData2(0)
+			ret.payloadEvent.append(row)
+			ret.payloadOffset.append(dataStart)
+			ret.payloadLength.append(end - dataStart)
+		else:
+			appendChannel(status & 0xF)
+			appendData1(ord(data[dataStart]))
+			if end - dataStart == 2:
+				appendData2(ord(data[dataStart + 1]))
+			else:
+				appendData2(0)
+		row += 1
+	return ret
+
+"""As GetTempoChangeEvents, for a ColumnarTrack."""
+def GetTempoChangeEventsColumnar(track):
+	tempo = track.Select(track.MetaEventMask(MIDIEvent.SET_TEMPO))
+	events = []
+	for (row, offset) in izip(tempo.payloadEvent, tempo.payloadOffset):
+		(hi, lo) = struct.unpack(">HB", track.data[offset:offset + 3])
+		events.append((tempo.time[row], (hi<<8) | lo))
+	if events == []:
+		# if no Set Tempo events are present, 120 BPM is assumed
+		events = [(0, 60000000/120)]
+	return events
+
+"""As FilterEventsByChannel, for a ColumnarTrack. Returns a dictionary from channel number onto a ColumnarTrack.
+All channels returned will end with MIDIEvent.END_OF_TRACK."""
+def FilterColumnarByChannel(track):
+	# the End Of Track is found among the few Meta events, rather than by masking every row
+	status = track.status.tostring()
+	end = status.find(chr(MIDIEvent.META_EVENT))
+	while end != -1 and track.data1[end] != MIDIEvent.END_OF_TRACK:
+		end = status.find(chr(MIDIEvent.META_EVENT), end + 1)
+	if end == -1:
+		raise AssertionError("end of track expected")
+	# one pass over the channel column buckets the rows of each channel; events after the end of track are
+	# ignored, as FilterEventsByChannel does
+	rowsByChannel = dict()
+	isChannelEvent = status[:end].translate(ALL_CHANNEL_EVENTS)
+	for (row, channel) in compress(izip(count(), track.channel[:end]), bytearray(isChannelEvent)):
+		if channel in rowsByChannel:
+			rowsByChannel[channel].append(row)
+		else:
+			rowsByChannel[channel] = array("L", [row])
+	ebc = dict()
+	for (channel, rows) in rowsByChannel.items():
+		rows.append(end)
+		ebc[channel] = track.Take(rows)
+	return ebc
+
+if __name__ == "__main__":
+	file=open(sys.argv[1], "r")
+	data = MapFile(file)
+	chunkIdx = FindRiffChunksFromBuffer(data)
+	hdr = DecodeHeaderFromBuffer(data, chunkIdx)
+	for trackNum in xrange(0, hdr["numTracks"]):
+		track = DecodeTrackColumnar(data, chunkIdx, trackNum)
+		print "TRACK %d: %d events, %d note on, %d note off, tempo %s" % (trackNum, len(track), sum(track.NoteOnMask()), sum(track.NoteOffMask()), GetTempoChangeEventsColumnar(track))
+	file.close()
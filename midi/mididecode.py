@@ -1,6 +1,9 @@
 #!/usr/bin/python
 
-import struct, sys
+from array import array
+from bisect import bisect_right
+from itertools import islice
+import argparse, mmap, multiprocessing, struct, sys
 
 def readFully(file, size):
 	ret = ""
@@ -30,11 +33,47 @@ def FindRiffChunks(file):
 		file.seek(length, 1)
 	return chunks
 
+"""Returns the whole of the file as a single read-only buffer, memory mapped where possible,
+otherwise fetched with one bulk read. The *FromBuffer functions decode directly from this,
+and the events they return refer back into it rather than holding their own copies."""
+def MapFile(file):
+	try:
+		return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+	except (AttributeError, EnvironmentError, ValueError):
+		# not a real file (or an empty one) - fall back to reading it all in
+		file.seek(0)
+		return file.read()
+
+"""As FindRiffChunks, but walks the chunk headers of a buffer returned by MapFile."""
+def FindRiffChunksFromBuffer(data):
+	chunks=dict()
+	fileLength = len(data)
+	offset = 0
+	while offset < fileLength:
+		if offset + 8 > fileLength:
+			raise EOFError
+		(type, length) = struct.unpack_from(">4sL", data, offset)
+		offset += 8
+		if type not in chunks:
+			chunks[type] = []
+		chunks[type].append({"offset":offset, "length":length})
+		offset += length
+	return chunks
+
 def DecodeHeader(file, chunkIdx):
 	if len(chunkIdx["MThd"]) != 1 or chunkIdx["MThd"][0]["offset"] != 8 or chunkIdx["MThd"][0]["length"] != 6:
 		raise ValueError("not a MIDI header")
 	file.seek(8)
-	(formatType, numTracks, timeDivision) = struct.unpack(">HHH", readFully(file, 6))
+	return _decodeHeaderFields(struct.unpack(">HHH", readFully(file, 6)))
+
+"""As DecodeHeader, but reads from a buffer returned by MapFile."""
+def DecodeHeaderFromBuffer(data, chunkIdx):
+	if len(chunkIdx["MThd"]) != 1 or chunkIdx["MThd"][0]["offset"] != 8 or chunkIdx["MThd"][0]["length"] != 6:
+		raise ValueError("not a MIDI header")
+	return _decodeHeaderFields(struct.unpack_from(">HHH", data, 8))
+
+def _decodeHeaderFields(fields):
+	(formatType, numTracks, timeDivision) = fields
 	if timeDivision & 0xA000:
 		timeDivision &= 0x7FFF
 		divisionType = "FRAMES_PER_SECOND"
@@ -55,6 +94,29 @@ def ReadVariableLengthNumber(file, appendTo=None):
 			return (ret, appendTo)
 	raise ValueError("largest permitted value is 0xffffffff")
 
+"""As ReadVariableLengthNumber, but reads from data starting at offset.
+Returns (number, offset of the byte following the number)."""
+def ReadVariableLengthNumberFromBuffer(data, offset):
+	ret = 0
+	for i in xrange(0,4):
+		ret <<= 7
+		x = ord(data[offset])
+		offset += 1
+		ret |= x & 0x7F
+		if x & 0x80 == 0:
+			return (ret, offset)
+	raise ValueError("largest permitted value is 0xffffffff")
+
+"""Returns number encoded as a MIDI variable length quantity."""
+def EncodeVariableLengthNumber(number):
+	assert number >= 0 and number <= 0x0FFFFFFF
+	ret = chr(number & 0x7F)
+	number >>= 7
+	while number:
+		ret = chr(0x80 | (number & 0x7F)) + ret
+		number >>= 7
+	return ret
+
 midiEventTypeNames={
 	0x08:"Note Off",
 	0x09:"Note On ",
@@ -84,35 +146,61 @@ metaEventTypeNames={
 
 """Represents a MIDI event message, including Meta and SysEx events, but not including the delta time.
 "Running Events" (where the event type byte is implicit from the previous event), are fully decoded -
-this class always represents a complete message."""
-class MIDIEvent:
+this class always represents a complete message. The fields are decoded once, when the event is
+created, so the accessors below are just lookups; messageData must not be changed afterwards."""
+class MIDIEvent(object):
 	NOTE_OFF = 0x8
 	NOTE_ON = 0x9
 	END_OF_TRACK = 0x2f
 	SET_TEMPO = 0x51
 	META_EVENT = 0xff
 	SYSEX_EVENT = 0xf0
-	
-	def __init__(self):
-		self.messageData = ""
+
+	# no per-event __dict__, there can be hundreds of thousands of these
+	__slots__ = ("messageData", "type", "channel", "param1", "param2", "metaEventType", "dataOffset", "dataLength", "tempo")
+
+	def __init__(self, messageData=""):
+		self.messageData = messageData
+		self.type = None
+		self.channel = None
+		self.param1 = None
+		self.param2 = None
+		self.metaEventType = None
+		self.dataOffset = None
+		self.dataLength = None
+		self.tempo = None
+		if len(messageData) == 0:
+			return
+		status = ord(messageData[0])
+		if status == MIDIEvent.META_EVENT:
+			self.type = status
+			self.metaEventType = ord(messageData[1])
+			(self.dataLength, self.dataOffset) = MIDIEvent._decodeVariableLength(messageData, 2)
+			if self.metaEventType == MIDIEvent.SET_TEMPO:
+				(hi,lo) = struct.unpack(">HB", messageData[-3:])
+				self.tempo = (hi<<8) | lo
+		elif status == MIDIEvent.SYSEX_EVENT:
+			self.type = status
+			(self.dataLength, self.dataOffset) = MIDIEvent._decodeVariableLength(messageData, 1)
+		else:
+			self.type = status >> 4
+			self.channel = status & 0xf
+			self.param1 = ord(messageData[1])
+			if self.type != 0xc and self.type != 0xd:
+				self.param2 = ord(messageData[2])
 
 	"""Returns the event type number. For a channel event this is in the range 0x8-0xe, otherwise this is META_EVENT or SYSEX_EVENT."""
 	def Type(self):
-		(type,) = struct.unpack("B", self.messageData[0])
-		if type == MIDIEvent.META_EVENT or type == MIDIEvent.SYSEX_EVENT:
-			return type
-		else:
-			return type >> 4
+		return self.type
 		
 	"""Returns the event type as a human readable string."""		
 	def TypeName(self):
-		return midiEventTypeNames[self.Type()]
+		return midiEventTypeNames[self.type]
 	
 	"""Returns the meta event type number. Valid only if Type() is META_EVENT."""
 	def MetaEventType(self):
-		assert self.Type() == MIDIEvent.META_EVENT
-		(metaEventType,) = struct.unpack("B", self.messageData[1])
-		return metaEventType
+		assert self.type == MIDIEvent.META_EVENT
+		return self.metaEventType
 	
 	"""Returns the meta event type as a human readable string. Valid only if Type() is META_EVENT."""
 	def MetaEventTypeName(self):
@@ -121,85 +209,83 @@ class MIDIEvent:
 	"""Returns the string associated with a meta event with an ASCII text payload.
 	Valid only if Type() is META_EVENT."""
 	def MetaEventString(self):
-		assert self.Type() == MIDIEvent.META_EVENT
-		if self.MetaEventType() in asciiMetaEventTypes:
-			length = self.MetaDataLength()
-			return self.messageData[-length:]
+		assert self.type == MIDIEvent.META_EVENT
+		if self.metaEventType in asciiMetaEventTypes:
+			return self.messageData[self.dataOffset:self.dataOffset + self.dataLength]
 		else:
 			return None
 	
 	"""Returns the length in bytes of the meta data payload. Valid only if Type() is META_EVENT."""
 	def MetaDataLength(self):
-		assert self.Type() == MIDIEvent.META_EVENT
-		return MIDIEvent._decodeVariableLength(self.messageData[2:])
+		assert self.type == MIDIEvent.META_EVENT
+		return self.dataLength
 	
 	"""Returns the length in bytes of the SysEx message payload. Valid only if Type() is SYSEX_EVENT."""
 	def SysExLength(self):
-		assert self.Type() == MIDIEvent.SYSEX_EVENT
-		return MIDIEvent._decodeVariableLength(self.messageData[1:])
+		assert self.type == MIDIEvent.SYSEX_EVENT
+		return self.dataLength
 
+	"""Decodes the variable length quantity starting at offset in data, returning (value, offset following it)."""
 	@staticmethod
-	def _decodeVariableLength(data):
+	def _decodeVariableLength(data, offset):
 		result = 0
-		for x in data:
-			x = ord(x)
+		while True:
+			x = ord(data[offset])
+			offset += 1
 			result <<= 7
 			result |= x & 0x7f
 			if x & 0x80 == 0:
-				return result
+				return (result, offset)
 	
 	"""Returns the channel number that the event corresponds to. Not valid for META_EVENT or SYSEX_EVENT."""
 	def Channel(self):
-		type = self.Type()
-		assert type >= 0x8 and type <= 0xe
-		return ord(self.messageData[0]) & 0xf
+		assert self.channel != None
+		return self.channel
 
 	"""Returns the first parameter of a channel event."""
 	def Param1(self):
-		type = self.Type()
-		assert type >= 0x8 and type <= 0xe
-		return ord(self.messageData[1])
+		assert self.channel != None
+		return self.param1
 	
 	"""Returns the second parameter of a channel event. This is None for 0xc "Program Change" and 0xd "Channel Aftertouch"."""
 	def Param2(self):
-		type = self.Type()
-		assert type >= 0x8 and type <= 0xe
-		if type == 0xc or type == 0xd:
-			return None
-		else:
-			return ord(self.messageData[2])
+		assert self.channel != None
+		return self.param2
 	
 	"""If this is a Set Tempo Meta Event, return the microseconds per quarter note (== microseconds per beat)."""
 	def MicrosecondsPerQuarterNote(self):
-		assert self.Type() == MIDIEvent.META_EVENT and self.MetaEventType() == MIDIEvent.SET_TEMPO
-		(hi,lo) = struct.unpack(">HB", self.messageData[-3:])
-		return (hi<<8) | lo
+		assert self.tempo != None
+		return self.tempo
 
 """Prints a report of the information returned from DecodeTrack."""
 def PrintTrack(eventList):
 	print "Time\t% 18s  Channel  Param1  Param2" % "Event"
 	for (time, event) in eventList:
-		type = event.Type()
-		if type == MIDIEvent.META_EVENT:
-			if event.MetaEventType() == MIDIEvent.SET_TEMPO:
-				mpqn = event.MicrosecondsPerQuarterNote()
-				bpm = 60000000/mpqn
-				print "%d\tSet Tempo (mpqn=%d bpm=%d)" % (time, mpqn, bpm)
-			else:
-				metaStr = event.MetaEventString()
-				if metaStr != None:
-					print "%d\t%s: %s" % (time, event.MetaEventTypeName(), metaStr)
-				else:
-					print "%d\t%s (%d bytes)" % (time, event.MetaEventTypeName(), event.MetaDataLength())
-		elif type == MIDIEvent.SYSEX_EVENT:
-			print "%d\tSysEx (%d bytes)" % (time, event.SysExLength())
+		PrintEvent(time, event)
+
+"""Prints one line of the report printed by PrintTrack."""
+def PrintEvent(time, event):
+	type = event.Type()
+	if type == MIDIEvent.META_EVENT:
+		if event.MetaEventType() == MIDIEvent.SET_TEMPO:
+			mpqn = event.MicrosecondsPerQuarterNote()
+			bpm = 60000000/mpqn
+			print "%d\tSet Tempo (mpqn=%d bpm=%d)" % (time, mpqn, bpm)
 		else:
-			param2 = event.Param2()
-			if param2 != None:
-				param2 = "% 6d" % param2
+			metaStr = event.MetaEventString()
+			if metaStr != None:
+				print "%d\t%s: %s" % (time, event.MetaEventTypeName(), metaStr)
 			else:
-				param2 = ""
-			print "%d\t% 18s  % 7d  % 6d  %s" % (time, event.TypeName(), event.Channel(), event.Param1(), param2)
+				print "%d\t%s (%d bytes)" % (time, event.MetaEventTypeName(), event.MetaDataLength())
+	elif type == MIDIEvent.SYSEX_EVENT:
+		print "%d\tSysEx (%d bytes)" % (time, event.SysExLength())
+	else:
+		param2 = event.Param2()
+		if param2 != None:
+			param2 = "% 6d" % param2
+		else:
+			param2 = ""
+		print "%d\t% 18s  % 7d  % 6d  %s" % (time, event.TypeName(), event.Channel(), event.Param1(), param2)
 
 """Decodes the track trackNum from the file. Returns a list of (time, MIDIEvent) tuples."""
 def DecodeTrack(file, chunkIdx, trackNum):
@@ -209,32 +295,32 @@ def DecodeTrack(file, chunkIdx, trackNum):
 	events = []
 	time = 0
 	while file.tell() < endOffset:
-		event = MIDIEvent()
+		messageData = ""
 		(deltaTime,discard) = ReadVariableLengthNumber(file, None)
 		time += deltaTime
 		etcByte = readFully(file, 1)
 		(eventTypeAndChannel,) = struct.unpack("B", etcByte)
 		if eventTypeAndChannel == 0xFF:
-			event.messageData += etcByte
+			messageData += etcByte
 			byte = readFully(file, 1) # meta event type
-			event.messageData += byte
-			(metaLength, event.messageData) = ReadVariableLengthNumber(file, event.messageData)
+			messageData += byte
+			(metaLength, messageData) = ReadVariableLengthNumber(file, messageData)
 			metaData = readFully(file, metaLength)
-			event.messageData += metaData
+			messageData += metaData
 		elif eventTypeAndChannel == 0xF0:
 			# SysEx event
-			event.messageData += etcByte
-			(length, event.messageData) = ReadVariableLengthNumber(file, event.messageData)
-			event.messageData += readFully(file, length)
+			messageData += etcByte
+			(length, messageData) = ReadVariableLengthNumber(file, messageData)
+			messageData += readFully(file, length)
 		else:
 			if eventTypeAndChannel >= 0x80:
-				event.messageData += etcByte
+				messageData += etcByte
 				byte = readFully(file, 1)
-				event.messageData += byte
+				messageData += byte
 			else:
 				# "running status" - the event type is the same as the last message
 				# this is actually the first data byte of the new message
-				event.messageData += previousEtcByte + etcByte
+				messageData += previousEtcByte + etcByte
 				etcByte = previousEtcByte
 				(eventTypeAndChannel,) = struct.unpack("B", etcByte)
 			eventType = eventTypeAndChannel >> 4
@@ -242,16 +328,232 @@ def DecodeTrack(file, chunkIdx, trackNum):
 			if eventType != 0x0C and eventType != 0x0D:
 				# 0xC and 0xD have only one byte of data, others have 2
 				byte = readFully(file, 1)
-				event.messageData += byte
+				messageData += byte
 		previousEtcByte = etcByte
-		events.append((time, event))
+		events.append((time, MIDIEvent(messageData)))
 	assert file.tell() == endOffset
 	return events
 
+"""Walks the events of track trackNum in a buffer returned by MapFile, without building any event objects.
+Yields (time, status, messageStart, dataStart, endOffset) for each event, where status is the event type
+and channel byte (with running status resolved), messageStart is the offset of the event in the buffer,
+dataStart the offset of its data bytes (the payload, for Meta and SysEx events) and endOffset the offset
+just past the event. For running status events, which have no status byte of their own, messageStart == dataStart.
+If a checkpoint from a TrackIndex is given, the walk starts from there rather than the start of the track."""
+def ScanTrackFromBuffer(data, chunkIdx, trackNum, checkpoint=None):
+	where = chunkIdx["MTrk"][trackNum]
+	offset = where["offset"]
+	endOffset = offset + where["length"]
+	if endOffset > len(data):
+		raise EOFError
+	time = 0
+	if checkpoint != None:
+		offset = checkpoint["offset"]
+		time = checkpoint["time"]
+		previousEtcByte = checkpoint["status"]
+	while offset < endOffset:
+		deltaTime = ord(data[offset])
+		if deltaTime < 0x80:
+			# most delta times fit in a single byte
+			offset += 1
+		else:
+			(deltaTime, offset) = ReadVariableLengthNumberFromBuffer(data, offset)
+		time += deltaTime
+		start = offset
+		eventTypeAndChannel = ord(data[offset])
+		offset += 1
+		if eventTypeAndChannel == 0xFF:
+			# skip the meta event type byte
+			(metaLength, offset) = ReadVariableLengthNumberFromBuffer(data, offset + 1)
+			dataStart = offset
+			offset += metaLength
+		elif eventTypeAndChannel == 0xF0:
+			# SysEx event
+			(length, offset) = ReadVariableLengthNumberFromBuffer(data, offset)
+			dataStart = offset
+			offset += length
+		else:
+			if eventTypeAndChannel < 0x80:
+				# "running status" - the event type is the same as the last message
+				# this is actually the first data byte of the new message
+				eventTypeAndChannel = previousEtcByte
+				offset -= 1
+			dataStart = offset
+			eventType = eventTypeAndChannel >> 4
+			assert eventType >= 8 and eventType <= 0xe
+			if eventType != 0x0C and eventType != 0x0D:
+				# 0xC and 0xD have only one byte of data, others have 2
+				offset += 2
+			else:
+				offset += 1
+		previousEtcByte = eventTypeAndChannel
+		yield (time, eventTypeAndChannel, start, dataStart, offset)
+	assert offset == endOffset
+
+"""Decodes track trackNum from a buffer returned by MapFile, yielding (time, MIDIEvent) tuples as it goes.
+Only the event being yielded is held in memory, so synthesis can start as soon as the first events are read.
+The messageData of each event is a zero-copy view of the buffer, except for running status events, which
+must have their event type byte restored and so hold a short string of their own."""
+def IterTrack(data, chunkIdx, trackNum):
+	return _eventsFromScan(data, ScanTrackFromBuffer(data, chunkIdx, trackNum))
+
+"""Builds the (time, MIDIEvent) tuples for IterTrack from the output of ScanTrackFromBuffer."""
+def _eventsFromScan(data, scan):
+	for (time, status, start, dataStart, end) in scan:
+		if start == dataStart:
+			yield (time, MIDIEvent(chr(status) + data[start:end]))
+		else:
+			yield (time, MIDIEvent(buffer(data, start, end - start)))
+
+"""A sparse index of a track, allowing it to be decoded from any time without reading the events
+before it. A checkpoint is taken every interval ticks, recording the state of the decoder at that
+point in the track as a dictionary of:
+	offset	the offset in the buffer of the next event
+	time	the time in ticks of the event before it, to which the delta times that follow are added
+	status	the running status
+	notes	a list of (channel, note, velocity) for the notes sounding at that point
+Checkpoints are only taken at the first event of a tick, and are found by the time of that event, kept in
+times, so every event before a checkpoint is before the times it is found for."""
+class TrackIndex:
+	def __init__(self, trackNum, interval):
+		self.trackNum = trackNum
+		self.interval = interval
+		self.times = array("L")
+		self.checkpoints = []
+
+	"""Returns the last checkpoint at or before time, or None if there isn't one."""
+	def Find(self, time):
+		i = bisect_right(self.times, time) - 1
+		if i < 0:
+			return None
+		return self.checkpoints[i]
+
+"""Builds a TrackIndex for track trackNum of a buffer returned by MapFile, with a checkpoint every interval ticks."""
+def IndexTrack(data, chunkIdx, trackNum, interval=480*16):
+	index = TrackIndex(trackNum, interval)
+	previousEnd = chunkIdx["MTrk"][trackNum]["offset"]
+	previousTime = 0
+	previousStatus = None
+	nextCheckpoint = 0
+	sounding = dict()
+	for (time, status, start, dataStart, end) in ScanTrackFromBuffer(data, chunkIdx, trackNum):
+		if time >= nextCheckpoint:
+			# the event before is earlier than nextCheckpoint, so is at an earlier tick than this one
+			index.times.append(time)
+			index.checkpoints.append({"offset":previousEnd, "time":previousTime, "status":previousStatus,
+				"notes":[(channel, note, velocity) for ((channel, note), velocity) in sorted(sounding.items())]})
+			nextCheckpoint = (time/interval + 1) * interval
+		eventType = status >> 4
+		if eventType == MIDIEvent.NOTE_ON or eventType == MIDIEvent.NOTE_OFF:
+			key = (status & 0xF, ord(data[dataStart]))
+			velocity = ord(data[dataStart + 1])
+			if eventType == MIDIEvent.NOTE_ON and velocity != 0:
+				sounding[key] = velocity
+			elif key in sounding:
+				del sounding[key]
+		previousEnd = end
+		previousTime = time
+		previousStatus = status
+	return index
+
+"""As IterTrack, but yields only the events at or after startTime, using the checkpoints of index to
+avoid decoding the events before it. Notes that are still sounding at startTime are yielded first,
+as Note On events at startTime. Other state, such as program changes and controllers, is not restored."""
+def IterTrackFrom(data, chunkIdx, index, startTime):
+	checkpoint = index.Find(startTime)
+	sounding = dict()
+	if checkpoint != None:
+		for (channel, note, velocity) in checkpoint["notes"]:
+			sounding[(channel, note)] = velocity
+	events = _eventsFromScan(data, ScanTrackFromBuffer(data, chunkIdx, index.trackNum, checkpoint))
+	for (time, event) in events:
+		if time >= startTime:
+			break
+		# between the checkpoint and startTime only the sounding notes need following
+		type = event.Type()
+		if type == MIDIEvent.NOTE_ON and event.Param2() != 0:
+			sounding[(event.Channel(), event.Param1())] = event.Param2()
+		elif type == MIDIEvent.NOTE_ON or type == MIDIEvent.NOTE_OFF:
+			sounding.pop((event.Channel(), event.Param1()), None)
+	else:
+		# the track ends before startTime
+		return
+	for ((channel, note), velocity) in sorted(sounding.items()):
+		yield (startTime, MIDIEvent(chr(0x90 | channel) + chr(note) + chr(velocity)))
+	yield (time, event)
+	for (time, event) in events:
+		yield (time, event)
+
+"""As DecodeTrack, but decodes from a buffer returned by MapFile. See IterTrack."""
+def DecodeTrackFromBuffer(data, chunkIdx, trackNum):
+	return list(IterTrack(data, chunkIdx, trackNum))
+
+"""Decodes every track of the MIDI file at path, returning a list with a midicolumns.ColumnarTrack for each track,
+in track order (ColumnarTrack.Events() gives the (time, MIDIEvent) tuples). The tracks are decoded in parallel by
+a pool of worker processes (by default, one per CPU), which send back the packed columns; this process only
+attaches them to its own mapping of the file, so none of the per-event work is done here."""
+def DecodeAllTracks(path, workers=None):
+	from midicolumns import ColumnarTrack, DecodeTrackColumnar
+	file = open(path, "r")
+	data = MapFile(file)
+	file.close()
+	chunkIdx = FindRiffChunksFromBuffer(data)
+	numTracks = len(chunkIdx.get("MTrk", []))
+	if workers == None:
+		workers = multiprocessing.cpu_count()
+	if workers <= 1 or numTracks <= 1:
+		return [DecodeTrackColumnar(data, chunkIdx, trackNum) for trackNum in xrange(0, numTracks)]
+	pool = multiprocessing.Pool(min(workers, numTracks))
+	try:
+		columns = pool.map(_decodeTrackToColumns, [(path, trackNum) for trackNum in xrange(0, numTracks)], 1)
+	finally:
+		pool.close()
+		pool.join()
+	return [ColumnarTrack.FromColumns(data, trackColumns) for trackColumns in columns]
+
+"""Worker for DecodeAllTracks. Decodes one track into a ColumnarTrack, returning its columns packed as strings,
+which are much cheaper to send back to the parent process than the events themselves."""
+def _decodeTrackToColumns(job):
+	from midicolumns import DecodeTrackColumnar
+	(path, trackNum) = job
+	file = open(path, "r")
+	data = MapFile(file)
+	file.close()
+	return DecodeTrackColumnar(data, FindRiffChunksFromBuffer(data), trackNum).Columns()
+
+"""Returns the sorted list of channel numbers used by channel events in track trackNum of a buffer returned by MapFile,
+without decoding the events."""
+def FindTrackChannels(data, chunkIdx, trackNum):
+	channels = set()
+	for (time, status, start, dataStart, end) in ScanTrackFromBuffer(data, chunkIdx, trackNum):
+		if status < 0xF0:
+			channels.add(status & 0xF)
+		elif status == MIDIEvent.META_EVENT and ord(data[start + 1]) == MIDIEvent.END_OF_TRACK:
+			break
+	return sorted(channels)
+
 """Filters the track for tempo change events, returning a list of (time, microsecondsPerQuarterNote).
 If there is no tempo recorded in the track, returns a setting of 120 BPM from stream start."""
 def GetTempoChangeEvents(events):
-	events = [(time, event.MicrosecondsPerQuarterNote()) for (time, event) in events if event.Type() == MIDIEvent.META_EVENT and event.MetaEventType() == MIDIEvent.SET_TEMPO]
+	return list(IterTempoChangeEvents(events))
+
+"""As GetTempoChangeEvents, but yields the tempo changes as they are found in events, which may be an iterator."""
+def IterTempoChangeEvents(events):
+	found = False
+	for (time, event) in events:
+		if event.Type() == MIDIEvent.META_EVENT and event.MetaEventType() == MIDIEvent.SET_TEMPO:
+			found = True
+			yield (time, event.MicrosecondsPerQuarterNote())
+	if not found:
+		# if no Set Tempo events are present, 120 BPM is assumed
+		yield (0, 60000000/120)
+
+"""As GetTempoChangeEvents, for track trackNum of a buffer returned by MapFile. Only the Set Tempo events are decoded,
+which makes this much quicker than decoding the whole track when only the tempo is needed."""
+def GetTempoChangeEventsFromBuffer(data, chunkIdx, trackNum):
+	events = [(time, MIDIEvent(buffer(data, start, end - start)).MicrosecondsPerQuarterNote())
+		for (time, status, start, dataStart, end) in ScanTrackFromBuffer(data, chunkIdx, trackNum)
+		if status == MIDIEvent.META_EVENT and ord(data[start + 1]) == MIDIEvent.SET_TEMPO]
 	if events == []:
 		# if no Set Tempo events are present, 120 BPM is assumed
 		events = [(0, 60000000/120)]
@@ -274,15 +576,89 @@ def FilterEventsByChannel(events):
 			return ebc
 	raise AssertionError("end of track expected")
 
+"""As FilterEventsByChannel, but yields just the (time, event) tuples for the one channel, ending
+with MIDIEvent.END_OF_TRACK, as they are found in events, which may be an iterator."""
+def IterChannelEvents(events, channel):
+	for (time, event) in events:
+		type = event.Type()
+		if type >= 0x8 and type <= 0xe:
+			if event.Channel() == channel:
+				yield (time, event)
+		elif type == MIDIEvent.META_EVENT and event.MetaEventType() == MIDIEvent.END_OF_TRACK:
+			yield (time, event)
+			return
+	raise AssertionError("end of track expected")
+
+"""Checks that IterTrackFrom, seeking with a TrackIndex of each track of a buffer returned by MapFile, yields the
+same events as decoding the track from the start, at the time of each checkpoint and the ticks either side of it:
+a Note On for each note still sounding, then the next window events of the track. Prints any that differ and
+returns whether all matched."""
+def CheckSeek(data, chunkIdx, interval=480*16, window=64):
+	ok = True
+	for trackNum in xrange(0, len(chunkIdx["MTrk"])):
+		index = IndexTrack(data, chunkIdx, trackNum, interval)
+		startTimes = set(index.times)
+		for checkpoint in index.checkpoints:
+			startTimes.update([max(0, checkpoint["time"] + step) for step in (-1, 0, 1)])
+		events = [(time, str(event.messageData)) for (time, event) in IterTrack(data, chunkIdx, trackNum)]
+		# the notes sounding before each start time are followed in one pass through the events
+		sounding = set()
+		i = 0
+		for startTime in sorted(startTimes):
+			while i < len(events) and events[i][0] < startTime:
+				messageData = events[i][1]
+				eventType = ord(messageData[0]) >> 4
+				if eventType == MIDIEvent.NOTE_ON and ord(messageData[2]) != 0:
+					sounding.add((ord(messageData[0]) & 0xF, ord(messageData[1])))
+				elif eventType == MIDIEvent.NOTE_ON or eventType == MIDIEvent.NOTE_OFF:
+					sounding.discard((ord(messageData[0]) & 0xF, ord(messageData[1])))
+				i += 1
+			seeked = [(time, str(event.messageData)) for (time, event) in islice(IterTrackFrom(data, chunkIdx, index, startTime), len(sounding) + window)]
+			if [time for (time, messageData) in seeked[:len(sounding)]] != [startTime] * len(sounding) or seeked[len(sounding):] != events[i:i + window]:
+				print "track %d: wrong events seeking to %d" % (trackNum, startTime)
+				ok = False
+	return ok
+
 if __name__ == "__main__":
-	file=open(sys.argv[1], "r")
-	chunkIdx = FindRiffChunks(file)
-	hdr = DecodeHeader(file, chunkIdx)
+	parser = argparse.ArgumentParser(description="Prints the events of a MIDI file.")
+	parser.add_argument("file")
+	parser.add_argument("-j", "--workers", type=int, default=None, help="number of processes to decode tracks with (default: one per CPU)")
+	parser.add_argument("--profile", action="store_true", help="print the time taken by each stage to stderr")
+	parser.add_argument("--profile-json", metavar="FILE", help="with --profile, also write the times to this file as JSON")
+	parser.add_argument("--check", action="store_true", help="instead, check that seeking with a TrackIndex yields the same events as decoding from the start")
+	args = parser.parse_args()
+	if args.check:
+		file = open(args.file, "r")
+		data = MapFile(file)
+		file.close()
+		ok = CheckSeek(data, FindRiffChunksFromBuffer(data))
+		print "check %s" % ("passed" if ok else "FAILED")
+		sys.exit(0 if ok else 1)
+	if args.profile:
+		from profiler import Profiler
+		profiler = Profiler()
+		sys.stdout = profiler.File("print (output)", sys.stdout)
+		measure = profiler.Measure
+	else:
+		measure = lambda name, fn, *args, **counts: fn(*args)
+	file=open(args.file, "r")
+	data = measure("MapFile", MapFile, file)
+	chunkIdx = measure("FindRiffChunks", FindRiffChunksFromBuffer, data)
+	hdr = measure("DecodeHeader", DecodeHeaderFromBuffer, data, chunkIdx)
 	print hdr
 	if hdr["numTracks"] != len(chunkIdx["MTrk"]):
 		raise ValueError("track count mismatch")
-	for trackNum in xrange(0, hdr["numTracks"]):
+	tracks = measure("DecodeAllTracks", DecodeAllTracks, args.file, args.workers)
+	for (trackNum, track) in enumerate(tracks):
 		print "TRACK %d" % trackNum
-		PrintTrack(DecodeTrack(file, chunkIdx, trackNum))
+		events = measure("Events", list, track.Events(), events=len(track))
+		if args.profile:
+			profiler.stages["DecodeAllTracks"]["events"] += len(events)
+		measure("PrintTrack", PrintTrack, events, events=len(events))
 	
 	file.close()
+	if args.profile:
+		sys.stdout = sys.__stdout__
+		profiler.Print()
+		if args.profile_json:
+			profiler.WriteJSON(args.profile_json)
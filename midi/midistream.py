@@ -0,0 +1,233 @@
+#!/usr/bin/python
+
+from mididecode import MapFile, FindRiffChunksFromBuffer, DecodeHeaderFromBuffer, DecodeTrackFromBuffer, MIDIEvent, EncodeVariableLengthNumber, PrintEvent
+
+import argparse, os, random, select, sys, threading, time, tty
+
+# number of data bytes following each channel event status byte, by event type (the high nibble)
+channelDataLengths = [0]*8 + [2, 2, 2, 2, 1, 1, 2, 0]
+# and following each System Common status byte; 0xF4 and 0xF5 are undefined, 0xF0 and 0xF7 delimit SysEx
+systemCommonDataLengths = {0xF1:1, 0xF2:2, 0xF3:1, 0xF6:0}
+
+"""Decodes MIDI as it is sent down the wire, from a serial port, pipe or socket, rather than from a file.
+Bytes are passed to Feed in chunks of any size as they arrive, and complete messages are returned as
+(time, MIDIEvent) tuples, where time is the time in milliseconds at which the chunk that completed the
+message arrived. A message may be split across chunks, including SysEx messages of any length.
+Running status is resolved, so every event holds its own status byte, as do those decoded from a file.
+SysEx messages are returned in the form they take in a file: 0xF0, the length of the rest of the message,
+then the message, ending with 0xF7.
+System Real Time messages (such as MIDI Clock) may appear anywhere, even in the middle of another message,
+and System Common messages cancel running status. Neither can be represented by a MIDIEvent, so they are
+passed to onSystemMessage(time, messageData), if given, and are otherwise dropped. Data bytes with no
+status to belong to (such as at the start of a stream joined part way through) are dropped and counted
+in droppedBytes. If no clock is given, times are from when the parser was created."""
+class MIDIStreamParser:
+	def __init__(self, onSystemMessage=None, clock=None):
+		self.onSystemMessage = onSystemMessage
+		if clock == None:
+			# bound now, so the clock doesn't depend on what the name time refers to later
+			now = time.time
+			startTime = now()
+			clock = lambda: 1000.0*(now() - startTime)
+		self.clock = clock
+		# the status byte of the message being received, and the running status once it is complete
+		self.status = None
+		self.data = []
+		self.dataRemaining = 0
+		# the bytes of a SysEx message being received, or None
+		self.sysex = None
+		self.droppedBytes = 0
+
+	"""Decodes a chunk of bytes, returning a list of (time, MIDIEvent) for the messages completed by it.
+	time defaults to the current time of the clock."""
+	def Feed(self, chunk, time=None):
+		if time == None:
+			time = self.clock()
+		events = []
+		# the state is kept in locals while decoding, as attribute lookups would cost more than the rest
+		status = self.status
+		data = self.data
+		dataRemaining = self.dataRemaining
+		sysex = self.sysex
+		for byte in bytearray(chunk):
+			if byte < 0x80:
+				if dataRemaining > 0:
+					data.append(byte)
+					dataRemaining -= 1
+					if dataRemaining == 0:
+						if status < 0xF0:
+							if len(data) == 2:
+								events.append((time, MIDIEvent("%c%c%c" % (status, data[0], data[1]))))
+							else:
+								events.append((time, MIDIEvent("%c%c" % (status, data[0]))))
+							# running status: the next data byte starts another message of the same type
+							data = []
+							dataRemaining = channelDataLengths[status >> 4]
+						else:
+							self._systemMessage(time, chr(status) + str(bytearray(data)))
+							status = None
+							data = []
+				elif sysex != None:
+					sysex.append(byte)
+				else:
+					self.droppedBytes += 1
+			elif byte >= 0xF8:
+				# System Real Time, which doesn't affect anything else in progress
+				self._systemMessage(time, chr(byte))
+			else:
+				if sysex != None:
+					# any status byte ends a SysEx message, though it should be 0xF7
+					sysex.append(0xF7)
+					events.append((time, MIDIEvent("\xF0" + EncodeVariableLengthNumber(len(sysex)) + str(sysex))))
+					sysex = None
+				if data:
+					# the previous message was cut short
+					self.droppedBytes += len(data)
+				data = []
+				if byte < 0xF0:
+					status = byte
+					dataRemaining = channelDataLengths[status >> 4]
+				else:
+					# System Common and SysEx cancel running status
+					status = None
+					dataRemaining = 0
+					if byte == 0xF0:
+						sysex = bytearray()
+					elif byte in systemCommonDataLengths:
+						dataRemaining = systemCommonDataLengths[byte]
+						if dataRemaining == 0:
+							self._systemMessage(time, chr(byte))
+						else:
+							status = byte
+		self.status = status
+		self.data = data
+		self.dataRemaining = dataRemaining
+		self.sysex = sysex
+		return events
+
+	def _systemMessage(self, time, messageData):
+		if self.onSystemMessage != None:
+			self.onSystemMessage(time, messageData)
+
+"""Reads from the file descriptor fd, passing whatever arrives to parser, and yields the (time, MIDIEvent)
+tuples decoded until the end of the input, or for ever from a serial port. Each read is timestamped as soon
+as it returns, so a message is timed to within the time it takes to arrive."""
+def IterStreamEvents(fd, parser, readSize=4096):
+	while True:
+		chunk = os.read(fd, readSize)
+		if chunk == "":
+			return
+		for event in parser.Feed(chunk):
+			yield event
+
+"""Returns the channel and SysEx events of a (time, MIDIEvent) list as they would be sent down the wire,
+using running status. Meta events are not sent."""
+def EncodeWireBytes(events):
+	wire = []
+	runningStatus = None
+	for (time, event) in events:
+		messageData = str(event.messageData)
+		type = event.Type()
+		if type == MIDIEvent.SYSEX_EVENT:
+			wire.append("\xF0" + messageData[event.dataOffset:event.dataOffset + event.dataLength])
+			runningStatus = None
+		elif type != MIDIEvent.META_EVENT:
+			if messageData[0] == runningStatus:
+				wire.append(messageData[1:])
+			else:
+				wire.append(messageData)
+				runningStatus = messageData[0]
+	return "".join(wire)
+
+"""Plays the tracks of the MIDI file at path down a pseudo terminal, as they would arrive from a serial port,
+in chunks of random sizes with MIDI Clock bytes scattered through them, and checks that MIDIStreamParser
+decodes the same events as the file decoder. Prints the time taken to decode each byte."""
+def CheckAgainstFile(path, seed=0):
+	file = open(path, "r")
+	data = MapFile(file)
+	file.close()
+	chunkIdx = FindRiffChunksFromBuffer(data)
+	hdr = DecodeHeaderFromBuffer(data, chunkIdx)
+	expected = []
+	wire = []
+	for trackNum in xrange(0, hdr["numTracks"]):
+		events = DecodeTrackFromBuffer(data, chunkIdx, trackNum)
+		expected.extend([str(event.messageData) for (t, event) in events if event.Type() != MIDIEvent.META_EVENT])
+		wire.append(EncodeWireBytes(events))
+	wire = "".join(wire)
+	rng = random.Random(seed)
+	(master, slave) = os.openpty()
+	tty.setraw(slave)
+	def send():
+		offset = 0
+		while offset < len(wire):
+			size = rng.randint(1, 64)
+			os.write(master, wire[offset:offset + size] + "\xF8" * rng.randint(0, 1))
+			offset += size
+	sender = threading.Thread(target=send)
+	sender.daemon = True
+	sender.start()
+	clocks = []
+	parser = MIDIStreamParser(onSystemMessage=lambda time, messageData: clocks.append(messageData))
+	received = []
+	wireBytes = 0
+	parseTime = 0
+	while len(received) < len(expected):
+		(readable, writable, exceptional) = select.select([slave], [], [], 5)
+		if not readable:
+			raise AssertionError("timed out after %d of %d events" % (len(received), len(expected)))
+		chunk = os.read(slave, 4096)
+		wireBytes += len(chunk)
+		start = time.time()
+		received.extend([str(event.messageData) for (t, event) in parser.Feed(chunk)])
+		parseTime += time.time() - start
+	sender.join()
+	os.close(master)
+	os.close(slave)
+	assert received == expected
+	assert parser.droppedBytes == 0
+	print "%d events, %d bytes (%d clocks): %.2f us/byte" % (len(received), wireBytes, len(clocks), 1e6*parseTime/wireBytes)
+	CheckPipe(wire, len(expected))
+
+"""Runs this script on a pipe, as it would be run on the output of another program, writing wire to it in
+several chunks with pauses between them so that each arrives in a separate read, timed by the default clock.
+Checks that it prints a line for each of the count events and exits cleanly."""
+def CheckPipe(wire, count, chunks=4, pause=0.05):
+	import subprocess
+	process = subprocess.Popen([sys.executable, os.path.abspath(__file__)], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	size = len(wire)/chunks + 1
+	try:
+		for offset in xrange(0, len(wire), size):
+			process.stdin.write(wire[offset:offset + size])
+			process.stdin.flush()
+			time.sleep(pause)
+		process.stdin.close()
+	except IOError:
+		# it has exited early, which is reported below
+		pass
+	output = process.stdout.read()
+	errors = process.stderr.read()
+	if process.wait() != 0:
+		raise AssertionError("reading from a pipe failed:\n" + errors)
+	lines = output.splitlines()
+	assert len(lines) == 1 + count, (len(lines), count)
+	print "%d events from a pipe in %d chunks" % (count, chunks)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Prints the MIDI messages arriving at a serial port (or any other file, such as a pipe).")
+	parser.add_argument("device", nargs="?", help="device to read from (default: standard input)")
+	parser.add_argument("--check", metavar="FILE", help="instead, play the MIDI file through a pseudo terminal and this script through a pipe, and check it decodes the same as from the file")
+	args = parser.parse_args()
+	if args.check:
+		CheckAgainstFile(args.check)
+	else:
+		if args.device:
+			# the baud rate is set with baud_hack
+			fd = os.open(args.device, os.O_RDONLY | os.O_NOCTTY)
+		else:
+			fd = sys.stdin.fileno()
+		if os.isatty(fd):
+			tty.setraw(fd)
+		print "Time\t% 18s  Channel  Param1  Param2" % "Event"
+		for (at, event) in IterStreamEvents(fd, MIDIStreamParser()):
+			PrintEvent(at, event)
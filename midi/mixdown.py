@@ -0,0 +1,152 @@
+#!/usr/bin/python
+
+from mididecode import MapFile, FindRiffChunksFromBuffer, DecodeHeaderFromBuffer, IterTrack, IterTrackFrom, IndexTrack, GetTempoChangeEventsFromBuffer, IterChannelEvents, FindTrackChannels
+from simplesynth import RenderTrack, TrackTimeToSamples, WriteBlocksLE16
+from tempomap import TempoMap
+
+from array import array
+from itertools import imap, izip
+import audioop, math, multiprocessing, os, shutil, tempfile
+
+# the mix is held as 32 bit samples in fixed point with MIX_BITS fractional bits, which leaves room for the sum
+# of 48 tracks at full scale with a gain of +12 dB before it saturates
+MIX_BITS = 8
+# samples mixed at a time
+MIX_CHUNK = 64*1024
+
+"""Returns the tracks that are synthesised from the MIDI file at path: the channels of a format 0 file,
+or tracks 1 on of any other."""
+def SynthesisedTracks(path):
+	file = open(path, "r")
+	data = MapFile(file)
+	file.close()
+	chunkIdx = FindRiffChunksFromBuffer(data)
+	hdr = DecodeHeaderFromBuffer(data, chunkIdx)
+	if hdr["formatType"] == 0:
+		return list(FindTrackChannels(data, chunkIdx, 0))
+	return range(1, hdr["numTracks"])
+
+"""Worker for MixTracks. Renders one track (or channel, for a format 0 file) as simplesynth would, to a
+file of raw native 16 bit samples in directory, returning its path."""
+def _renderTrackToFile(job):
+	(path, track, directory, startTick, maxSamples, options) = job
+	file = open(path, "r")
+	data = MapFile(file)
+	file.close()
+	chunkIdx = FindRiffChunksFromBuffer(data)
+	hdr = DecodeHeaderFromBuffer(data, chunkIdx)
+	tempoMap = TempoMap(hdr, GetTempoChangeEventsFromBuffer(data, chunkIdx, 0))
+	trackNum = 0 if hdr["formatType"] == 0 else track
+	if startTick != 0:
+		events = IterTrackFrom(data, chunkIdx, IndexTrack(data, chunkIdx, trackNum), startTick)
+	else:
+		events = IterTrack(data, chunkIdx, trackNum)
+	if hdr["formatType"] == 0:
+		events = IterChannelEvents(events, track)
+	sampleRate = options.get("sampleRate", 44100)
+	timedEvents = TrackTimeToSamples(hdr, events, tempoMap, sampleRate, tempoMap.TickToSample(startTick, sampleRate))
+	trackPath = os.path.join(directory, "%d.raw" % track)
+	out = open(trackPath, "wb")
+	samples = 0
+	for block in RenderTrack(timedEvents, **options):
+		if maxSamples != None and samples + len(block) >= maxSamples:
+			block[maxSamples - samples:] = array("h")
+			block.tofile(out)
+			break
+		block.tofile(out)
+		samples += len(block)
+	out.close()
+	return trackPath
+
+"""Adds the track in the file of raw native 16 bit samples at trackPath, times gain, to the mix, an open file
+of native 32 bit samples with MIX_BITS fractional bits, lengthening the mix where the track is longer. Records
+the peak of each MIX_CHUNK of the mix in peaks, a list indexed by chunk, so that the peak of the whole mix is
+known once the last track is added."""
+def _addToMix(mix, trackPath, gain, peaks):
+	# lin2lin widens a sample to 32 bits with 16 fractional bits, so the gain also brings it down to MIX_BITS
+	factor = gain * math.pow(2, MIX_BITS - 16)
+	track = open(trackPath, "rb")
+	mix.seek(0)
+	chunk = 0
+	while True:
+		samples = track.read(2 * MIX_CHUNK)
+		if samples == "":
+			break
+		scaled = audioop.mul(audioop.lin2lin(samples, 2, 4), 4, factor)
+		position = mix.tell()
+		mixed = mix.read(len(scaled))
+		if len(mixed) < len(scaled):
+			mixed += "\0" * (len(scaled) - len(mixed))
+		mixed = audioop.add(mixed, scaled, 4)
+		mix.seek(position)
+		mix.write(mixed)
+		if chunk < len(peaks):
+			peaks[chunk] = audioop.max(mixed, 4)
+		else:
+			peaks.append(audioop.max(mixed, 4))
+		chunk += 1
+	track.close()
+
+"""Renders the tracks (or channels, for a format 0 file) of the MIDI file at path, or those listed in tracks, in a
+pool of worker processes (by default, one per CPU), and writes the sum of them as a single track to out, a
+WAVWriter. Each track is scaled by its gain in decibels in trackGainsDb (by default 0). If normalize is set, the
+mix is scaled so that its peak is headroomDb below full scale; otherwise it is reduced by headroomDb and any sample
+beyond full scale is clipped. Each track is added to the mix as soon as it is rendered, in track order, and its
+file deleted, so only the tracks being rendered are held on disk besides the mix; the sum is in integer arithmetic,
+so the output is exactly the same whatever the number of workers. The peak is known once the last track is added,
+so the gain is applied as the mix is written out. renderOptions are passed to RenderTrack, and maxSamples limits
+the length of every track. Returns a dict of the peak of the mix before scaling (as a fraction of full scale), the
+gain applied to it in decibels, and the number of samples clipped."""
+def MixTracks(path, out, tracks=None, trackGainsDb=dict(), headroomDb=1.0, normalize=True, workers=None, startTick=0, maxSamples=None, **renderOptions):
+	if tracks == None:
+		tracks = SynthesisedTracks(path)
+	if workers == None:
+		workers = multiprocessing.cpu_count()
+	directory = tempfile.mkdtemp()
+	pool = None
+	try:
+		jobs = [(path, track, directory, startTick, maxSamples, renderOptions) for track in tracks]
+		if workers <= 1 or len(tracks) <= 1:
+			trackPaths = imap(_renderTrackToFile, jobs)
+		else:
+			pool = multiprocessing.Pool(min(workers, len(tracks)))
+			trackPaths = pool.imap(_renderTrackToFile, jobs, 1)
+		mix = open(os.path.join(directory, "mix.raw"), "w+b")
+		peaks = []
+		for (track, trackPath) in izip(tracks, trackPaths):
+			_addToMix(mix, trackPath, math.pow(10, trackGainsDb.get(track, 0.0) / 20), peaks)
+			os.remove(trackPath)
+		if pool != None:
+			pool.close()
+			pool.join()
+			pool = None
+		peak = max(peaks + [0])
+		attenuation = math.pow(10, -headroomDb / 20)
+		if normalize:
+			scale = 0x7fff * attenuation * (1 << MIX_BITS) / peak if peak > 0 else 0
+		else:
+			scale = attenuation
+		# scaled to 16 fractional bits, a sample saturates at the 32 bit limits just as its top 16 bits reach full scale
+		factor = scale * (1 << (16 - MIX_BITS))
+		clipped = 0
+		mix.seek(0)
+		while True:
+			mixed = mix.read(4 * MIX_CHUNK)
+			if mixed == "":
+				break
+			scaled = audioop.mul(mixed, 4, factor)
+			if audioop.max(scaled, 4) >= 0x7fff0000:
+				# only a chunk that reaches full scale is counted sample by sample
+				clipped += len([x for x in array("i", mixed) if not -0x80000000 <= math.floor(x * factor) <= 0x7fffffff])
+			WriteBlocksLE16([array("h", audioop.lin2lin(scaled, 4, 2))], out)
+		mix.close()
+	finally:
+		if pool != None:
+			pool.terminate()
+			pool.join()
+		shutil.rmtree(directory)
+	return {
+		"peak": float(peak) / (0x7fff << MIX_BITS),
+		"gainDb": 20 * math.log10(scale) if scale > 0 else None,
+		"clipped": clipped,
+	}
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+
+from array import array
+from collections import OrderedDict
+
+"""Holds rendered notes, as arrays of signed 16 bit samples keyed by (note, waveform, duration in samples),
+up to maxBytes of samples in all. When it is full, the notes used least recently are evicted. Notes of more
+than maxNoteBytes (by default, 1/64 of maxBytes) aren't held, so that one long note doesn't empty the cache."""
+class NoteCache:
+	def __init__(self, maxBytes=32*1024*1024, maxNoteBytes=None):
+		self.maxBytes = maxBytes
+		self.maxNoteBytes = maxNoteBytes if maxNoteBytes != None else maxBytes / 64
+		self.segments = OrderedDict()
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		# samples copied from the cache and rendered
+		self.hitSamples = 0
+		self.missSamples = 0
+
+	"""Returns whether a note of count samples of the given size is short enough to be held."""
+	def Holds(self, count, itemsize=2):
+		return count * itemsize <= min(self.maxNoteBytes, self.maxBytes)
+
+	"""Returns the samples stored under key, or None."""
+	def Get(self, key):
+		segment = self.segments.pop(key, None)
+		if segment == None:
+			self.misses += 1
+			return None
+		# move it to the most recently used end
+		self.segments[key] = segment
+		self.hits += 1
+		self.hitSamples += len(segment)
+		return segment
+
+	"""Stores segment under key, evicting the least recently used notes to make room. A segment too long
+	for the cache to hold (see Holds) isn't stored."""
+	def Put(self, key, segment):
+		self.missSamples += len(segment)
+		size = len(segment) * segment.itemsize
+		if not self.Holds(len(segment), segment.itemsize):
+			return
+		while self.bytes + size > self.maxBytes:
+			(evictedKey, evicted) = self.segments.popitem(last=False)
+			self.bytes -= len(evicted) * evicted.itemsize
+			self.evictions += 1
+		self.segments[key] = segment
+		self.bytes += size
+
+	"""Counts a note of count samples that is too long to be held (see Holds) as a miss, as it is rendered."""
+	def Skip(self, count):
+		self.misses += 1
+		self.missSamples += count
+
+	"""Returns a line summarising the use of the cache."""
+	def Report(self):
+		lookups = self.hits + self.misses
+		if lookups == 0:
+			return "note cache unused"
+		return "note cache: %d hits, %d misses, %d evictions, %.1f%% of notes and %.1f%% of samples from the cache, %d notes in %.1f MB" % (
+			self.hits, self.misses, self.evictions, 100.0 * self.hits / lookups,
+			100.0 * self.hitSamples / max(1, self.hitSamples + self.missSamples), len(self.segments), self.bytes / 1048576.0)
+
+"""Renders the list of (sample position, midiNote) from ExtractMonophonicNotes, with times from TrackTimeToSamples,
+as arrays of blockSize signed 16 bit samples (except the last). Each note is rendered from the start of a cycle
+by renderNote(note, count, blockSize), which yields arrays of up to blockSize samples, count in all. Notes that
+cache (if given) holds are rendered whole and kept in it under (note, waveform, count), and copied from it when
+they are played again; longer notes are rendered a block at a time. The output is the same as that of the
+renderer renderNote uses, as long as it starts each note from the start of a cycle."""
+def RenderNotes(timedNotes, renderNote, waveform, cache=None, blockSize=4096):
+	silence = array("h", [0])
+	block = array("h")
+	position = 0
+	note = None
+	for (at, nextNote) in timedNotes:
+		if at > position:
+			count = at - position
+			if note == None:
+				pieces = (silence * min(blockSize, count - i) for i in xrange(0, count, blockSize))
+			elif cache != None and cache.Holds(count):
+				key = (note, waveform, count)
+				segment = cache.Get(key)
+				if segment == None:
+					segment = array("h")
+					for piece in renderNote(note, count, count):
+						segment.extend(piece)
+					cache.Put(key, segment)
+				pieces = [segment]
+			else:
+				if cache != None:
+					cache.Skip(count)
+				pieces = renderNote(note, count, blockSize)
+			for piece in pieces:
+				block.extend(piece)
+				if len(block) >= blockSize:
+					# a long note or silence fills many blocks, which are taken from it before any is deleted
+					end = len(block) - len(block) % blockSize
+					for i in xrange(0, end, blockSize):
+						yield block[i:i + blockSize]
+					del block[:end]
+			position = at
+		note = nextNote
+	if len(block) > 0:
+		yield block
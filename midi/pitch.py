@@ -0,0 +1,300 @@
+#!/usr/bin/python
+
+from wavreader import WAVReader
+
+import numpy
+from numpy.lib.stride_tricks import as_strided
+
+import argparse, math, sys, time
+
+# the range of frequencies the C# tuner listens for, in Hertz
+MIN_FREQ = 60.0
+MAX_FREQ = 1300.0
+# spectrum peaks tried as the fundamental, and periods scanned around each, as in the C# tuner
+PEAKS_COUNT = 5
+MAX_INTERVAL_STEPS = 30
+
+NOTE_NAMES = ("C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B")
+
+"""Returns the length of the FFT the C# tuner uses for frameSize samples: frameSize if it is a power of 2, or
+else the next power of 2 above it, padded with zeros."""
+def FFTLength(frameSize):
+	length = 1
+	while length < frameSize:
+		length <<= 1
+	return length
+
+"""Returns a read only view of samples, a 1 dimensional array, as a 2 dimensional array of frames of frameSize
+samples, each hop samples after the one before, without copying them. A partial frame at the end is left out."""
+def Frames(samples, frameSize, hop):
+	count = max(0, (len(samples) - frameSize) / hop + 1)
+	frames = as_strided(samples, shape=(count, frameSize), strides=(samples.strides[0] * hop, samples.strides[0]))
+	frames.flags.writeable = False
+	return frames
+
+"""Returns (midiNote, name, cents) for the equal tempered note closest to frequency, where cents is how far
+frequency is above (or below, if negative) it."""
+def ClosestNote(frequency):
+	exact = 69 + 12 * math.log(frequency / 440.0, 2)
+	midiNote = int(round(exact))
+	return (midiNote, "%s%d" % (NOTE_NAMES[midiNote % 12], midiNote / 12 - 1), 100 * (exact - midiNote))
+
+"""Finds the fundamental frequency of frames of frameSize samples as the C# tuner's FindFundamentalFrequency does,
+working on a batch of frames at once. The PEAKS_COUNT highest bins of the power spectrum between minFreq and
+maxFreq are each taken as a guess at the fundamental, and up to MAX_INTERVAL_STEPS periods between those of the
+bin's edges are scanned for the one over which the signal differs least from itself. The period that differs
+least of all gives the frequency. The squared differences are worked out for every period at once from the
+autocorrelation of the frame, by FFT, rather than summed for each period scanned.
+With exact set, the result is the C# tuner's: a whole number of samples, compared over the longest period, with
+a frame taken to be silent if its lowest useful bin is one of the peaks (which low notes in short frames are
+also taken to be). Otherwise, the period is moved to the least difference near it and interpolated between
+samples, the differences are summed over as much of the frame as there is, and a frame is taken to be silent
+if its clarity, one less the least difference over the energy of the samples compared, is below minClarity:
+near 1 for a periodic signal, and near 0 for noise."""
+class PitchDetector:
+	def __init__(self, sampleRate, frameSize=4096, minFreq=MIN_FREQ, maxFreq=MAX_FREQ, exact=False, minClarity=0.5):
+		self.sampleRate = sampleRate
+		self.frameSize = frameSize
+		self.exact = exact
+		self.minClarity = minClarity
+		self.fftLength = FFTLength(frameSize)
+		self.minBin = max(0, int(minFreq * self.fftLength / sampleRate))
+		self.maxBin = min(self.fftLength / 2 + 1, int(maxFreq * self.fftLength / sampleRate) + 1)
+		if self.maxBin - self.minBin < PEAKS_COUNT:
+			raise ValueError("a frame of %d samples is too short to find frequencies from %g to %g Hz" % (frameSize, minFreq, maxFreq))
+		# the longest period scanned, that of the bin above the lowest useful one
+		self.maxInterval = self.fftLength / (self.minBin + 1)
+		# the samples compared with those a period later
+		if exact:
+			self.length = int(sampleRate / minFreq)
+		else:
+			self.length = frameSize - self.maxInterval - 1
+		if self.length < int(sampleRate / minFreq) or self.length + self.maxInterval + 1 > frameSize:
+			raise ValueError("a frame needs at least %d samples to find frequencies down to %g Hz" % (int(sampleRate / minFreq) + self.maxInterval + 1, minFreq))
+		self.correlationLength = FFTLength(self.length + self.maxInterval + 1)
+		self.steps = numpy.arange(MAX_INTERVAL_STEPS)
+		self.periods = numpy.arange(self.maxInterval + 2)
+
+	"""Returns (frequencies, clarity): the fundamental frequency in Hertz of each of frames, a 2 dimensional array
+	of frames of frameSize samples, or 0 where a frame is silent, and the clarity of each."""
+	def Detect(self, frames):
+		count = len(frames)
+		rows = numpy.arange(count)
+		spectrum = numpy.fft.rfft(frames, self.fftLength)
+		power = spectrum.real ** 2 + spectrum.imag ** 2
+		peaks = numpy.argpartition(-power[:, self.minBin:self.maxBin], PEAKS_COUNT - 1, axis=1)[:, :PEAKS_COUNT] + self.minBin
+		# the periods between those of the edges of each peak's bin, up to MAX_INTERVAL_STEPS of them
+		intervalStart = self.fftLength / (peaks + 1)
+		intervalEnd = numpy.minimum(self.fftLength / numpy.maximum(peaks, 1), self.maxInterval)
+		span = intervalEnd - intervalStart
+		steps = numpy.clip(span, 1, MAX_INTERVAL_STEPS)
+		intervals = intervalStart[:, :, None] + span[:, :, None] * self.steps / steps[:, :, None]
+		intervals = numpy.where(self.steps < steps[:, :, None], intervals, intervalStart[:, :, None])
+		(differences, energy) = self.Differences(frames)
+		best = differences[rows[:, None, None], intervals].reshape(count, -1).argmin(axis=1)
+		interval = intervals.reshape(count, -1)[rows, best]
+		peak = best / MAX_INTERVAL_STEPS
+		if not self.exact:
+			# periods are scanned up to this far apart
+			(period, interval) = self._refine(differences, interval, -(-span[rows, peak] // steps[rows, peak]))
+		total = energy[rows, interval]
+		clarity = numpy.where(total > 0, 1 - differences[rows, interval] / numpy.where(total > 0, total, 1), 0.0)
+		if self.exact:
+			period = interval.astype(numpy.float64)
+			silent = (peaks == self.minBin).any(axis=1)
+		else:
+			silent = clarity < self.minClarity
+		return (numpy.where(silent, 0.0, self.sampleRate / numpy.maximum(period, 1.0)), clarity)
+
+	"""Returns (differences, energy) for each of frames: the sum of the squared differences between its first
+	length samples and those each period from 0 to maxInterval + 1 later, as ScanSignalIntervals sums for one
+	period, and the sum of the squares of both."""
+	def Differences(self, frames):
+		head = frames[:, :self.length]
+		body = frames[:, :self.length + self.maxInterval + 1]
+		correlation = numpy.fft.irfft(numpy.conj(numpy.fft.rfft(head, self.correlationLength)) * numpy.fft.rfft(body, self.correlationLength),
+			self.correlationLength)[:, :self.maxInterval + 2]
+		squares = numpy.zeros((len(frames), body.shape[1] + 1))
+		numpy.cumsum(body * body, axis=1, out=squares[:, 1:])
+		energy = squares[:, self.length, None] + squares[:, self.periods + self.length] - squares[:, self.periods]
+		return (energy - 2 * correlation, energy)
+
+	"""Moves each interval to the least difference within gap samples of it, then fits a parabola through that and
+	the differences either side, returning the period at its minimum and the whole interval it was found at."""
+	def _refine(self, differences, interval, gap):
+		rows = numpy.arange(len(interval))
+		offsets = numpy.arange(-gap.max(), gap.max() + 1)
+		candidates = numpy.clip(interval[:, None] + offsets, 1, self.maxInterval)
+		values = numpy.where(abs(offsets) <= gap[:, None], differences[rows[:, None], candidates], numpy.inf)
+		interval = candidates[rows, values.argmin(axis=1)]
+		(before, at, after) = (differences[rows, interval - 1], differences[rows, interval], differences[rows, interval + 1])
+		curvature = before - 2 * at + after
+		shift = numpy.where(curvature > 0, 0.5 * (before - after) / numpy.where(curvature > 0, curvature, 1), 0)
+		return (interval + numpy.clip(shift, -0.5, 0.5), interval)
+
+"""Returns the fundamental frequency of x, an array of samples, as the C# tuner's FindFundamentalFrequency does
+(with exact set), or 0 if there is no sound."""
+def FindFundamentalFrequency(x, sampleRate, minFreq=MIN_FREQ, maxFreq=MAX_FREQ, exact=False):
+	(frequencies, clarity) = PitchDetector(sampleRate, len(x), minFreq, maxFreq, exact).Detect(numpy.asarray(x, dtype=numpy.float64)[None, :])
+	return frequencies[0]
+
+"""FindFundamentalFrequency of the C# tuner as it is written, one sample at a time, to check PitchDetector against."""
+def _ReferenceFundamentalFrequency(x, sampleRate, minFreq=MIN_FREQ, maxFreq=MAX_FREQ):
+	length = FFTLength(len(x))
+	spectrum = abs(numpy.fft.fft(x, length)) ** 2
+	usefulMin = max(0, int(minFreq * length / sampleRate))
+	usefulMax = min(length, int(maxFreq * length / sampleRate) + 1)
+	# FindPeaks keeps the highest PEAKS_COUNT, replacing the lowest kept with any higher
+	peakIndices = range(usefulMin, usefulMin + PEAKS_COUNT)
+	for i in xrange(usefulMin + PEAKS_COUNT, usefulMax):
+		lowest = min(xrange(0, PEAKS_COUNT), key=lambda j: spectrum[peakIndices[j]])
+		if spectrum[peakIndices[lowest]] < spectrum[i]:
+			peakIndices[lowest] = i
+	if usefulMin in peakIndices:
+		return 0.0
+	verifyLength = int(sampleRate / minFreq)
+	minPeakValue = float("inf")
+	optimalInterval = 0
+	for index in peakIndices:
+		(intervalMin, intervalMax) = (length / (index + 1), length / index)
+		steps = min(MAX_INTERVAL_STEPS, max(1, intervalMax - intervalMin))
+		for i in xrange(0, steps):
+			interval = intervalMin + (intervalMax - intervalMin) * i / steps
+			value = sum([(x[j] - x[j + interval]) ** 2 for j in xrange(0, verifyLength)])
+			if value < minPeakValue:
+				minPeakValue = value
+				optimalInterval = interval
+	return float(sampleRate) / optimalInterval
+
+"""Yields (time in seconds, frequency, clarity) for each frame of frameSize samples, hop samples apart, of samples,
+an array of samples at sampleRate, finding the frequencies batchSize frames at a time with a PitchDetector."""
+def DetectPitches(samples, sampleRate, frameSize=4096, hop=1024, batchSize=16, minFreq=MIN_FREQ, maxFreq=MAX_FREQ, exact=False, minClarity=0.5):
+	frames = Frames(numpy.asarray(samples, dtype=numpy.float64), frameSize, hop)
+	batches = (frames[start:start + batchSize] for start in xrange(0, len(frames), batchSize))
+	return DetectBatchPitches(batches, sampleRate, frameSize, hop, minFreq, maxFreq, exact, minClarity)
+
+"""As DetectPitches, but for batches of frames, as arrays of frameSize samples from ReadWAVFrames, rather than
+an array of samples."""
+def DetectBatchPitches(batches, sampleRate, frameSize=4096, hop=1024, minFreq=MIN_FREQ, maxFreq=MAX_FREQ, exact=False, minClarity=0.5):
+	detector = PitchDetector(sampleRate, frameSize, minFreq, maxFreq, exact, minClarity)
+	start = 0
+	for frames in batches:
+		(frequencies, clarity) = detector.Detect(frames)
+		for i in xrange(0, len(frequencies)):
+			yield (float((start + i) * hop) / sampleRate, frequencies[i], clarity[i])
+		start += len(frames)
+
+"""Yields batches of up to batchSize frames of frameSize samples, each hop samples after the one before, from
+the WAV file read by reader, with the samples scaled to between -1 and 1 and the channels, if there are more
+than one, averaged. Each batch is read with reader.Blocks as one block of the samples its frames cover, and
+converted on its own, so the file is never all in memory and the samples the frames of a batch share are
+converted once."""
+def ReadWAVFrames(reader, frameSize, hop, batchSize):
+	remaining = max(0, (len(reader) - frameSize) / hop + 1)
+	span = (batchSize - 1) * hop + frameSize
+	# the last block is padded out with silence, and the frames that look into the padding are left out
+	for block in reader.Blocks(span, batchSize * hop, pad=True):
+		if remaining <= 0:
+			return
+		frames = Frames(reader.ToFloat(block).mean(axis=1), frameSize, hop)[:remaining]
+		remaining -= len(frames)
+		yield frames
+
+"""Returns seconds of a tone at frequency, sampled at sampleRate: a sine wave, or a plucked string with harmonics
+that decay faster the higher they are, with noise added at noiseLevel (relative to the amplitude)."""
+def SyntheticTone(frequency, sampleRate=44100, seconds=1.0, shape="sine", noiseLevel=0.0, seed=0):
+	t = numpy.arange(int(seconds * sampleRate)) / float(sampleRate)
+	if shape == "sine":
+		tone = numpy.sin(2 * math.pi * frequency * t)
+	else:
+		tone = numpy.zeros(len(t))
+		for harmonic in xrange(1, int(sampleRate / 2 / frequency) + 1):
+			tone += numpy.sin(2 * math.pi * harmonic * frequency * t) * numpy.exp(-t * harmonic * 2.0) / harmonic
+		tone /= abs(tone).max()
+	if noiseLevel > 0:
+		tone += noiseLevel * numpy.random.RandomState(seed).standard_normal(len(t))
+	return 0.5 * tone
+
+"""Checks PitchDetector against synthetic tones across the range of a guitar, as sines and as plucked strings, with
+and without noise, printing any that are out and the worst errors. With exact set, it must find what the C# tuner,
+as written in _ReferenceFundamentalFrequency, finds for every frame; otherwise, it must find the frequencies played
+to within cents (noisyCents with noise), and noise and silence must be found silent. Returns whether all passed."""
+def CheckAccuracy(sampleRate=44100, frameSize=4096, cents=2.0, noisyCents=15.0):
+	ok = True
+	worst = dict()
+	# the open strings of a guitar, A 440, and notes up the neck of the top string
+	frequencies = [82.41, 110.0, 146.83, 196.0, 246.94, 329.63, 440.0, 659.26, 987.77, 1244.51]
+	for exact in (False, True):
+		detector = PitchDetector(sampleRate, frameSize, exact=exact)
+		for shape in ("sine", "pluck"):
+			for noiseLevel in (0.0, 0.05):
+				for frequency in frequencies:
+					frames = Frames(SyntheticTone(frequency, sampleRate, 0.5, shape, noiseLevel), frameSize, frameSize / 2)
+					(found, clarity) = detector.Detect(frames)
+					if exact:
+						expected = numpy.array([_ReferenceFundamentalFrequency(frame, sampleRate) for frame in frames])
+						bad = found != expected
+						error = abs(found - expected)
+					else:
+						error = abs(1200 * numpy.log2(numpy.maximum(found, 1e-3) / frequency))
+						bad = error > (noisyCents if noiseLevel > 0 else cents)
+					key = ("exact" if exact else "cents", shape, noiseLevel)
+					worst[key] = max(worst.get(key, 0), error.max())
+					if bad.any():
+						print "%s %s, noise %g, %.2f Hz: found %s" % (key[0], shape, noiseLevel, frequency, found[bad])
+						ok = False
+		if not exact:
+			for (name, samples) in (("silence", numpy.zeros(sampleRate)), ("noise", 0.5 * numpy.random.RandomState(0).standard_normal(sampleRate))):
+				(found, clarity) = detector.Detect(Frames(samples, frameSize, frameSize / 2))
+				if found.any():
+					print "%s: found %s" % (name, found[found > 0])
+					ok = False
+	for ((kind, shape, noiseLevel), error) in sorted(worst.items()):
+		print "%-5s %-5s noise %-4g worst error %.3f %s" % (kind, shape, noiseLevel, error, "cents" if kind == "cents" else "Hz from the C# tuner's")
+	return ok
+
+"""Returns (frames per second, real time factor) of finding the frequency of seconds of a plucked string at
+sampleRate, with frames of frameSize samples hop samples apart, batchSize at a time, on one core."""
+def Benchmark(seconds=10, sampleRate=44100, frameSize=4096, hop=1024, batchSize=16):
+	tone = SyntheticTone(196.0, sampleRate, seconds, "pluck")
+	start = time.time()
+	frames = len(list(DetectPitches(tone, sampleRate, frameSize, hop, batchSize)))
+	elapsed = time.time() - start
+	return (frames / elapsed, seconds / elapsed)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Finds the pitch of a WAV file over time, as the C# guitar tuner does.")
+	parser.add_argument("file", nargs="?", help="WAV file, of any format WAVReader reads")
+	parser.add_argument("--frame-size", type=int, default=4096, help="samples in each frame analysed")
+	parser.add_argument("--hop", type=int, default=1024, help="samples from one frame to the next")
+	parser.add_argument("--batch", type=int, default=16, help="frames analysed at once")
+	parser.add_argument("--min-freq", type=float, default=MIN_FREQ)
+	parser.add_argument("--max-freq", type=float, default=MAX_FREQ)
+	parser.add_argument("--exact", action="store_true", help="find what the C# tuner would, in whole samples")
+	parser.add_argument("--min-clarity", type=float, default=0.5, help="clarity (0 to 1) below which a frame is taken to be silent")
+	parser.add_argument("--check", action="store_true", help="check the frequencies found for synthetic tones")
+	parser.add_argument("--benchmark", type=int, default=None, metavar="SECONDS", help="measure the frames per second analysed of this many seconds of a tone")
+	args = parser.parse_args()
+	if args.check:
+		ok = CheckAccuracy(frameSize=args.frame_size)
+		print "check %s" % ("passed" if ok else "FAILED")
+		sys.exit(0 if ok else 1)
+	if args.benchmark:
+		(framesPerSecond, realtimeFactor) = Benchmark(args.benchmark, frameSize=args.frame_size, hop=args.hop, batchSize=args.batch)
+		print "%.0f frames/s of %d samples, %d apart: %.1fx real time" % (framesPerSecond, args.frame_size, args.hop, realtimeFactor)
+		sys.exit(0)
+	if args.file == None:
+		parser.error("a WAV file, --check or --benchmark is needed")
+	try:
+		reader = WAVReader(args.file)
+		frames = ReadWAVFrames(reader, args.frame_size, args.hop, args.batch)
+		pitches = DetectBatchPitches(frames, reader.SampleRate, args.frame_size, args.hop, args.min_freq, args.max_freq, args.exact, args.min_clarity)
+		for (at, frequency, clarity) in pitches:
+			if frequency > 0:
+				(midiNote, name, cents) = ClosestNote(frequency)
+				print "%8.3f s %9.3f Hz  %-4s %+6.1f cents  clarity %.2f" % (at, frequency, name, cents, clarity)
+			else:
+				print "%8.3f s         -                          clarity %.2f" % (at, clarity)
+		reader.close()
+	except ValueError, e:
+		parser.error(str(e))
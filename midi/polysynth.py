@@ -0,0 +1,277 @@
+#!/usr/bin/python
+
+from mididecode import MIDIEvent
+
+from array import array
+import argparse, math, random, time
+
+_noteFrequenciesHz = [440.0 * math.pow(2, (midiNote-69)/12.0) for midiNote in xrange(0, 128)]
+
+"""Returns the frequency in Hertz for the given MIDI note (0-127)."""
+def MIDINoteFrequencyHz(midiNote):
+	assert midiNote >= 0 and midiNote < 128
+	return _noteFrequenciesHz[midiNote]
+
+"""One of the oscillators of a VoiceEngine. While active, it plays a square wave for the note
+of a channel, at an amplitude of level, where sign is the sign of the current half cycle and
+untilFlip the number of samples until the next."""
+class Voice(object):
+	__slots__ = ("active", "channel", "note", "velocity", "level", "sign", "halfPeriod", "untilFlip", "started")
+
+	def __init__(self):
+		self.active = False
+		self.channel = None
+		self.note = None
+		self.velocity = 0
+		self.level = 0
+		self.sign = 1
+		self.halfPeriod = 0
+		self.untilFlip = 0
+		self.started = 0
+
+"""Plays any number of notes at once, up to the number of voices, mixing them into blocks of
+signed 16 bit samples. The voices are all created up front and reused, so playing a note doesn't
+allocate anything. When every voice is in use, a new note takes over (steals) the voice that has
+been playing the longest (STEAL_OLDEST) or the quietest, then the longest (STEAL_QUIETEST), or is
+dropped (STEAL_NONE). Each voice contributes voiceLevel at full velocity; the mix is clipped.
+Notes are started and stopped between calls to Render, which records how long it takes and how
+many voices it mixed, so that the voice limit can be set to what the machine can render in time."""
+class VoiceEngine:
+	STEAL_OLDEST = "oldest"
+	STEAL_QUIETEST = "quietest"
+	STEAL_NONE = "none"
+
+	def __init__(self, maxVoices=8, sampleRate=44100, voiceLevel=0x2000, stealing=STEAL_OLDEST):
+		assert stealing in (VoiceEngine.STEAL_OLDEST, VoiceEngine.STEAL_QUIETEST, VoiceEngine.STEAL_NONE)
+		self.voices = [Voice() for i in xrange(0, maxVoices)]
+		self.sampleRate = sampleRate
+		self.voiceLevel = voiceLevel
+		self.stealing = stealing
+		self.halfPeriods = [0.5*sampleRate/MIDINoteFrequencyHz(note) for note in xrange(0, 128)]
+		# the sum of the active voices' outputs at the next sample
+		self.level = 0
+		# counts notes started, to order the voices by age
+		self.notesStarted = 0
+		# instrumentation
+		self.blocks = 0
+		self.samples = 0
+		self.renderSeconds = 0.0
+		self.maxBlockSeconds = 0.0
+		self.voiceSamples = 0
+		self.peakVoices = 0
+		self.steals = 0
+		self.drops = 0
+
+	"""Starts playing note on channel. A velocity of 0 stops it, as for a Note On event."""
+	def NoteOn(self, channel, note, velocity):
+		if velocity == 0:
+			self.NoteOff(channel, note)
+			return
+		voice = None
+		for v in self.voices:
+			if v.active and v.channel == channel and v.note == note:
+				# the note is played again
+				voice = v
+				break
+			if not v.active and voice == None:
+				voice = v
+		if voice == None:
+			voice = self._steal()
+			if voice == None:
+				self.drops += 1
+				return
+			self.steals += 1
+		if voice.active:
+			self._stop(voice)
+		voice.active = True
+		voice.channel = channel
+		voice.note = note
+		voice.velocity = velocity
+		voice.level = self.voiceLevel * velocity / 127
+		voice.sign = 1
+		voice.halfPeriod = self.halfPeriods[note]
+		voice.untilFlip = voice.halfPeriod
+		voice.started = self.notesStarted
+		self.notesStarted += 1
+		self.level += voice.level
+
+	"""Stops playing note on channel."""
+	def NoteOff(self, channel, note):
+		for v in self.voices:
+			if v.active and v.channel == channel and v.note == note:
+				self._stop(v)
+
+	"""Stops every note, on every channel if channel is None."""
+	def AllNotesOff(self, channel=None):
+		for v in self.voices:
+			if v.active and (channel == None or v.channel == channel):
+				self._stop(v)
+
+	"""Returns the number of voices playing."""
+	def ActiveVoices(self):
+		return len([v for v in self.voices if v.active])
+
+	def _stop(self, voice):
+		self.level -= voice.sign * voice.level
+		voice.active = False
+
+	"""Returns the voice to take over for a new note, or None if notes are dropped instead."""
+	def _steal(self):
+		if self.stealing == VoiceEngine.STEAL_OLDEST:
+			return min(self.voices, key=lambda v: v.started)
+		elif self.stealing == VoiceEngine.STEAL_QUIETEST:
+			return min(self.voices, key=lambda v: (v.velocity, v.started))
+		return None
+
+	"""Appends count samples of the mix of the active voices to out, an array of signed 16 bit samples.
+	The mix only changes where one of the voices changes sign, so rather than add up every sample, the
+	changes of all the voices are sorted and the run of samples between each is filled in at once."""
+	def Render(self, count, out):
+		start = time.time()
+		changes = []
+		active = 0
+		for v in self.voices:
+			if not v.active:
+				continue
+			active += 1
+			t = v.untilFlip
+			# the first sample of the new half cycle is the first at or after the time of the change
+			i = int(t)
+			if i < t:
+				i += 1
+			if i < count:
+				sign = v.sign
+				halfPeriod = v.halfPeriod
+				delta = 2*v.level
+				while i < count:
+					sign = -sign
+					changes.append((i, sign*delta))
+					t += halfPeriod
+					i = int(t)
+					if i < t:
+						i += 1
+				v.sign = sign
+			v.untilFlip = t - count
+		changes.sort()
+		level = self.level
+		position = 0
+		for (i, delta) in changes:
+			if i > position:
+				out.extend(array("h", [max(-0x8000, min(0x7fff, level))]) * (i - position))
+				position = i
+			level += delta
+		if count > position:
+			out.extend(array("h", [max(-0x8000, min(0x7fff, level))]) * (count - position))
+		self.level = level
+		elapsed = time.time() - start
+		self.blocks += 1
+		self.samples += count
+		self.renderSeconds += elapsed
+		self.maxBlockSeconds = max(self.maxBlockSeconds, elapsed)
+		self.voiceSamples += active * count
+		self.peakVoices = max(self.peakVoices, active)
+
+	"""Returns a line summarising the instrumentation: the render cost per block, as a fraction of real time
+	(the load), and the number of voices playing."""
+	def Report(self):
+		if self.blocks == 0:
+			return "nothing rendered"
+		return "%d blocks: %.3f ms/block (max %.3f), load %.1f%%, %.1f voices on average (peak %d), %d stolen, %d dropped" % (
+			self.blocks, 1000*self.renderSeconds/self.blocks, 1000*self.maxBlockSeconds,
+			100*self.renderSeconds*self.sampleRate/self.samples, float(self.voiceSamples)/self.samples, self.peakVoices,
+			self.steals, self.drops)
+
+# the commands a VoiceEngine is played with, from EngineCommands
+COMMAND_END = 0
+COMMAND_NOTE_ON = 1
+COMMAND_NOTE_OFF = 2
+COMMAND_ALL_NOTES_OFF = 3
+
+"""Yields the (sample position, MIDIEvent) tuples, as from TrackTimeToSamples, that a VoiceEngine acts on as
+(sample position, command, channel, note, velocity) tuples, up to a COMMAND_END at the END_OF_TRACK event (or at
+the last event, if there isn't one). Note On events with a velocity of 0 are given as COMMAND_NOTE_OFF."""
+def EngineCommands(timedEvents):
+	at = 0
+	for (at, event) in timedEvents:
+		type = event.Type()
+		if type == MIDIEvent.NOTE_ON and event.Param2() > 0:
+			yield (at, COMMAND_NOTE_ON, event.Channel(), event.Param1(), event.Param2())
+		elif type == MIDIEvent.NOTE_OFF or type == MIDIEvent.NOTE_ON:
+			yield (at, COMMAND_NOTE_OFF, event.Channel(), event.Param1(), 0)
+		elif type == 0xB and event.Param1() in (120, 123):
+			# All Sound Off and All Notes Off
+			yield (at, COMMAND_ALL_NOTES_OFF, event.Channel(), 0, 0)
+		elif type == MIDIEvent.META_EVENT and event.MetaEventType() == MIDIEvent.END_OF_TRACK:
+			break
+	yield (at, COMMAND_END, 0, 0, 0)
+
+"""Plays the (sample position, MIDIEvent) tuples, as from TrackTimeToSamples, through engine, yielding arrays
+of blockSize signed 16 bit samples (except the last) up to the END_OF_TRACK event. Each event takes effect at
+its sample."""
+def RenderPolyphonic(timedEvents, engine, blockSize=256):
+	return RenderCommands(EngineCommands(timedEvents), engine, blockSize)
+
+"""As RenderPolyphonic, for the tuples from EngineCommands (or a compiled Schedule)."""
+def RenderCommands(commands, engine, blockSize=256):
+	block = array("h")
+	position = 0
+	for (at, command, channel, note, velocity) in commands:
+		while position < at:
+			count = min(at - position, blockSize - len(block))
+			engine.Render(count, block)
+			position += count
+			if len(block) == blockSize:
+				yield block
+				block = array("h")
+		if command == COMMAND_NOTE_ON:
+			engine.NoteOn(channel, note, velocity)
+		elif command == COMMAND_NOTE_OFF:
+			engine.NoteOff(channel, note)
+		elif command == COMMAND_ALL_NOTES_OFF:
+			engine.AllNotesOff(channel)
+		else:
+			break
+	if len(block) > 0:
+		yield block
+
+"""Returns the fraction of real time that a VoiceEngine of the given number of voices takes to render
+seconds of random notes with every voice playing."""
+def MeasureLoad(voices, sampleRate=44100, blockSize=256, seconds=1):
+	rng = random.Random(0)
+	engine = VoiceEngine(voices, sampleRate)
+	block = array("h")
+	for i in xrange(0, seconds * sampleRate / blockSize):
+		if i % 8 == 0:
+			# keep every voice busy, changing notes now and then
+			engine.NoteOn(rng.randint(0, 15), rng.randint(36, 96), 100)
+			while engine.ActiveVoices() < voices:
+				engine.NoteOn(rng.randint(0, 15), rng.randint(36, 96), 100)
+		engine.Render(blockSize, block)
+		del block[:]
+	return engine.renderSeconds * sampleRate / engine.samples
+
+"""Returns the most voices (up to maxVoices) that a VoiceEngine can render with every one playing, while
+taking no more than the given fraction of real time, to use as the voice limit on this machine."""
+def CalibrateVoiceLimit(sampleRate=44100, blockSize=256, load=0.5, maxVoices=256):
+	# double the voices until the load is too high, then bisect
+	low = 0
+	high = 1
+	while high <= maxVoices and MeasureLoad(high, sampleRate, blockSize) <= load:
+		low = high
+		high *= 2
+	high = min(high, maxVoices + 1)
+	while high - low > 1:
+		middle = (low + high) / 2
+		if MeasureLoad(middle, sampleRate, blockSize) <= load:
+			low = middle
+		else:
+			high = middle
+	return low
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Finds the number of voices that can be rendered in real time on this machine.")
+	parser.add_argument("--sample-rate", type=int, default=44100)
+	parser.add_argument("--block-size", type=int, default=256)
+	parser.add_argument("--load", type=float, default=0.5, help="fraction of real time the rendering may take")
+	args = parser.parse_args()
+	print "%d voices" % CalibrateVoiceLimit(args.sample_rate, args.block_size, args.load)
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+
+from collections import OrderedDict
+import json, platform, resource, sys, time
+
+"""Records the wall clock and CPU time taken by each stage of a pipeline, with the events or samples
+that pass through it. A stage is either a block of code, timed by Measure, or a generator, wrapped by
+Stage so that the time taken to produce each of its items is counted. The stages of a pipeline of
+generators run nested in each other, so each is only counted the time not taken by the stages it pulls
+from. Nothing is timed unless a Profiler is made, so the pipeline costs nothing extra without one."""
+class Profiler:
+	def __init__(self):
+		self.stages = OrderedDict()
+		# the stage running now, whose time the stage it pulls from is taken out of
+		self.current = None
+		self.startWall = time.time()
+		self.startCPU = time.clock()
+		self.audioSeconds = 0.0
+
+	def _stage(self, name):
+		if name not in self.stages:
+			self.stages[name] = {"wall":0.0, "cpu":0.0, "calls":0, "events":0, "samples":0}
+		return self.stages[name]
+
+	def _enter(self, stage):
+		outer = self.current
+		self.current = stage
+		return (outer, time.time(), time.clock())
+
+	def _exit(self, stage, entered):
+		(outer, startWall, startCPU) = entered
+		wall = time.time() - startWall
+		cpu = time.clock() - startCPU
+		stage["wall"] += wall
+		stage["cpu"] += cpu
+		stage["calls"] += 1
+		if outer != None:
+			outer["wall"] -= wall
+			outer["cpu"] -= cpu
+		self.current = outer
+
+	"""Yields the items of iterable, counting the time taken to produce each towards the named stage.
+	Each item counts as an event, or as its length in samples if samples is set (or 1 if samples is 1, for
+	a stage producing one sample at a time)."""
+	def Stage(self, name, iterable, samples=False):
+		stage = self._stage(name)
+		it = iter(iterable)
+		while True:
+			entered = self._enter(stage)
+			try:
+				item = it.next()
+			except StopIteration:
+				self._exit(stage, entered)
+				return
+			self._exit(stage, entered)
+			if samples is True:
+				stage["samples"] += len(item)
+			elif samples:
+				stage["samples"] += 1
+			else:
+				stage["events"] += 1
+			yield item
+
+	"""Times fn(*args), towards the named stage, returning what it returns. events or samples may be added
+	to the stage's counts."""
+	def Measure(self, name, fn, *args, **counts):
+		stage = self._stage(name)
+		entered = self._enter(stage)
+		try:
+			return fn(*args)
+		finally:
+			self._exit(stage, entered)
+			stage["events"] += counts.get("events", 0)
+			stage["samples"] += counts.get("samples", 0)
+
+	"""Returns file with its write method timed as the named stage, for the time spent in I/O. Each write
+	counts as an event."""
+	def File(self, name, file):
+		return _ProfiledFile(self, name, file)
+
+	"""Returns the recorded stages, totals, real time factor and peak memory, as a dict that can be written as JSON."""
+	def Summary(self):
+		wall = time.time() - self.startWall
+		# ru_maxrss is in kilobytes on Linux, bytes on Mac OS
+		peakRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		if sys.platform == "darwin":
+			peakRSS /= 1024
+		summary = OrderedDict([
+			("python", platform.python_version()),
+			("wall", wall),
+			("cpu", time.clock() - self.startCPU),
+			("audio_seconds", self.audioSeconds),
+			("realtime_factor", self.audioSeconds / wall if self.audioSeconds > 0 and wall > 0 else None),
+			("peak_rss_kb", peakRSS),
+			("stages", self.stages),
+		])
+		return summary
+
+	"""Prints a table of the stages and the totals."""
+	def Print(self, out=sys.stderr):
+		summary = self.Summary()
+		print >>out, "%-28s %9s %9s %6s %10s %10s %12s" % ("stage", "wall s", "cpu s", "%", "events", "samples", "per second")
+		for (name, stage) in summary["stages"].items():
+			count = stage["samples"] or stage["events"]
+			print >>out, "%-28s %9.4f %9.4f %5.1f%% %10d %10d %12s" % (name, stage["wall"], stage["cpu"],
+				100 * stage["wall"] / summary["wall"] if summary["wall"] > 0 else 0, stage["events"], stage["samples"],
+				"%.4g" % (count / stage["wall"]) if count and stage["wall"] > 0 else "-")
+		print >>out, "%-28s %9.4f %9.4f" % ("total", summary["wall"], summary["cpu"])
+		if summary["audio_seconds"] > 0:
+			print >>out, "%.1f seconds of audio, %.2fx real time" % (summary["audio_seconds"], summary["realtime_factor"])
+		print >>out, "peak memory %d KB" % summary["peak_rss_kb"]
+
+	"""Writes the Summary to the file at path as JSON."""
+	def WriteJSON(self, path):
+		file = open(path, "w")
+		json.dump(self.Summary(), file, indent=1)
+		file.close()
+
+class _ProfiledFile:
+	def __init__(self, profiler, name, file):
+		self.profiler = profiler
+		self.name = name
+		self.file = file
+
+	def write(self, data):
+		self.profiler.Measure(self.name, self.file.write, data, events=1)
+
+	def __getattr__(self, name):
+		return getattr(self.file, name)
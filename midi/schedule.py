@@ -0,0 +1,144 @@
+#!/usr/bin/python
+
+from mididecode import MapFile, FindRiffChunksFromBuffer, DecodeHeaderFromBuffer, IterTrack, GetTempoChangeEventsFromBuffer, FilterEventsByChannel
+from polysynth import COMMAND_NOTE_ON, COMMAND_NOTE_OFF, EngineCommands
+from simplesynth import TrackTimeToSamples, ExtractMonophonicNotes
+from tempomap import TempoMap
+
+from collections import OrderedDict
+import argparse, hashlib, mmap, os, struct, sys, time
+
+SCHEDULE_MAGIC = "MIDS0001"
+SCHEDULE_SUFFIX = ".mids"
+# extensions of the MIDI file looked for beside a schedule by ScheduleSource
+SOURCE_EXTENSIONS = (".mid", ".midi", ".MID", ".MIDI")
+# magic, sample rate, format type of the MIDI file, number of tracks, SHA-1 of the MIDI file
+HEADER = struct.Struct("<8sIHH20s")
+# track (or channel, for a format 0 file), then the byte offset and number of records of its commands and notes
+TRACK_ENTRY = struct.Struct("<iIIII")
+# sample position, command, channel, note, velocity: a tuple from EngineCommands
+RECORD = struct.Struct("<IBBBB")
+
+"""Compiles the MIDI file at path into a schedule at schedulePath, holding what is played for each track (or
+channel, for a format 0 file) that simplesynth synthesises, at sampleRate: both the commands for a VoiceEngine,
+from EngineCommands, and the monophonic notes, from ExtractMonophonicNotes, with their times in samples. Each is
+stored as fixed width RECORDs, which a Schedule reads in place, so nothing is decoded or converted to play it.
+Returns the number of tracks."""
+def CompileSchedule(path, schedulePath, sampleRate=44100):
+	file = open(path, "r")
+	data = MapFile(file)
+	file.close()
+	chunkIdx = FindRiffChunksFromBuffer(data)
+	hdr = DecodeHeaderFromBuffer(data, chunkIdx)
+	tempoMap = TempoMap(hdr, GetTempoChangeEventsFromBuffer(data, chunkIdx, 0))
+	if hdr["formatType"] == 0:
+		# track 0 is decoded once and split by channel, rather than decoded again for each channel
+		eventsPerChannel = FilterEventsByChannel(IterTrack(data, chunkIdx, 0))
+		tracks = sorted(eventsPerChannel.keys())
+		trackEvents = eventsPerChannel.pop
+	else:
+		tracks = range(1, hdr["numTracks"])
+		trackEvents = lambda track: IterTrack(data, chunkIdx, track)
+	records = []
+	for track in tracks:
+		# both the commands and the notes are made from the one decode of the track
+		timedEvents = list(TrackTimeToSamples(hdr, trackEvents(track), tempoMap, sampleRate))
+		commands = [RECORD.pack(*command) for command in EngineCommands(timedEvents)]
+		notes = [RECORD.pack(at, COMMAND_NOTE_OFF if note == None else COMMAND_NOTE_ON, 0, note or 0, 0)
+			for (at, note) in ExtractMonophonicNotes(timedEvents)]
+		records.append((track, commands, notes))
+	offset = HEADER.size + TRACK_ENTRY.size * len(tracks)
+	entries = []
+	for (track, commands, notes) in records:
+		entries.append(TRACK_ENTRY.pack(track, offset, len(commands), offset + RECORD.size * len(commands), len(notes)))
+		offset += RECORD.size * (len(commands) + len(notes))
+	# write to a temporary file and rename, so that a reader never sees a partly written schedule
+	tempPath = "%s.%d.tmp" % (schedulePath, os.getpid())
+	file = open(tempPath, "wb")
+	file.write(HEADER.pack(SCHEDULE_MAGIC, sampleRate, hdr["formatType"], len(tracks), hashlib.sha1(data).digest()))
+	file.write("".join(entries))
+	for (track, commands, notes) in records:
+		file.write("".join(commands))
+		file.write("".join(notes))
+	file.close()
+	os.rename(tempPath, schedulePath)
+	return len(tracks)
+
+"""Returns whether the file at path is a schedule written by CompileSchedule."""
+def IsSchedule(path):
+	file = open(path, "rb")
+	magic = file.read(len(SCHEDULE_MAGIC))
+	file.close()
+	return magic == SCHEDULE_MAGIC
+
+"""Returns the MIDI file that the schedule at schedulePath would have been compiled from by default: the file beside
+it with the same name and a MIDI extension in place of SCHEDULE_SUFFIX. Returns None if there isn't one."""
+def ScheduleSource(schedulePath):
+	base = os.path.splitext(schedulePath)[0]
+	for extension in SOURCE_EXTENSIONS:
+		if os.path.isfile(base + extension):
+			return base + extension
+	return None
+
+"""A schedule written by CompileSchedule, mapped into memory, so that opening it reads only the header and
+the table of tracks, and the records of a track are only paged in as they are played."""
+class Schedule:
+	def __init__(self, path):
+		file = open(path, "rb")
+		try:
+			self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		finally:
+			file.close()
+		if len(self.data) < HEADER.size:
+			raise ValueError("%s is not a schedule" % path)
+		(magic, self.sampleRate, self.formatType, numTracks, self.sha1) = HEADER.unpack_from(self.data, 0)
+		if magic != SCHEDULE_MAGIC:
+			raise ValueError("%s is not a schedule" % path)
+		self.tracks = OrderedDict()
+		for i in xrange(0, numTracks):
+			entry = TRACK_ENTRY.unpack_from(self.data, HEADER.size + TRACK_ENTRY.size * i)
+			if max(entry[1] + RECORD.size * entry[2], entry[3] + RECORD.size * entry[4]) > len(self.data):
+				raise ValueError("%s is truncated" % path)
+			self.tracks[entry[0]] = entry[1:]
+
+	"""Returns the tracks (or channels, for a format 0 file) in the schedule."""
+	def Tracks(self):
+		return self.tracks.keys()
+
+	"""Returns whether the schedule was compiled from data, the contents of a MIDI file."""
+	def CompiledFrom(self, data):
+		return hashlib.sha1(data).digest() == self.sha1
+
+	def _records(self, offset, count):
+		unpack = RECORD.unpack_from
+		data = self.data
+		for position in xrange(offset, offset + RECORD.size * count, RECORD.size):
+			yield unpack(data, position)
+
+	"""Yields the commands of track, as EngineCommands did, to be played with RenderCommands."""
+	def Commands(self, track):
+		(offset, count, notesOffset, notesCount) = self.tracks[track]
+		return self._records(offset, count)
+
+	"""Yields the monophonic notes of track as (sample position, midiNote) tuples, as ExtractMonophonicNotes did."""
+	def Notes(self, track):
+		(offset, count, notesOffset, notesCount) = self.tracks[track]
+		for (at, command, channel, note, velocity) in self._records(notesOffset, notesCount):
+			if command == COMMAND_NOTE_ON:
+				yield (at, note)
+			else:
+				yield (at, None)
+
+	def close(self):
+		self.data.close()
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Compiles a MIDI file into a schedule that simplesynth plays without decoding it.")
+	parser.add_argument("file")
+	parser.add_argument("-o", "--output", default=None, help="schedule to write (default: the MIDI file with %s in place of its extension)" % SCHEDULE_SUFFIX)
+	parser.add_argument("--sample-rate", type=int, default=44100)
+	args = parser.parse_args()
+	output = args.output or os.path.splitext(args.file)[0] + SCHEDULE_SUFFIX
+	start = time.time()
+	tracks = CompileSchedule(args.file, output, args.sample_rate)
+	print "%s: %d tracks, %d bytes, compiled in %.3f s" % (output, tracks, os.path.getsize(output), time.time() - start)
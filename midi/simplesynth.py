@@ -1,9 +1,17 @@
 #!/usr/bin/python
 
-from mididecode import FindRiffChunks, DecodeHeader, MIDIEvent, DecodeTrack, GetTempoChangeEvents, FilterEventsByChannel
+from mididecode import MapFile, FindRiffChunksFromBuffer, DecodeHeaderFromBuffer, MIDIEvent, IterTrack, IterTrackFrom, IndexTrack, GetTempoChangeEventsFromBuffer, IterChannelEvents, FindTrackChannels, FilterEventsByChannel
+from midicolumns import GetTempoChangeEventsColumnar, FilterColumnarByChannel
+from midicache import MIDICache, DefaultCacheDirectory
+from polysynth import MIDINoteFrequencyHz, VoiceEngine, EngineCommands, RenderCommands
+from wavetable import SHAPES, PHASE_BITS, PHASE_MASK, PhaseIncrements, WavetableBank, WavetableOscillator, RenderWavetable
+from audiostream import AudioStream, PipeSink, FileSink, PortAudioSink
+from notecache import NoteCache, RenderNotes
+from tempomap import TempoMap
 from wavwriter import WAVWriter
 
-import math, sys
+from array import array
+import argparse, math, os, sys
 
 """Output the waveform from the input iterator to the file as uint16 Little Endian."""
 def LE16(waveform, out):
@@ -45,47 +53,211 @@ def GenerateWaveform(timedNotes, sampleIntervalMillis):
 		yield amplitude
 		T += sampleIntervalMillis
 
-"""Returns the frequency in Hertz for the given MIDI note (0-127)."""
-def MIDINoteFrequencyHz(midiNote):
-	assert midiNote >= 0 and midiNote < 128
-	return 440.0 * math.pow(2, (midiNote-69)/12.0)
+"""Rounds a non-negative integer to the nearest that has no more than 53 significant bits, as a float would hold it."""
+def _roundToFloat(units):
+	shift = units.bit_length() - 53
+	if shift <= 0:
+		return units
+	(q, r) = divmod(units, 1 << shift)
+	if 2*r > (1 << shift) or (2*r == (1 << shift) and q & 1):
+		q += 1
+	return q << shift
 
-"""Converts the timestamps on the event list into milliseconds from the track time.
-This is based on the Time Division in the header and the tempo, where the tempo can
-change throughout the track."""
-def TrackTimeToMillis(hdr, channelEvents, tempoChangeEvents):
-	assert hdr["divisionType"]=="TICKS_PER_BEAT"
-	ticksPerBeat = hdr["timeDivision"]
-	channelEventIterator = channelEvents.__iter__()
-	tempoEventIterator = tempoChangeEvents.__iter__()
-	# StopIteration here is OK, if the input is empty then the output will be empty
-	(nextChannelEventTime, nextChannelEvent) = channelEventIterator.next()
+"""Adds step to value, both integers in units of some small power of two, as float additions would, at least once
+and no more than count times, stopping at the first sum >= until. Returns (value, number of additions).
+The result is exactly that of a loop of float additions, which is how GenerateWaveform keeps time, but is worked
+out a binade at a time: while value stays within [2**e, 2**(e+1)), every addition of step rounds to the same
+multiple of the unit in the last place, so any number of them can be made at once. binades caches, for each
+binade above 2**53 units, the largest value from which an addition stays within it, and the increment."""
+def _accumulate(value, step, until, count, binades):
+	done = 0
+	while done < count:
+		shift = value.bit_length() - 53
+		if shift < 0:
+			shift = 0
+		if shift not in binades:
+			binades[shift] = _binade(step, shift)
+		(limit, increment) = binades[shift]
+		if value > limit:
+			# the sum leaves the binade, so is rounded to the next one's unit in the last place, ties to even
+			unit = 2 << shift
+			value += step
+			r = value & (unit - 1)
+			value -= r
+			if 2*r > unit or (2*r == unit and value & unit):
+				value += unit
+			done += 1
+		else:
+			steps = (limit - value) // increment + 1
+			if until - value <= increment:
+				steps = 1
+			elif (until - value - 1) // increment + 1 < steps:
+				steps = (until - value - 1) // increment + 1
+			if count - done < steps:
+				steps = count - done
+			value += steps * increment
+			done += steps
+		if value >= until:
+			break
+	return (value, done)
+
+"""Returns (limit, increment) for _accumulate for the binade of values of 53 + shift bits."""
+def _binade(step, shift):
+	if shift == 0:
+		# every sum below 2**53 units is exact
+		return ((1 << 53) - 1 - step, step)
+	unit = 1 << shift
+	(q, r) = divmod(step, unit)
+	if 2*r == unit:
+		# a tie, which rounds to even, so the increment varies; make every addition separately
+		return (-1, None)
+	increment = (q + (2*r > unit)) << shift
+	if increment == 0:
+		raise ValueError("step too small to change the value")
+	return ((1 << (shift + 53)) - 1 - step, increment)
+
+"""Returns the exponent of the unit in which the times kept by RenderBlocks are whole numbers: the smallest unit
+in the last place of the sample interval and the half wavelength of any note."""
+def _timeUnitExponent(sampleIntervalMillis):
+	return min([math.frexp(x)[1] - 53 for x in [sampleIntervalMillis] + [500.0/MIDINoteFrequencyHz(note) for note in xrange(0, 128)]])
+
+"""Renders the same square waveform as GenerateWaveform, sample for sample, but as arrays of signed 16 bit
+samples, blockSize samples long (except the last), scaled as by LE16. Rather than step through every sample,
+each run of samples up to the next transition or change of sign is filled in at once. The times are kept as
+integers, exactly equal to the floats GenerateWaveform would have, so the runs have exactly the same lengths."""
+def RenderBlocks(timedNotes, sampleIntervalMillis, blockSize=4096):
+	it = timedNotes.__iter__()
+	unitExponent = _timeUnitExponent(sampleIntervalMillis)
+	# the smallest number of units >= the given time, so that units >= ToUnits(time) if and only if the time is reached
+	toUnits = lambda millis: int(math.ceil(math.ldexp(millis, -unitExponent)))
+	step = toUnits(sampleIntervalMillis)
+	halfWavelengths = [toUnits(500.0/MIDINoteFrequencyHz(note)) for note in xrange(0, 128)]
+	binades = dict()
+	levels = {0:array("h", [0]), 1:array("h", [0x7fff]), -1:array("h", [-0x8000])}
+	block = array("h")
+	T = 0
+	Tosc = 0
+	amplitude = 0
+	halfWavelength = 0
 	try:
-		(nextTempoEventTime, nextTempoMPQN) = tempoEventIterator.next()
+		(tranTime, nextNote) = it.next()
 	except StopIteration:
-		# this is not OK, there should be tempo setting at the start
-		raise AssertionError
-	milliTime = 0
-	milliTimeBase = 0
-	eventTimeBase = 0
-	millisPerEventTick = 0
+		return
+	tranUnits = toUnits(tranTime)
 	while True:
-		if nextTempoEventTime == None or nextChannelEventTime < nextTempoEventTime:
-			milliTime = milliTimeBase + (nextChannelEventTime - eventTimeBase) * millisPerEventTick
-			yield (milliTime, nextChannelEvent)
+		if T >= tranUnits:
+			if nextNote != None:
+				amplitude = 1
+				halfWavelength = halfWavelengths[nextNote]
+				Tosc = 0
+			else:
+				amplitude = 0
 			try:
-				(nextChannelEventTime, nextChannelEvent) = channelEventIterator.next()
+				(tranTime, nextNote) = it.next()
 			except StopIteration:
-				return
+				break
+			tranUnits = toUnits(tranTime)
+			continue
+		# the samples up to the next transition
+		(T, count) = _accumulate(T, step, tranUnits, sys.maxint, binades)
+		if amplitude == 0:
+			# the oscillator carries on in silence, but is reset before it's next heard
+			block.extend(levels[0] * count)
 		else:
-			milliTime = milliTimeBase + (nextTempoEventTime - eventTimeBase) * millisPerEventTick
-			milliTimeBase = milliTime
-			eventTimeBase = nextTempoEventTime
-			millisPerEventTick = 0.001*nextTempoMPQN/ticksPerBeat
-			try:
-				(nextTempoEventTime, nextTempoMPQN) = tempoEventIterator.next()
-			except StopIteration:
-				nextTempoEventTime = None
+			while count > 0:
+				# the samples up to and including the next change of sign
+				(Tosc, steps) = _accumulate(Tosc, step, halfWavelength, count, binades)
+				if Tosc >= halfWavelength:
+					block.extend(levels[amplitude] * (steps - 1))
+					amplitude = -amplitude
+					Tosc = _roundToFloat(Tosc - halfWavelength)
+					block.append(levels[amplitude][0])
+				else:
+					block.extend(levels[amplitude] * steps)
+				count -= steps
+		while len(block) >= blockSize:
+			yield block[:blockSize]
+			del block[:blockSize]
+	while len(block) > 0:
+		yield block[:blockSize]
+		del block[:blockSize]
+
+"""Renders the square wave of ExtractMonophonicNotes output with (sample position, note) times, as from
+TrackTimeToSamples, as arrays of blockSize signed 16 bit samples (except the last), scaled as by LE16.
+Each note starts at its position exactly, on a fixed point phase advanced by a whole number per sample,
+so the notes keep in time however long the track; each run of samples up to the next change of sign or
+the next note is filled in at once."""
+def RenderSquare(timedNotes, sampleRate=44100, blockSize=4096):
+	increments = PhaseIncrements(sampleRate)
+	half = 1 << (PHASE_BITS - 1)
+	levels = {0:array("h", [0]), 1:array("h", [0x7fff]), -1:array("h", [-0x8000])}
+	block = array("h")
+	position = 0
+	phase = 0
+	increment = None
+	for (at, note) in timedNotes:
+		while position < at:
+			count = min(at - position, blockSize - len(block))
+			position += count
+			if increment == None:
+				block.extend(levels[0] * count)
+			while increment != None and count > 0:
+				# the samples up to the next change of sign: the first half of a cycle is high, the second low
+				if phase < half:
+					(sign, steps) = (1, (half - phase + increment - 1) / increment)
+				else:
+					(sign, steps) = (-1, (PHASE_MASK + 1 - phase + increment - 1) / increment)
+				steps = min(steps, count)
+				block.extend(levels[sign] * steps)
+				phase = (phase + steps * increment) & PHASE_MASK
+				count -= steps
+			if len(block) == blockSize:
+				yield block
+				block = array("h")
+		if note == None:
+			increment = None
+		else:
+			increment = increments[note]
+			phase = 0
+	if len(block) > 0:
+		yield block
+
+"""Writes blocks of signed 16 bit samples, as from RenderBlocks, to the file as Little Endian."""
+def WriteBlocksLE16(blocks, out):
+	for block in blocks:
+		if sys.byteorder != "little":
+			block = array("h", block)
+			block.byteswap()
+		out.write(block)
+
+"""Converts the timestamps on the event list into milliseconds from the track time.
+This is based on the Time Division in the header and the tempo, where the tempo can
+change throughout the track. tempoChangeEvents may be a TempoMap, which can be shared
+between tracks, or a list of (time, microsecondsPerQuarterNote) to build one from.
+The times output are relative to startMillis, for rendering from part way through a track."""
+def TrackTimeToMillis(hdr, channelEvents, tempoChangeEvents, startMillis=0):
+	if isinstance(tempoChangeEvents, TempoMap):
+		tempoMap = tempoChangeEvents
+	else:
+		tempoMap = TempoMap(hdr, tempoChangeEvents)
+	tickToMillis = tempoMap.TickToMillis
+	if startMillis == 0:
+		for (time, event) in channelEvents:
+			yield (tickToMillis(time), event)
+	else:
+		for (time, event) in channelEvents:
+			yield (tickToMillis(time) - startMillis, event)
+
+"""As TrackTimeToMillis, but yields (sample position, MIDIEvent), where the position at sampleRate is that of the
+first sample at or after the event, counted from startSample, worked out exactly from the ticks."""
+def TrackTimeToSamples(hdr, channelEvents, tempoChangeEvents, sampleRate=44100, startSample=0):
+	if isinstance(tempoChangeEvents, TempoMap):
+		tempoMap = tempoChangeEvents
+	else:
+		tempoMap = TempoMap(hdr, tempoChangeEvents)
+	tickToSample = tempoMap.TickToSample
+	for (time, event) in channelEvents:
+		yield (tickToSample(time, sampleRate) - startSample, event)
 
 """Returns a list of (fromTime, noteNumber) from (time, MIDIEvent), consisting only of notes.
 Where two or more notes are played in polyphone in the input stream, the later note replaces
@@ -107,29 +279,250 @@ def ExtractMonophonicNotes(trackEvents):
 			return
 	raise AssertionError("end of track expected")
 			
-midiFile=open(sys.argv[1], "r")
-chunkIdx = FindRiffChunks(midiFile)
-hdr = DecodeHeader(midiFile, chunkIdx)
-track0 = DecodeTrack(midiFile, chunkIdx, 0)
-tempoChangeEvents = GetTempoChangeEvents(track0)
-SampleRate=44100
-# Type 0 MIDI files are synthesised by separate channels
-# Type 1 and 2 files are synthesised by track
-if hdr["formatType"] == 0:
-	eventsPerChannel = FilterEventsByChannel(track0)
-	range = eventsPerChannel.keys()
-else:
-	range = xrange(1, hdr["numTracks"])
-track0 = None
-for i in range:
-	if hdr["formatType"] == 0:
-		filename = "channel%d.wav" % i
-		channelEvents = eventsPerChannel[i]
+"""Renders the (sample position, MIDIEvent) tuples from TrackTimeToSamples as blocks of signed 16 bit samples:
+with a VoiceEngine of the given number of voices and stealing, if voices > 0, or else monophonically, with the
+wavetable of the given waveform or, by default, as a plain square wave. blockSize defaults to that of each renderer.
+Monophonic notes are copied from cache, a NoteCache, if given, once rendered. If log is given, the VoiceEngine
+report is written to it. If profiler is given, the stages are timed with it."""
+def RenderTrack(timedEvents, sampleRate=44100, voices=0, stealing=VoiceEngine.STEAL_OLDEST, waveform=None, blockSize=None, log=None, cache=None, profiler=None):
+	commands = EngineCommands(timedEvents)
+	timedNotes = ExtractMonophonicNotes(timedEvents)
+	if profiler != None:
+		commands = profiler.Stage("EngineCommands", commands)
+		timedNotes = profiler.Stage("ExtractMonophonicNotes", timedNotes)
+	return RenderTrackCommands(commands, timedNotes, sampleRate, voices, stealing, waveform, blockSize, log, cache, profiler)
+
+"""As RenderTrack, for a track given both as the tuples from EngineCommands, which are played with voices > 0,
+and as the (sample position, midiNote) tuples from ExtractMonophonicNotes, which are played otherwise. Only the
+one played is read, so both may be generators over the same events."""
+def RenderTrackCommands(commands, timedNotes, sampleRate=44100, voices=0, stealing=VoiceEngine.STEAL_OLDEST, waveform=None, blockSize=None, log=None, cache=None, profiler=None):
+	if profiler != None:
+		stage = profiler.Stage
+	else:
+		stage = lambda name, iterable, samples=False: iterable
+	if voices > 0:
+		engine = VoiceEngine(voices, sampleRate, stealing=stealing)
+		for block in stage("RenderPolyphonic", RenderCommands(commands, engine, blockSize or 256), samples=True):
+			yield block
+		if log != None:
+			print >>log, engine.Report()
+		return
+	if cache != None:
+		if waveform:
+			oscillator = WavetableOscillator(WavetableBank(waveform, sampleRate))
+			def renderNote(note, count, blockSize):
+				oscillator.Start(note)
+				for position in xrange(0, count, blockSize):
+					samples = array("h")
+					oscillator.Render(min(blockSize, count - position), samples)
+					yield samples
+		else:
+			renderNote = lambda note, count, blockSize: RenderSquare([(0, note), (count, None)], sampleRate, blockSize)
+		blocks = stage("RenderNotes", RenderNotes(timedNotes, renderNote, waveform or "square", cache, blockSize or 4096), samples=True)
+	elif waveform:
+		oscillator = WavetableOscillator(WavetableBank(waveform, sampleRate))
+		blocks = stage("RenderWavetable", RenderWavetable(timedNotes, oscillator, blockSize or 4096), samples=True)
 	else:
-		filename = "track%d.wav" % i
-		channelEvents = DecodeTrack(midiFile, chunkIdx, i)
-	print "writing %s" % filename
-	wavFile = WAVWriter(open(filename, "wb"), SampleRate=SampleRate)
-	LE16(GenerateWaveform(ExtractMonophonicNotes(TrackTimeToMillis(hdr, channelEvents, tempoChangeEvents)), 1000.0/SampleRate), wavFile)
-	wavFile.close()
-midiFile.close()
+		blocks = stage("RenderSquare", RenderSquare(timedNotes, sampleRate, blockSize or 4096), samples=True)
+	for block in blocks:
+		yield block
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Synthesises each track (or channel, for a format 0 file) of a MIDI file to a WAV file.")
+	parser.add_argument("file", help="MIDI file, or a schedule compiled from one by schedule.py (compiled again first if the MIDI file beside it has changed)")
+	parser.add_argument("--cache", action="store_true", help="load the decoded file from the cache, adding it if it isn't there")
+	parser.add_argument("--cache-dir", default=None, help="cache directory (default: %s)" % DefaultCacheDirectory())
+	parser.add_argument("--start", type=float, default=0, help="time in seconds to start rendering from")
+	parser.add_argument("--voices", type=int, default=0, help="play up to this many notes at once (default: only the latest note, as a square wave)")
+	parser.add_argument("--stealing", default=VoiceEngine.STEAL_OLDEST, choices=(VoiceEngine.STEAL_OLDEST, VoiceEngine.STEAL_QUIETEST, VoiceEngine.STEAL_NONE),
+		help="which voice a note takes over when all are playing, with --voices")
+	parser.add_argument("--waveform", default=None, choices=SHAPES, help="play the latest note with a band-limited wavetable of this shape (default: a plain square wave)")
+	parser.add_argument("--stream", default=None, choices=("stdout", "file", "portaudio"),
+		help="play one track as it is rendered: as raw 16 bit little endian PCM to stdout (for aplay or sox), to --stream-file at the rate it would be played, or through PortAudio")
+	parser.add_argument("--stream-file", default=os.devnull, help="file written by --stream file (default: %s)" % os.devnull)
+	parser.add_argument("--track", type=int, default=None, help="track (or channel, for a format 0 file) to play with --stream (default: the first)")
+	parser.add_argument("--block-size", type=int, default=256, help="samples rendered at a time with --stream")
+	parser.add_argument("--buffer-blocks", type=int, default=4, help="blocks rendered ahead with --stream")
+	parser.add_argument("--latency", type=float, default=None, help="output latency in seconds to ask PortAudio for (default: the device's low latency)")
+	parser.add_argument("--note-cache", type=float, default=32, metavar="MB", help="megabytes of rendered notes kept to be copied when they are played again, for the monophonic waveforms written to files (0 for none)")
+	parser.add_argument("--float-timing", action="store_true", help="render the square wave with the times in floating point milliseconds, as GenerateWaveform does")
+	parser.add_argument("--mix", default=None, metavar="FILE", help="render the tracks in parallel and write their sum to this WAV file")
+	parser.add_argument("--jobs", type=int, default=None, help="worker processes rendering tracks with --mix (default: one per CPU)")
+	parser.add_argument("--gain", action="append", default=[], metavar="TRACK=DB", help="gain in decibels of a track (or channel) in the --mix (may be repeated)")
+	parser.add_argument("--headroom", type=float, default=1.0, help="decibels below full scale of the peak of the --mix (default: 1)")
+	parser.add_argument("--clip", action="store_true", help="with --mix, reduce the mix by --headroom and clip it, rather than scaling it to fit")
+	parser.add_argument("--profile", action="store_true", help="print the time taken by each stage, the real time factor and the peak memory to stderr")
+	parser.add_argument("--profile-json", metavar="FILE", help="with --profile, also write them to this file as JSON")
+	args = parser.parse_args()
+	if args.cache and args.start != 0:
+		parser.error("--start can't be used with --cache")
+	if args.waveform and args.voices > 0:
+		parser.error("--waveform can't be used with --voices")
+	if args.float_timing and (args.voices > 0 or args.waveform or args.stream or args.mix):
+		parser.error("--float-timing can only be used for the plain square wave written to files")
+	if args.mix and (args.cache or args.stream):
+		parser.error("--mix can't be used with --cache or --stream")
+	# a compiled schedule is played as it is, from the start, with its times in samples
+	from schedule import IsSchedule, Schedule, ScheduleSource, CompileSchedule
+	compiled = None
+	if IsSchedule(args.file):
+		if args.cache or args.start != 0 or args.float_timing or args.mix:
+			parser.error("--cache, --start, --float-timing and --mix can't be used with a compiled schedule")
+		compiled = Schedule(args.file)
+		# a schedule that is out of date with the MIDI file beside it is compiled again
+		source = ScheduleSource(args.file)
+		if source != None:
+			sourceFile = open(source, "r")
+			sourceData = MapFile(sourceFile)
+			sourceFile.close()
+			if not compiled.CompiledFrom(sourceData):
+				print >>sys.stderr, "%s has changed since %s was compiled, compiling it again" % (source, args.file)
+				sampleRate = compiled.sampleRate
+				compiled.close()
+				CompileSchedule(source, args.file, sampleRate)
+				compiled = Schedule(args.file)
+	if args.profile and args.stream:
+		# the stages would run in two threads at once
+		parser.error("--profile can't be used with --stream")
+	trackGainsDb = dict()
+	for gain in args.gain:
+		try:
+			(track, db) = gain.split("=")
+			trackGainsDb[int(track)] = float(db)
+		except ValueError:
+			parser.error("--gain takes TRACK=DB, not %s" % gain)
+	SampleRate=44100
+	if args.profile:
+		from profiler import Profiler
+		profiler = Profiler()
+		measure = profiler.Measure
+		stage = profiler.Stage
+	else:
+		profiler = None
+		measure = lambda name, fn, *args, **counts: fn(*args)
+		stage = lambda name, iterable, samples=False: iterable
+	startMillis = 0
+	startSample = 0
+	startTick = 0
+	# Type 0 MIDI files are synthesised by separate channels
+	# Type 1 and 2 files are synthesised by track
+	if compiled != None:
+		if compiled.sampleRate != SampleRate:
+			parser.error("the schedule is compiled for %d Hz, not %d Hz" % (compiled.sampleRate, SampleRate))
+		hdr = {"formatType": compiled.formatType}
+		range = compiled.Tracks()
+	elif args.cache:
+		(midiData, hdr, chunkIdx, tracks) = measure("MIDICache.Load", MIDICache(args.cache_dir).Load, args.file)
+		tempoMap = TempoMap(hdr, GetTempoChangeEventsColumnar(tracks[0]))
+		if hdr["formatType"] == 0:
+			eventsPerChannel = FilterColumnarByChannel(tracks[0])
+			range = sorted(eventsPerChannel.keys())
+			trackEvents = lambda i: eventsPerChannel[i].Events()
+		else:
+			range = xrange(1, hdr["numTracks"])
+			trackEvents = lambda i: tracks[i].Events()
+	else:
+		# Events are decoded as they are synthesised, so that no track is held in memory
+		midiFile=open(args.file, "r")
+		midiData = measure("MapFile", MapFile, midiFile)
+		midiFile.close()
+		chunkIdx = measure("FindRiffChunks", FindRiffChunksFromBuffer, midiData)
+		hdr = measure("DecodeHeader", DecodeHeaderFromBuffer, midiData, chunkIdx)
+		tempoMap = measure("TempoMap", lambda: TempoMap(hdr, GetTempoChangeEventsFromBuffer(midiData, chunkIdx, 0)))
+		if args.start != 0:
+			# start from the first tick at or after the requested time, skipping earlier events using a track index
+			startTick = int(math.ceil(tempoMap.MillisToTick(1000*args.start)))
+			startMillis = tempoMap.TickToMillis(startTick)
+			startSample = tempoMap.TickToSample(startTick, SampleRate)
+			iterTrack = lambda trackNum: IterTrackFrom(midiData, chunkIdx, IndexTrack(midiData, chunkIdx, trackNum), startTick)
+		else:
+			iterTrack = lambda trackNum: IterTrack(midiData, chunkIdx, trackNum)
+		if hdr["formatType"] == 0:
+			range = FindTrackChannels(midiData, chunkIdx, 0)
+			if args.stream:
+				# only the one channel is played, so it can be picked out as the track is decoded
+				trackEvents = lambda i: IterChannelEvents(iterTrack(0), i)
+			else:
+				# the track is decoded once and split by channel, rather than decoded again for each channel;
+				# each channel's events are let go once they have been asked for
+				eventsPerChannel = dict()
+				def trackEvents(i):
+					if not eventsPerChannel:
+						eventsPerChannel.update(FilterEventsByChannel(iterTrack(0)))
+					return eventsPerChannel.pop(i)
+		else:
+			range = xrange(1, hdr["numTracks"])
+			trackEvents = iterTrack
+	# raw samples streamed to stdout leave only stderr for messages
+	log = sys.stderr if args.stream == "stdout" else sys.stdout
+	def renderTrack(i, blockSize=None, cache=None):
+		if compiled != None:
+			return RenderTrackCommands(stage("Schedule.Commands", compiled.Commands(i)), stage("Schedule.Notes", compiled.Notes(i)),
+				SampleRate, args.voices, args.stealing, args.waveform, blockSize, log, cache, profiler)
+		timedEvents = stage("TrackTimeToSamples", TrackTimeToSamples(hdr, stage("decode", trackEvents(i)), tempoMap, SampleRate, startSample))
+		return RenderTrack(timedEvents, SampleRate, args.voices, args.stealing, args.waveform, blockSize, log, cache, profiler)
+	if args.mix:
+		from mixdown import MixTracks
+		print "writing %s" % args.mix
+		wavFile = WAVWriter(open(args.mix, "wb"), SampleRate=SampleRate)
+		# the tracks are rendered in other processes, so only the whole mix is timed
+		mix = measure("MixTracks", lambda: MixTracks(args.file, wavFile, list(range), trackGainsDb, args.headroom, not args.clip, args.jobs, startTick,
+			sampleRate=SampleRate, voices=args.voices, stealing=args.stealing, waveform=args.waveform))
+		wavFile.close()
+		print "peak %.3f, gain %s dB, %d samples clipped" % (mix["peak"], "%.1f" % mix["gainDb"] if mix["gainDb"] != None else "-", mix["clipped"])
+		if profiler != None:
+			profiler.stages["MixTracks"]["samples"] = wavFile.dataChunkSize / wavFile.BlockAlign
+			profiler.audioSeconds = float(wavFile.dataChunkSize / wavFile.BlockAlign) / SampleRate
+			profiler.Print()
+			if args.profile_json:
+				profiler.WriteJSON(args.profile_json)
+		sys.exit(0)
+	if args.stream:
+		if args.track == None:
+			args.track = list(range)[0]
+		elif args.track not in range:
+			parser.error("there's no track (or channel) %d to play" % args.track)
+		if args.stream == "stdout":
+			sink = PipeSink(sys.stdout)
+		elif args.stream == "file":
+			sink = FileSink(open(args.stream_file, "wb"), SampleRate)
+		else:
+			try:
+				sink = PortAudioSink(SampleRate, args.block_size, args.latency)
+			except (IOError, OSError), e:
+				parser.error(str(e))
+		print >>log, "playing %s %d" % ("channel" if hdr["formatType"] == 0 else "track", args.track)
+		stream = AudioStream(sink, args.block_size, args.buffer_blocks, SampleRate)
+		try:
+			stream.Play(renderTrack(args.track, args.block_size))
+		finally:
+			sink.close()
+		print >>log, stream.Report()
+		sys.exit(0)
+	# the notes of every track share one cache
+	noteCache = NoteCache(int(args.note_cache * 1024 * 1024)) if args.note_cache > 0 and args.voices == 0 else None
+	for i in range:
+		if hdr["formatType"] == 0:
+			filename = "channel%d.wav" % i
+		else:
+			filename = "track%d.wav" % i
+		print "writing %s" % filename
+		outFile = open(filename, "wb")
+		if profiler != None:
+			outFile = profiler.File("write (I/O)", outFile)
+		wavFile = WAVWriter(outFile, SampleRate=SampleRate)
+		if args.float_timing:
+			timedMillis = stage("TrackTimeToMillis", TrackTimeToMillis(hdr, stage("decode", trackEvents(i)), tempoMap, startMillis))
+			blocks = stage("RenderBlocks", RenderBlocks(stage("ExtractMonophonicNotes", ExtractMonophonicNotes(timedMillis)), 1000.0/SampleRate), samples=True)
+		else:
+			blocks = renderTrack(i, cache=noteCache)
+		measure("WriteBlocksLE16", WriteBlocksLE16, blocks, wavFile)
+		wavFile.close()
+		if profiler != None:
+			profiler.audioSeconds += float(wavFile.dataChunkSize / wavFile.BlockAlign) / SampleRate
+	if noteCache != None and not args.float_timing:
+		print noteCache.Report()
+	if profiler != None:
+		profiler.Print()
+		if args.profile_json:
+			profiler.WriteJSON(args.profile_json)
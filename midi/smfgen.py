@@ -0,0 +1,144 @@
+#!/usr/bin/python
+
+from mididecode import EncodeVariableLengthNumber, FindRiffChunksFromBuffer, DecodeTrackFromBuffer
+
+import argparse, os, random, struct
+
+"""Returns the bytes of a track chunk of eventsPerTrack random note events on the given channel.
+Notes follow one another with random lengths and gaps, occasionally overlapping. If tempo is set, the track
+starts with a Set Tempo event of that many microseconds per quarter note, and tempoChangeEvery > 0 inserts
+a random tempo change every that many events. runningStatus is the probability of an event leaving out
+its status byte, where the previous event allows it. If riff > 0, only the first riff note events are random,
+and are then played over and over, as in a riff; it can't be used with tempoChangeEvery."""
+def GenerateTrack(rng, channel, eventsPerTrack, tempo=None, tempoChangeEvery=0, runningStatus=1.0, name=None, riff=0):
+	assert riff == 0 or tempoChangeEvery == 0
+	track = []
+	if name != None:
+		track.append(EncodeVariableLengthNumber(0) + "\xff\x03" + EncodeVariableLengthNumber(len(name)) + name)
+	if tempo != None:
+		track.append(EncodeVariableLengthNumber(0) + "\xff\x51\x03" + struct.pack(">I", tempo)[1:])
+	track.append(EncodeVariableLengthNumber(0) + chr(0xC0 | channel) + chr(rng.randint(0, 127)))
+	previousStatus = None
+	note = None
+	riffStart = len(track)
+	for i in xrange(0, eventsPerTrack):
+		if riff > 0 and i >= riff:
+			# the first event of the riff always has its status byte, so it can follow the last
+			track.append(track[riffStart + i % riff])
+			continue
+		if tempoChangeEvery > 0 and i > 0 and i % tempoChangeEvery == 0:
+			track.append(EncodeVariableLengthNumber(0) + "\xff\x51\x03" + struct.pack(">I", rng.randint(300000, 1000000))[1:])
+			# meta events cancel running status
+			previousStatus = None
+		if note == None or rng.random() < 0.1:
+			# start a note, sometimes before the previous one has been released
+			note = rng.randint(36, 96)
+			status = 0x90 | channel
+			message = chr(note) + chr(rng.randint(1, 127))
+		elif rng.random() < 0.5:
+			# release with a Note On of velocity 0, which keeps running status going
+			status = 0x90 | channel
+			message = chr(note) + "\0"
+			note = None
+		else:
+			status = 0x80 | channel
+			message = chr(note) + chr(64)
+			note = None
+		if status != previousStatus or rng.random() >= runningStatus:
+			message = chr(status) + message
+		previousStatus = status
+		track.append(EncodeVariableLengthNumber(rng.randint(0, 480)) + message)
+	track.append(EncodeVariableLengthNumber(0) + "\xff\x2f\x00")
+	data = "".join(track)
+	return "MTrk" + struct.pack(">L", len(data)) + data
+
+"""Returns the bytes of a Standard MIDI File of random notes. A format 0 file has a single track holding
+numTracks channels of eventsPerTrack events each, interleaved; a format 1 file has a tempo track followed
+by numTracks note tracks. See GenerateTrack for the other parameters."""
+def GenerateSMF(formatType=1, numTracks=4, eventsPerTrack=1000, tempoChangeEvery=0, runningStatus=1.0, ticksPerBeat=480, seed=0, riff=0):
+	rng = random.Random(seed)
+	if formatType == 0:
+		tracks = [GenerateFormat0Track(rng, numTracks, eventsPerTrack, tempoChangeEvery, runningStatus, riff)]
+	else:
+		# format 1 keeps the tempo changes in the first track, spread over about the length of the note tracks
+		if tempoChangeEvery > 0:
+			tracks = [GenerateTempoTrack(rng, eventsPerTrack / tempoChangeEvery, 240 * tempoChangeEvery)]
+		else:
+			tracks = [GenerateTempoTrack(rng, 0, 0)]
+		for trackNum in xrange(1, numTracks + 1):
+			tracks.append(GenerateTrack(rng, (trackNum - 1) % 16, eventsPerTrack, runningStatus=runningStatus, name="track %d" % trackNum, riff=riff))
+	return "MThd" + struct.pack(">LHHH", 6, formatType, len(tracks), ticksPerBeat) + "".join(tracks)
+
+"""Returns a tempo track of count random tempo changes, spaced interval ticks apart."""
+def GenerateTempoTrack(rng, count, interval):
+	track = [EncodeVariableLengthNumber(0) + "\xff\x51\x03" + struct.pack(">I", 500000)[1:]]
+	for i in xrange(0, count):
+		track.append(EncodeVariableLengthNumber(interval) + "\xff\x51\x03" + struct.pack(">I", rng.randint(300000, 1000000))[1:])
+	track.append(EncodeVariableLengthNumber(0) + "\xff\x2f\x00")
+	data = "".join(track)
+	return "MTrk" + struct.pack(">L", len(data)) + data
+
+"""Returns a single track holding numChannels channels of random notes, merged in time order, as in a format 0 file."""
+def GenerateFormat0Track(rng, numChannels, eventsPerChannel, tempoChangeEvery, runningStatus, riff=0):
+	# generate each channel as its own track, then merge them by absolute time
+	merged = []
+	for channel in xrange(0, numChannels):
+		chunk = GenerateTrack(rng, channel % 16, eventsPerChannel, tempo=(500000 if channel == 0 else None),
+			tempoChangeEvery=(tempoChangeEvery if channel == 0 else 0), runningStatus=runningStatus, riff=riff)
+		events = DecodeTrackFromBuffer(chunk, FindRiffChunksFromBuffer(chunk), 0)
+		# drop the End Of Track, one is added after the merge
+		merged.extend([(time, channel, i, str(event.messageData)) for (i, (time, event)) in enumerate(events[:-1])])
+	merged.sort()
+	track = []
+	previousTime = 0
+	previousStatus = None
+	for (time, channel, i, message) in merged:
+		status = ord(message[0])
+		if status == previousStatus and status < 0xF0 and rng.random() < runningStatus:
+			message = message[1:]
+		previousStatus = status
+		track.append(EncodeVariableLengthNumber(time - previousTime) + message)
+		previousTime = time
+	track.append(EncodeVariableLengthNumber(0) + "\xff\x2f\x00")
+	data = "".join(track)
+	return "MTrk" + struct.pack(">L", len(data)) + data
+
+"""Named GenerateSMF settings covering the shapes of file the decoder and synth see: small and large files,
+many tracks, frequent tempo changes, no running status, format 0 and a riff repeated throughout."""
+CORPUS = [
+	("small", dict(formatType=1, numTracks=2, eventsPerTrack=500)),
+	("dense", dict(formatType=1, numTracks=4, eventsPerTrack=50000)),
+	("many-tracks", dict(formatType=1, numTracks=48, eventsPerTrack=2000)),
+	("tempo-changes", dict(formatType=1, numTracks=4, eventsPerTrack=10000, tempoChangeEvery=20)),
+	("no-running-status", dict(formatType=1, numTracks=4, eventsPerTrack=10000, runningStatus=0.0)),
+	("format0", dict(formatType=0, numTracks=8, eventsPerTrack=10000, tempoChangeEvery=100)),
+	("riff", dict(formatType=1, numTracks=2, eventsPerTrack=10000, riff=16)),
+]
+
+"""Writes the CORPUS files into directory, returning a list of (name, path)."""
+def WriteCorpus(directory):
+	ret = []
+	for (name, settings) in CORPUS:
+		path = os.path.join(directory, name + ".mid")
+		file = open(path, "wb")
+		file.write(GenerateSMF(**settings))
+		file.close()
+		ret.append((name, path))
+	return ret
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Writes a Standard MIDI File of random notes, for benchmarking.")
+	parser.add_argument("file")
+	parser.add_argument("--format", type=int, default=1, choices=(0, 1))
+	parser.add_argument("--tracks", type=int, default=4, help="number of note tracks (channels, for format 0)")
+	parser.add_argument("--events", type=int, default=1000, help="note events per track")
+	parser.add_argument("--tempo-change-every", type=int, default=0, help="events between tempo changes (0 for none)")
+	parser.add_argument("--running-status", type=float, default=1.0, help="probability of using running status where possible")
+	parser.add_argument("--riff", type=int, default=0, help="note events repeated over and over (0 for all random)")
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args()
+	if args.riff > 0 and args.tempo_change_every > 0:
+		parser.error("--riff can't be used with --tempo-change-every")
+	file = open(args.file, "wb")
+	file.write(GenerateSMF(args.format, args.tracks, args.events, args.tempo_change_every, args.running_status, seed=args.seed, riff=args.riff))
+	file.close()
@@ -0,0 +1,175 @@
+#!/usr/bin/python
+
+from array import array
+from bisect import bisect_right
+
+"""Converts between track time in ticks and milliseconds from the start of the track, for a track's
+list of (time, microsecondsPerQuarterNote) tempo changes, as returned by GetTempoChangeEvents.
+The time in milliseconds at each tempo change is worked out once, when the map is built, so a
+conversion is a binary search for the tempo in force, rather than a walk from the start of the track.
+As in a forward walk, ticks before the first tempo change are all at 0 milliseconds.
+The times are also kept exactly, as whole numbers of microseconds / ticksPerBeat, so that ticks can be
+converted to sample positions with no rounding but the last, however long the track."""
+class TempoMap:
+	def __init__(self, hdr, tempoChangeEvents):
+		assert hdr["divisionType"]=="TICKS_PER_BEAT"
+		ticksPerBeat = hdr["timeDivision"]
+		# there is no tempo in force before the first change
+		self.ticks = array("d", [0])
+		self.millis = array("d", [0])
+		self.millisPerTick = array("d", [0])
+		self.ticksPerBeat = ticksPerBeat
+		self.scaledMicros = [0]
+		self.tempos = [0]
+		for (time, mpqn) in tempoChangeEvents:
+			assert time >= self.ticks[-1]
+			self.millis.append(self.millis[-1] + (time - self.ticks[-1]) * self.millisPerTick[-1])
+			self.scaledMicros.append(self.scaledMicros[-1] + (time - int(self.ticks[-1])) * self.tempos[-1])
+			self.ticks.append(time)
+			self.millisPerTick.append(0.001*mpqn/ticksPerBeat)
+			self.tempos.append(mpqn)
+		if len(self.ticks) == 1:
+			# there should be tempo setting at the start
+			raise AssertionError
+
+	"""Returns the time in milliseconds of the given track time in ticks."""
+	def TickToMillis(self, tick):
+		i = bisect_right(self.ticks, tick) - 1
+		return self.millis[i] + (tick - self.ticks[i]) * self.millisPerTick[i]
+
+	"""Returns the position at sampleRate of the given track time in ticks: the first sample at or after it."""
+	def TickToSample(self, tick, sampleRate):
+		i = bisect_right(self.ticks, tick) - 1
+		scaledMicros = self.scaledMicros[i] + (tick - int(self.ticks[i])) * self.tempos[i]
+		return -(-scaledMicros * sampleRate // (self.ticksPerBeat * 1000000))
+
+	"""Returns the track time in ticks (possibly fractional) of the given time in milliseconds."""
+	def MillisToTick(self, millis):
+		i = bisect_right(self.millis, millis) - 1
+		if self.millisPerTick[i] == 0:
+			# only possible before the first tempo change, where all ticks map to the same time
+			return self.ticks[i]
+		return self.ticks[i] + (millis - self.millis[i]) / self.millisPerTick[i]
+
+	"""Converts a sequence of ticks to milliseconds, returning an array of doubles. While the ticks
+	increase (the usual case) the tempo in force is carried forward rather than searched for each time."""
+	def TicksToMillis(self, ticks):
+		ret = array("d")
+		end = len(self.ticks)
+		i = 0
+		for tick in ticks:
+			if tick < self.ticks[i]:
+				i = bisect_right(self.ticks, tick) - 1
+			else:
+				while i + 1 < end and self.ticks[i + 1] <= tick:
+					i += 1
+			ret.append(self.millis[i] + (tick - self.ticks[i]) * self.millisPerTick[i])
+		return ret
+
+	"""Converts a sequence of times in milliseconds to ticks, returning an array of doubles. See TicksToMillis."""
+	def MillisToTicks(self, millis):
+		ret = array("d")
+		end = len(self.millis)
+		i = 0
+		for ms in millis:
+			if ms < self.millis[i]:
+				i = bisect_right(self.millis, ms) - 1
+			else:
+				while i + 1 < end and self.millis[i + 1] <= ms:
+					i += 1
+			if self.millisPerTick[i] == 0:
+				ret.append(self.ticks[i])
+			else:
+				ret.append(self.ticks[i] + (ms - self.millis[i]) / self.millisPerTick[i])
+		return ret
+
+"""Checks TickToSample against the exact position, worked out with fractions, of ticks spread over hours of a
+track with tempo changes, and checks that the notes rendered by RenderSquare from TrackTimeToSamples start and
+stop at exactly those positions over the whole track. Prints how far the positions worked out from TickToMillis,
+in floating point milliseconds, are off."""
+def CheckSampleTiming(hours=10, sampleRate=44100, renderHours=1, renderSampleRate=8000, seed=0):
+	from mididecode import MIDIEvent
+	from simplesynth import TrackTimeToMillis, TrackTimeToSamples, ExtractMonophonicNotes, RenderBlocks, RenderSquare
+	from fractions import Fraction
+	import math, random
+	rng = random.Random(seed)
+	for ticksPerBeat in (96, 480, 960, 1000):
+		hdr = {"formatType":1, "numTracks":2, "timeDivision":ticksPerBeat, "divisionType":"TICKS_PER_BEAT"}
+		# about a beat a second, with the tempo changing every few hundred beats
+		endTick = hours * 3600 * ticksPerBeat
+		tempoChangeEvents = [(0, 500000)]
+		while tempoChangeEvents[-1][0] < endTick:
+			tempoChangeEvents.append((tempoChangeEvents[-1][0] + rng.randint(1, 500 * ticksPerBeat), rng.randint(300000, 1500000)))
+		tempoMap = TempoMap(hdr, tempoChangeEvents)
+		# the exact time in seconds of each tempo change
+		changeSeconds = [Fraction(0)]
+		for ((time, mpqn), (nextTime, nextMpqn)) in zip(tempoChangeEvents, tempoChangeEvents[1:]):
+			changeSeconds.append(changeSeconds[-1] + Fraction((nextTime - time) * mpqn, ticksPerBeat * 1000000))
+		"""The exact time in seconds of tick."""
+		def exactSeconds(tick):
+			i = bisect_right([time for (time, mpqn) in tempoChangeEvents], tick) - 1
+			(time, mpqn) = tempoChangeEvents[i]
+			return changeSeconds[i] + Fraction((tick - time) * mpqn, ticksPerBeat * 1000000)
+		"""The first sample at or after tick, exactly."""
+		def exactSample(tick, rate):
+			position = exactSeconds(tick) * rate
+			return position.numerator / position.denominator + (1 if position.denominator > 1 and position > 0 else 0)
+		ticks = sorted([rng.randint(0, endTick) for i in xrange(0, 2000)] + [time for (time, mpqn) in tempoChangeEvents[:200]])
+		floatErrors = []
+		for tick in ticks:
+			expected = exactSample(tick, sampleRate)
+			assert tempoMap.TickToSample(tick, sampleRate) == expected, "tick %d at %d ticks per beat: sample %d, expected %d" % (
+				tick, ticksPerBeat, tempoMap.TickToSample(tick, sampleRate), expected)
+			floatErrors.append(abs(int(math.ceil(tempoMap.TickToMillis(tick) * sampleRate / 1000.0)) - expected))
+		print "%d ticks per beat: %d ticks over %d hours exact; from milliseconds, %d off by up to %d samples" % (
+			ticksPerBeat, len(ticks), hours, len([error for error in floatErrors if error != 0]), max(floatErrors))
+	# render notes separated by rests, so that each start and stop can be seen in the output
+	hdr = {"formatType":1, "numTracks":2, "timeDivision":480, "divisionType":"TICKS_PER_BEAT"}
+	endTick = renderHours * 3600 * 480
+	events = []
+	tick = 0
+	while tick < endTick:
+		tick += rng.randint(1, 960)
+		note = rng.randint(36, 96)
+		events.append((tick, MIDIEvent("\x90" + chr(note) + chr(100))))
+		tick += rng.randint(1, 960)
+		events.append((tick, MIDIEvent("\x80" + chr(note) + chr(0))))
+	events.append((tick, MIDIEvent("\xff\x2f\x00")))
+	tempoMap = TempoMap(hdr, [(time, rng.randint(300000, 1500000)) for time in xrange(0, endTick, 50000)])
+	expected = [tempoMap.TickToSample(time, renderSampleRate) for (time, event) in events]
+	# the sample at each start of a note is non zero, and the sample before each start (and at each stop) zero
+	checks = [(position, i % 2 == 0) for (i, position) in enumerate(expected[:-1])] + [(position - 1, False) for position in expected[:-1:2] if position > 0]
+	checks.sort()
+	"""Returns the number of samples rendered by blocks and the number of checks they fail."""
+	def check(blocks):
+		position = 0
+		failed = 0
+		c = 0
+		for block in blocks:
+			while c < len(checks) and checks[c][0] < position + len(block):
+				(at, sounding) = checks[c]
+				if (block[at - position] != 0) != sounding:
+					failed += 1
+				c += 1
+			position += len(block)
+		return (position, failed)
+	(samples, failed) = check(RenderSquare(ExtractMonophonicNotes(TrackTimeToSamples(hdr, iter(events), tempoMap, renderSampleRate)), renderSampleRate, 64*1024))
+	assert samples == expected[-1], "rendered %d samples, expected %d" % (samples, expected[-1])
+	assert failed == 0, "%d of %d note starts and stops rendered at the wrong sample" % (failed, len(checks))
+	print "%d notes over %d hour rendered at exactly the expected samples" % (len(events) / 2, renderHours)
+	(samples, failed) = check(RenderBlocks(ExtractMonophonicNotes(TrackTimeToMillis(hdr, iter(events), tempoMap)), 1000.0/renderSampleRate, 64*1024))
+	print "in floating point milliseconds, as GenerateWaveform, %d of %d note starts and stops are a sample out, and the track ends %d samples off" % (
+		failed, len(checks), samples - expected[-1])
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(description="Checks the conversion of ticks to sample positions.")
+	parser.add_argument("--check", action="store_true", help="check the sample positions against exact ones worked out with fractions")
+	parser.add_argument("--hours", type=int, default=10, help="length of the track checked")
+	args = parser.parse_args()
+	if args.check:
+		# TrackTimeToSamples takes the TempoMap class of the tempomap module, not of __main__
+		from tempomap import CheckSampleTiming
+		CheckSampleTiming(args.hours)
+	else:
+		parser.print_help()
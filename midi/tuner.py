@@ -0,0 +1,283 @@
+#!/usr/bin/python
+
+from pitch import MIN_FREQ, MAX_FREQ, ClosestNote, SyntheticTone
+from wavreader import WAVReader
+
+import numpy
+from numpy.lib.stride_tricks import as_strided
+
+import argparse, math, sys, time
+
+"""Finds the pitch of a stream of samples at sampleRate as it arrives, hop samples at a time, from the squared
+differences between each of the last window samples and those each period from minFreq to maxFreq before it.
+Only the differences of the hop that has arrived are worked out; they are added to a running total, from which
+those of the hop that has left the window are taken. The samples are held in a ring written twice over, so the
+latest are always in one piece, and every buffer is allocated up front, so a hop allocates nothing but views.
+From the totals, the clarity of each period (one less the difference over the energy of the samples compared,
+near 1 for a periodic signal) is worked out, and, as in McLeod's method, the shortest period whose clarity is
+a local maximum within peakRatio of the highest, once the clarity has first fallen below 0, is taken,
+interpolated between samples; below minClarity, there is no pitch. A pitch
+is found window + the longest period samples after a note starts, at the earliest."""
+class StreamingTuner:
+	def __init__(self, sampleRate=44100, hop=256, window=1024, minFreq=MIN_FREQ, maxFreq=MAX_FREQ, peakRatio=0.9, minClarity=0.5):
+		if window % hop != 0:
+			raise ValueError("the window (%d) must be a whole number of hops (%d)" % (window, hop))
+		self.sampleRate = sampleRate
+		self.hop = hop
+		self.window = window
+		self.peakRatio = peakRatio
+		self.minClarity = minClarity
+		self.minLag = max(2, int(sampleRate / maxFreq))
+		self.maxLag = int(math.ceil(sampleRate / minFreq)) + 1
+		# the ring holds the window, the longest period before it and a hop being written, in whole hops
+		self.ringLength = -(-(window + self.maxLag + hop) // hop) * hop
+		self.ring = numpy.zeros(2 * self.ringLength)
+		self.written = 0
+		lags = self.maxLag + 1
+		self.work = numpy.zeros((hop, lags))
+		# the differences of each hop in the window, in a ring of their own, and their total
+		self.hopDifferences = numpy.zeros((window / hop, lags))
+		self.differences = numpy.zeros(lags)
+		self.squares = numpy.zeros(self.ringLength + 1)
+		self.energy = numpy.zeros(lags)
+		self.past = numpy.zeros(lags)
+		self.clarity = numpy.zeros(lags)
+		self.negative = numpy.zeros(lags, dtype=bool)
+		self.rising = numpy.zeros(lags - 2, dtype=bool)
+		self.peaks = numpy.zeros(lags - 2, dtype=bool)
+		# where the squares summed for each period start and end, from the start of the ring's latest samples
+		self.pastEnd = self.ringLength - numpy.arange(lags)
+		self.pastStart = self.pastEnd - window
+		# after a Reset, the squares of the samples with only the silence it left a period before them
+		self.resetAt = None
+		self.lagRange = numpy.arange(lags)
+		self.unpairedEnd = numpy.zeros(lags, dtype=int)
+		self.unpaired = numpy.zeros(lags)
+		self.paired = numpy.zeros(lags)
+		# instrumentation, with the times of the latest hops kept for their percentiles
+		self.hops = 0
+		self.totalSeconds = 0.0
+		self.maxSeconds = 0.0
+		self.lastSeconds = 0.0
+		self.hopSeconds = numpy.zeros(4096)
+
+	"""Adds block, an array of hop samples, to the stream, returning (frequency, clarity) for the window that
+	ends with it, with a frequency of 0 where there is no pitch (or too few samples have arrived)."""
+	def Process(self, block):
+		start = time.clock()
+		n = self.ringLength
+		at = self.written % n
+		self.ring[at:at + self.hop] = block
+		self.ring[at + n:at + n + self.hop] = block
+		self.written += self.hop
+		latest = self.ring[at + self.hop:at + self.hop + n]
+		# each new sample less each of the maxLag samples before it
+		newest = latest[n - self.hop:]
+		stride = latest.strides[0]
+		before = as_strided(newest, shape=(self.hop, self.maxLag + 1), strides=(stride, -stride))
+		numpy.subtract(newest[:, None], before, out=self.work)
+		numpy.multiply(self.work, self.work, out=self.work)
+		slot = self.hops % len(self.hopDifferences)
+		numpy.subtract(self.differences, self.hopDifferences[slot], out=self.differences)
+		self.work.sum(axis=0, out=self.hopDifferences[slot])
+		if slot == len(self.hopDifferences) - 1:
+			# sum afresh once around the ring, so that rounding doesn't build up
+			self.hopDifferences.sum(axis=0, out=self.differences)
+		else:
+			numpy.add(self.differences, self.hopDifferences[slot], out=self.differences)
+		self.hops += 1
+		result = (0.0, 0.0)
+		if self.written >= self.window + self.maxLag:
+			result = self._pitch(latest)
+		self.lastSeconds = time.clock() - start
+		self.hopSeconds[(self.hops - 1) % len(self.hopSeconds)] = self.lastSeconds
+		self.totalSeconds += self.lastSeconds
+		self.maxSeconds = max(self.maxSeconds, self.lastSeconds)
+		return result
+
+	"""Forgets the samples so far, so that the pitch of a new note is found without waiting for the last one to
+	leave the window: until it has, only the samples since are compared, and only for periods they hold two of.
+	The instrumentation is kept."""
+	def Reset(self):
+		self.ring[:] = 0
+		self.hopDifferences[:] = 0
+		self.differences[:] = 0
+		self.resetAt = self.written
+
+	def _pitch(self, latest):
+		squares = self.squares
+		numpy.multiply(latest, latest, out=squares[1:])
+		numpy.cumsum(squares[1:], out=squares[1:])
+		# the energy of the window and of the samples each period before it
+		numpy.take(squares, self.pastEnd, out=self.energy)
+		numpy.take(squares, self.pastStart, out=self.past)
+		numpy.subtract(self.energy, self.past, out=self.energy)
+		numpy.add(self.energy, self.energy[0], out=self.energy)
+		differences = self.differences
+		sinceReset = None
+		if self.resetAt != None and self.written - self.resetAt < self.window + self.maxLag:
+			# the samples within a period after the Reset were compared with the silence it left, which adds
+			# their squares to both the differences and the energy; take them out
+			sinceReset = self.written - self.resetAt
+			reset = self.ringLength - sinceReset
+			first = max(reset, self.ringLength - self.window)
+			numpy.add(self.lagRange, reset, out=self.unpairedEnd)
+			numpy.clip(self.unpairedEnd, first, self.ringLength, out=self.unpairedEnd)
+			numpy.take(squares, self.unpairedEnd, out=self.unpaired)
+			numpy.subtract(self.unpaired, squares[first], out=self.unpaired)
+			numpy.subtract(self.energy, self.unpaired, out=self.energy)
+			numpy.subtract(differences, self.unpaired, out=self.paired)
+			differences = self.paired
+			# periods too long for the samples since, whose clarity is cleared below, without dividing by 0
+			self.energy[sinceReset / 2 + 1:] = 1
+		if self.energy[0] <= 0:
+			return (0.0, 0.0)
+		clarity = self.clarity
+		numpy.divide(differences, self.energy, out=clarity)
+		numpy.subtract(1, clarity, out=clarity)
+		if sinceReset != None:
+			# too few samples since the Reset to hold two of each longer period
+			clarity[sinceReset / 2 + 1:] = 0
+		# local maxima of the clarity up to the longest period, after it first falls below 0: before then, the
+		# samples are only alike for being close together
+		numpy.less(clarity, 0, out=self.negative)
+		first = self.negative.argmax()
+		if not self.negative[first]:
+			return (0.0, 0.0)
+		numpy.greater(clarity[1:-1], clarity[:-2], out=self.rising)
+		numpy.greater_equal(clarity[1:-1], clarity[2:], out=self.peaks)
+		numpy.logical_and(self.peaks, self.rising, out=self.peaks)
+		self.peaks[:max(first, self.minLag) - 1] = False
+		lags = numpy.flatnonzero(self.peaks) + 1
+		if len(lags) == 0:
+			return (0.0, 0.0)
+		values = clarity[lags]
+		best = values.max()
+		if best < self.minClarity:
+			return (0.0, best)
+		lag = lags[numpy.argmax(values >= self.peakRatio * best)]
+		# noise makes small maxima on the way up to the one of the period; take the highest within a quarter of it
+		start = max(first, lag - lag / 4)
+		lag = start + clarity[start:min(self.maxLag, lag + lag / 4 + 1)].argmax()
+		(before, at, after) = (clarity[lag - 1], clarity[lag], clarity[lag + 1])
+		curvature = before - 2 * at + after
+		shift = 0.5 * (before - after) / curvature if curvature < 0 else 0.0
+		return (self.sampleRate / (lag + shift), at - 0.25 * (before - after) * shift)
+
+	"""Returns a line summarising the time taken to process each hop, against the time it lasts."""
+	def Report(self):
+		if self.hops == 0:
+			return "nothing processed"
+		hopLength = float(self.hop) / self.sampleRate
+		mean = self.totalSeconds / self.hops
+		latest = self.hopSeconds[:min(self.hops, len(self.hopSeconds))]
+		return "%d hops of %.2f ms: %.3f ms/hop on average, 99%% of the latest within %.3f ms, max %.3f ms, load %.1f%%" % (
+			self.hops, 1000 * hopLength, 1000 * mean, 1000 * numpy.percentile(latest, 99), 1000 * self.maxSeconds, 100 * mean / hopLength)
+
+"""Yields the blocks of hop samples, scaled to between -1 and 1, read from file, raw 16 bit little endian mono PCM
+such as arecord or sox writes to a pipe, until it ends. Each block is read into the same buffer, so it must be
+used before the next is read."""
+def ReadRawBlocks(file, hop):
+	raw = bytearray(2 * hop)
+	samples = numpy.frombuffer(raw, dtype="<i2")
+	block = numpy.zeros(hop)
+	while True:
+		count = file.readinto(raw)
+		if count < len(raw):
+			return
+		numpy.multiply(samples, 1 / 32768.0, out=block)
+		yield block
+
+"""As ReadRawBlocks, for a WAV file, opened as reader, a WAVReader, standing in for a live stream, averaging its
+channels. If realtime is set, each block is given no sooner than it would have been recorded."""
+def ReadWAVBlocks(reader, hop, realtime=False):
+	block = numpy.zeros(hop)
+	started = time.time()
+	read = 0
+	for samples in reader.Blocks(hop):
+		numpy.mean(reader.ToFloat(samples), axis=1, out=block)
+		read += hop
+		if realtime:
+			wait = started + float(read) / reader.SampleRate - time.time()
+			if wait > 0:
+				time.sleep(wait)
+		yield block
+
+"""Plays a tuner, made by makeTuner(), a note at each of frequencies, as a plucked string starting after a
+moment's silence, with noise at noiseLevel, and returns the results as a list of dicts, one per note, with:
+	latency		milliseconds from the note starting to the end of the hop in which a pitch within cents of
+			it is first found, plus the time taken to process that hop
+	steady		standard deviation, in cents, of the pitch found from then over the next holdSeconds
+	worst		the furthest, in cents, that pitch is from the note played
+	dropouts	hops in that time in which no pitch is found."""
+def MeasureNotes(makeTuner, frequencies, sampleRate=44100, noiseLevel=0.02, holdSeconds=1.0, cents=10.0):
+	results = []
+	for frequency in frequencies:
+		tuner = makeTuner()
+		hop = tuner.hop
+		silence = int(0.1 * sampleRate) / hop * hop
+		signal = numpy.concatenate((numpy.zeros(silence), SyntheticTone(frequency, sampleRate, holdSeconds + 0.5, "pluck")))
+		signal += noiseLevel * 0.5 * numpy.random.RandomState(0).standard_normal(len(signal))
+		found = None
+		pitches = []
+		for start in xrange(0, len(signal) - hop + 1, hop):
+			(pitch, clarity) = tuner.Process(signal[start:start + hop])
+			end = start + hop
+			if found == None and end > silence and pitch > 0 and abs(1200 * math.log(pitch / frequency, 2)) <= cents:
+				found = 1000.0 * (end - silence) / sampleRate + 1000 * tuner.lastSeconds
+				heldUntil = end + int(holdSeconds * sampleRate)
+			elif found != None and end <= heldUntil:
+				pitches.append(pitch)
+		pitches = numpy.array(pitches)
+		heard = pitches[pitches > 0]
+		deviation = 1200 * numpy.log2(heard / frequency) if len(heard) > 0 else numpy.zeros(1)
+		results.append({"frequency": frequency, "latency": found, "steady": deviation.std(), "worst": abs(deviation).max(),
+			"dropouts": len(pitches) - len(heard), "report": tuner.Report()})
+	return results
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Tunes a guitar from a live stream of samples, printing the pitch as it is found.")
+	parser.add_argument("file", nargs="?", help="16 bit PCM WAV file standing in for the stream, or - for raw 16 bit little endian mono PCM on stdin")
+	parser.add_argument("--sample-rate", type=int, default=44100, help="sample rate of the raw PCM on stdin")
+	parser.add_argument("--hop", type=int, default=256, help="samples taken at a time")
+	parser.add_argument("--window", type=int, default=1024, help="samples compared with those a period before")
+	parser.add_argument("--min-freq", type=float, default=MIN_FREQ)
+	parser.add_argument("--max-freq", type=float, default=MAX_FREQ)
+	parser.add_argument("--realtime", action="store_true", help="read the WAV file no faster than it would be recorded")
+	parser.add_argument("--measure", action="store_true", help="measure the latency and steadiness of the pitch found for plucked strings")
+	args = parser.parse_args()
+	makeTuner = lambda sampleRate: StreamingTuner(sampleRate, args.hop, args.window, args.min_freq, args.max_freq)
+	if args.measure:
+		# the open strings of a guitar, and notes up the neck of the top string
+		frequencies = [82.41, 110.0, 146.83, 196.0, 246.94, 329.63, 440.0, 659.26, 987.77]
+		try:
+			results = MeasureNotes(lambda: makeTuner(args.sample_rate), frequencies, args.sample_rate)
+		except ValueError, e:
+			parser.error(str(e))
+		for result in results:
+			print "%8.2f Hz: latency %s, steady to %.2f cents (worst %.2f), %d dropouts" % (result["frequency"],
+				"%.1f ms" % result["latency"] if result["latency"] != None else "never found", result["steady"], result["worst"], result["dropouts"])
+		print results[-1]["report"]
+		sys.exit(0)
+	if args.file == None:
+		parser.error("a WAV file, - or --measure is needed")
+	try:
+		if args.file == "-":
+			sampleRate = args.sample_rate
+			blocks = ReadRawBlocks(sys.stdin, args.hop)
+		else:
+			reader = WAVReader(args.file)
+			sampleRate = reader.SampleRate
+			blocks = ReadWAVBlocks(reader, args.hop, args.realtime)
+		tuner = makeTuner(sampleRate)
+	except ValueError, e:
+		parser.error(str(e))
+	for (i, block) in enumerate(blocks):
+		(frequency, clarity) = tuner.Process(block)
+		at = float((i + 1) * args.hop) / sampleRate
+		if frequency > 0:
+			(midiNote, name, cents) = ClosestNote(frequency)
+			print "%8.3f s %9.3f Hz  %-4s %+6.1f cents  clarity %.2f" % (at, frequency, name, cents, clarity)
+		else:
+			print "%8.3f s         -                          clarity %.2f" % (at, clarity)
+	print >>sys.stderr, tuner.Report()
@@ -0,0 +1,184 @@
+#!/usr/bin/python
+
+from polysynth import MIDINoteFrequencyHz
+
+from array import array
+import argparse, math, operator
+
+# a table holds one cycle of the waveform in 2**TABLE_BITS samples
+TABLE_BITS = 11
+TABLE_SIZE = 1 << TABLE_BITS
+# the phase of an oscillator is a 32 bit fraction of a cycle, of which the top TABLE_BITS index the table
+PHASE_BITS = 32
+PHASE_MASK = (1 << PHASE_BITS) - 1
+INDEX_SHIFT = PHASE_BITS - TABLE_BITS
+
+SHAPES = ("sine", "saw", "square", "triangle")
+
+_phaseIncrements = dict()
+_octaveTables = dict()
+
+"""Returns an array of the phase increment per sample of each MIDI note (0-127) at sampleRate. Notes above the
+sample rate would need more than PHASE_BITS, so are wrapped as the phase is, which plays the same samples
+and keeps each one in an unsigned long, which is 32 bits on the Pi."""
+def PhaseIncrements(sampleRate):
+	if sampleRate not in _phaseIncrements:
+		_phaseIncrements[sampleRate] = array("L", [int(round(MIDINoteFrequencyHz(note) / sampleRate * (1 << PHASE_BITS))) & PHASE_MASK for note in xrange(0, 128)])
+	return _phaseIncrements[sampleRate]
+
+"""Returns the amplitude of harmonic k (1 for the fundamental) of the given shape, relative to the fundamental."""
+def HarmonicGain(shape, k):
+	if shape == "sine":
+		return 1.0 if k == 1 else 0.0
+	elif shape == "saw":
+		return (-1)**(k + 1) / float(k)
+	elif shape == "square":
+		return 1.0 / k if k % 2 == 1 else 0.0
+	elif shape == "triangle":
+		return (-1)**((k - 1) / 2) / float(k*k) if k % 2 == 1 else 0.0
+	raise ValueError("unknown waveform %s" % shape)
+
+"""Returns a cycle of the given shape for each of the numbers of harmonics in harmonicCounts, as arrays of
+TABLE_SIZE signed 16 bit samples peaking at amplitude. Each is the sum of the shape's first harmonics sine
+waves, so a table with few enough of them for the notes it plays has none above the Nyquist frequency. The
+harmonics are added once, in order, taking a copy of the sum at each of the counts."""
+def BuildWavetables(shape, harmonicCounts, amplitude=0x7fff):
+	sine = [math.sin(2 * math.pi * i / TABLE_SIZE) for i in xrange(0, TABLE_SIZE)]
+	cycle = [0.0] * TABLE_SIZE
+	tables = dict()
+	k = 0
+	for harmonics in sorted(set(harmonicCounts)):
+		while k < harmonics:
+			k += 1
+			gain = HarmonicGain(shape, k)
+			if gain != 0.0:
+				harmonic = [sine[i & (TABLE_SIZE - 1)] for i in xrange(0, k * TABLE_SIZE, k)]
+				cycle = map(operator.add, cycle, map(gain.__mul__, harmonic))
+		scale = amplitude / max(map(abs, cycle))
+		tables[harmonics] = array("h", [int(round(x * scale)) for x in cycle])
+	return [tables[harmonics] for harmonics in harmonicCounts]
+
+"""Returns the number of harmonics in the table for each octave of notes at sampleRate: as many as the highest
+note of the octave has below the Nyquist frequency, up to as many as a table can hold."""
+def OctaveHarmonics(sampleRate):
+	harmonicCounts = []
+	for octave in xrange(0, 11):
+		highest = MIDINoteFrequencyHz(min(octave*12 + 11, 127))
+		harmonicCounts.append(max(1, min(TABLE_SIZE/2 - 1, int(sampleRate / 2.0 / highest))))
+	return harmonicCounts
+
+"""The wavetables of one shape at one sample rate. Each octave of notes has its own table, with the harmonics
+given by OctaveHarmonics, so lower notes keep more of their harmonics and no note aliases. The tables are made once for each shape
+and sample rate, and those scaled for each velocity as they are first needed."""
+class WavetableBank:
+	def __init__(self, shape, sampleRate=44100):
+		self.shape = shape
+		self.sampleRate = sampleRate
+		self.phaseIncrements = PhaseIncrements(sampleRate)
+		if (shape, sampleRate) not in _octaveTables:
+			_octaveTables[(shape, sampleRate)] = BuildWavetables(shape, OctaveHarmonics(sampleRate))
+		self.octaveTables = _octaveTables[(shape, sampleRate)]
+		self.scaledTables = dict()
+
+	"""Returns the table for note played at velocity (1-127)."""
+	def Table(self, note, velocity=127):
+		key = (note / 12, velocity)
+		if key not in self.scaledTables:
+			table = self.octaveTables[note / 12]
+			if velocity == 127:
+				self.scaledTables[key] = table
+			else:
+				self.scaledTables[key] = array("h", [x * velocity / 127 for x in table])
+		return self.scaledTables[key]
+
+"""Plays the notes of bank's shape, one at a time, from a fixed point phase accumulator."""
+class WavetableOscillator:
+	def __init__(self, bank):
+		self.bank = bank
+		self.table = None
+		self.increment = 0
+		self.phase = 0
+
+	"""Starts playing note at velocity from the start of a cycle, or stops playing if note is None."""
+	def Start(self, note, velocity=127):
+		if note == None:
+			self.table = None
+		else:
+			self.table = self.bank.Table(note, velocity)
+			self.increment = self.bank.phaseIncrements[note]
+			self.phase = 0
+
+	"""Appends count samples to out, an array of signed 16 bit samples."""
+	def Render(self, count, out):
+		if self.table == None:
+			out.extend(array("h", [0]) * count)
+			return
+		table = self.table
+		phase = self.phase
+		increment = self.increment
+		# the table is indexed by the top bits of each phase, wrapped to PHASE_BITS; the phases are worked out
+		# from the sample number, as the unwrapped ones overflow the C longs xrange takes on a 32 bit machine
+		out.extend(array("h", [table[((phase + i * increment) & PHASE_MASK) >> INDEX_SHIFT] for i in xrange(0, count)]))
+		self.phase = (phase + count * increment) & PHASE_MASK
+
+"""Renders the list of (sample position, midiNote) from ExtractMonophonicNotes, with times from TrackTimeToSamples,
+with oscillator, as arrays of blockSize signed 16 bit samples (except the last)."""
+def RenderWavetable(timedNotes, oscillator, blockSize=4096):
+	block = array("h")
+	position = 0
+	for (at, note) in timedNotes:
+		while position < at:
+			count = min(at - position, blockSize - len(block))
+			oscillator.Render(count, block)
+			position += count
+			if len(block) == blockSize:
+				yield block
+				block = array("h")
+		oscillator.Start(note)
+	if len(block) > 0:
+		yield block
+
+"""Checks that an oscillator of each shape, started with its phase just short of wrapping, renders blocks that match
+the table looked up at each phase worked out afresh, and carries its phase from one block to the next. Prints any
+that fail and returns whether all passed. Also checks that every phase increment fits in PHASE_BITS."""
+def CheckPhaseWrap(sampleRate=44100, blockSize=4096):
+	ok = True
+	if max(PhaseIncrements(sampleRate)) > PHASE_MASK:
+		print "phase increments don't fit in %d bits" % PHASE_BITS
+		ok = False
+	for shape in SHAPES:
+		bank = WavetableBank(shape, sampleRate)
+		for note in (21, 69, 108, 127):
+			oscillator = WavetableOscillator(bank)
+			oscillator.Start(note)
+			start = PHASE_MASK - 3 * oscillator.increment
+			oscillator.phase = start
+			samples = array("h")
+			oscillator.Render(blockSize, samples)
+			oscillator.Render(blockSize, samples)
+			table = bank.Table(note)
+			expected = [table[((start + i * oscillator.increment) % (1 << PHASE_BITS)) >> INDEX_SHIFT] for i in xrange(0, 2 * blockSize)]
+			if list(samples) != expected or not 0 <= oscillator.phase <= PHASE_MASK:
+				print "%s note %d: wrong samples rendered across the phase wrapping" % (shape, note)
+				ok = False
+	return ok
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Writes a scale played with each wavetable shape to a WAV file.")
+	parser.add_argument("--sample-rate", type=int, default=44100)
+	parser.add_argument("--check", action="store_true", help="check rendering with the phase about to wrap, rather than writing the scales")
+	args = parser.parse_args()
+	if args.check:
+		import sys
+		ok = CheckPhaseWrap(args.sample_rate)
+		print "check %s" % ("passed" if ok else "FAILED")
+		sys.exit(0 if ok else 1)
+	from simplesynth import WriteBlocksLE16
+	from wavwriter import WAVWriter
+	for shape in SHAPES:
+		print "writing %s.wav" % shape
+		oscillator = WavetableOscillator(WavetableBank(shape, args.sample_rate))
+		scale = [(i * args.sample_rate / 4, note) for (i, note) in enumerate(range(36, 97, 12) + [None])]
+		wavFile = WAVWriter(open("%s.wav" % shape, "wb"), SampleRate=args.sample_rate)
+		WriteBlocksLE16(RenderWavetable(scale, oscillator), wavFile)
+		wavFile.close()
@@ -0,0 +1,277 @@
+#!/usr/bin/python
+
+from mididecode import MapFile
+from wavwriter import WAVWriter
+
+import numpy
+from numpy.lib.stride_tricks import as_strided
+
+import argparse, os, shutil, struct, sys, tempfile
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+"""As mididecode.FindRiffChunks, for the chunks of a RIFF WAVE file in a buffer returned by MapFile: returns a
+dictionary from chunk type onto a list of {"offset", "length"}, where the offset is that of the chunk's data.
+RIFF lengths are little endian, and each chunk is padded to an even length. A chunk running past the end of the
+file, such as the data chunk of a file still being written, is taken to end with it."""
+def FindWAVChunks(data):
+	if len(data) < 12 or data[0:4] != "RIFF" or data[8:12] != "WAVE":
+		raise ValueError("not a RIFF WAVE file")
+	chunks = dict()
+	fileLength = len(data)
+	offset = 12
+	while offset + 8 <= fileLength:
+		(type, length) = struct.unpack_from("<4sI", data, offset)
+		offset += 8
+		length = min(length, fileLength - offset)
+		if type not in chunks:
+			chunks[type] = []
+		chunks[type].append({"offset":offset, "length":length})
+		offset += length + length % 2
+	return chunks
+
+"""Reads a WAV file of 8, 16, 24 or 32 bit PCM or 32 or 64 bit float samples, as written by WAVWriter or anything
+else, in place: the file is memory mapped (where it can be) and its samples are returned as NumPy arrays looking
+into the mapping, so that the whole file is never copied into memory. The format is in the attributes of the same
+names as WAVWriter's arguments. 24 bit samples, which NumPy has no type for, are converted to 32 bit integers a
+block at a time as they are asked for, and so are copied. The mapping stays open while any array looks into it."""
+class WAVReader:
+	def __init__(self, path):
+		file = open(path, "rb")
+		try:
+			self.data = MapFile(file)
+		finally:
+			file.close()
+		self.chunks = FindWAVChunks(self.data)
+		if "fmt " not in self.chunks or "data" not in self.chunks:
+			raise ValueError("%s has no fmt or data chunk" % path)
+		fmt = self.chunks["fmt "][0]
+		if fmt["length"] < 16:
+			raise ValueError("%s has a short fmt chunk" % path)
+		(self.AudioFormat, self.NumChannels, self.SampleRate, ByteRate, self.BlockAlign, self.BitsPerSample) = struct.unpack_from("<HHIIHH", self.data, fmt["offset"])
+		if self.AudioFormat == WAVE_FORMAT_EXTENSIBLE and fmt["length"] >= 40:
+			# the format is the first two bytes of the SubFormat GUID
+			(self.AudioFormat,) = struct.unpack_from("<H", self.data, fmt["offset"] + 24)
+		sampleBytes = (self.BitsPerSample + 7) / 8
+		if self.AudioFormat == WAVE_FORMAT_PCM and sampleBytes in (1, 2, 3, 4):
+			self.dtype = numpy.dtype({1:"u1", 2:"<i2", 3:"u1", 4:"<i4"}[sampleBytes])
+		elif self.AudioFormat == WAVE_FORMAT_IEEE_FLOAT and sampleBytes in (4, 8):
+			self.dtype = numpy.dtype({4:"<f4", 8:"<f8"}[sampleBytes])
+		else:
+			raise ValueError("%s has %d bit samples of format %d, which can't be read" % (path, self.BitsPerSample, self.AudioFormat))
+		if self.NumChannels == 0 or self.BlockAlign != self.NumChannels * sampleBytes:
+			raise ValueError("%s has %d byte sample frames, not %d" % (path, self.BlockAlign, self.NumChannels * sampleBytes))
+		self.sampleBytes = sampleBytes
+		data = self.chunks["data"][0]
+		self.dataOffset = data["offset"]
+		self.numFrames = data["length"] / self.BlockAlign
+
+	def __len__(self):
+		return self.numFrames
+
+	"""Returns the length of the file in seconds."""
+	def Seconds(self):
+		return float(self.numFrames) / self.SampleRate
+
+	"""Returns count sample frames (by default, to the end) from frame start as an array of (frames, channels),
+	looking into the file. 24 bit samples are converted to 32 bit integers, in a new array. Fewer frames are
+	returned where the file ends first; a negative start or count is a ValueError."""
+	def Samples(self, start=0, count=None):
+		if start < 0 or (count != None and count < 0):
+			raise ValueError("no samples from frame %d, count %s" % (start, count))
+		start = min(start, self.numFrames)
+		if count == None or start + count > self.numFrames:
+			count = self.numFrames - start
+		offset = self.dataOffset + start * self.BlockAlign
+		if self.sampleBytes == 3:
+			raw = numpy.frombuffer(self.data, numpy.uint8, count * self.BlockAlign, offset).reshape(count * self.NumChannels, 3)
+			# each sample into the top three bytes of a 32 bit integer, then shifted down to keep its sign
+			wide = numpy.zeros((count * self.NumChannels, 4), numpy.uint8)
+			wide[:, 1:] = raw
+			return (wide.view("<i4") >> 8).reshape(count, self.NumChannels)
+		return numpy.frombuffer(self.data, self.dtype, count * self.NumChannels, offset).reshape(count, self.NumChannels)
+
+	"""Returns the samples of channel, as Samples does, as a one dimensional array."""
+	def Channel(self, channel, start=0, count=None):
+		return self.Samples(start, count)[:, channel]
+
+	"""Returns samples, as from Samples, as 64 bit floats between -1 and 1, in a new array."""
+	def ToFloat(self, samples):
+		if self.AudioFormat == WAVE_FORMAT_IEEE_FLOAT:
+			return samples.astype(numpy.float64)
+		if self.sampleBytes == 1:
+			# 8 bit samples are unsigned
+			return (samples.astype(numpy.float64) - 128) / 128
+		return samples / float(1 << (8 * self.sampleBytes - 1))
+
+	"""Yields blocks of frameSize sample frames, as Samples returns them, each hop frames (by default, frameSize)
+	after the one before, from frame start up to frame end (by default, the end of the file). The blocks look into
+	the file without being copied, except for 24 bit samples. A partial block at the end is left out, unless pad
+	is set, when it is filled out with silence (in a new array)."""
+	def Blocks(self, frameSize, hop=None, start=0, end=None, pad=False):
+		if hop == None:
+			hop = frameSize
+		if end == None or end > self.numFrames:
+			end = self.numFrames
+		# a start past the end gives no blocks, padded or not
+		start = min(start, end)
+		if self.sampleBytes == 3:
+			position = start
+			while position + frameSize <= end:
+				yield self.Samples(position, frameSize)
+				position += hop
+		else:
+			samples = self.Samples(start, end - start)
+			count = max(0, (len(samples) - frameSize) / hop + 1)
+			(frameStride, sampleStride) = samples.strides
+			blocks = as_strided(samples, shape=(count, frameSize, self.NumChannels), strides=(frameStride * hop, frameStride, sampleStride))
+			for block in blocks:
+				yield block
+			position = start + count * hop
+		if pad and position < end:
+			block = numpy.zeros((frameSize, self.NumChannels), self.Samples(0, 0).dtype)
+			if self.sampleBytes == 1:
+				block[:] = 128
+			block[:end - position] = self.Samples(position, end - position)
+			yield block
+
+	"""Drops the reader's hold on the mapping, which is unmapped once no array looks into it."""
+	def close(self):
+		self.data = None
+
+"""Writes samples, an array of (frames, channels) of the given format, to a WAV file at path with a WAVWriter,
+packing 24 bit samples (held in 32 bit integers) into three bytes each."""
+def WriteWAV(path, samples, sampleRate=44100, bitsPerSample=16, audioFormat=WAVE_FORMAT_PCM):
+	samples = numpy.asarray(samples)
+	if samples.ndim == 1:
+		samples = samples[:, None]
+	writer = WAVWriter(open(path, "wb"), audioFormat, samples.shape[1], sampleRate, bitsPerSample)
+	if bitsPerSample == 24:
+		writer.write(samples.astype("<i4").view(numpy.uint8).reshape(-1, 4)[:, :3].tostring())
+	else:
+		writer.write(numpy.ascontiguousarray(samples).tostring())
+	writer.close()
+
+"""Checks that what WriteWAV writes through a WAVWriter in every format is read back unchanged, whole and in blocks,
+that the samples are views of the mapped file, and that chunks before the data chunk, WAVE_FORMAT_EXTENSIBLE, a
+data chunk whose length hasn't been filled in and one closed part way through a sample frame are read. Prints any that fail and returns whether all passed."""
+def CheckRoundTrip():
+	ok = True
+	directory = tempfile.mkdtemp()
+	rng = numpy.random.RandomState(0)
+	formats = [
+		(8, WAVE_FORMAT_PCM, lambda shape: rng.randint(0, 256, shape).astype(numpy.uint8)),
+		(16, WAVE_FORMAT_PCM, lambda shape: rng.randint(-0x8000, 0x8000, shape).astype(numpy.int16)),
+		(24, WAVE_FORMAT_PCM, lambda shape: rng.randint(-0x800000, 0x800000, shape).astype(numpy.int32)),
+		(32, WAVE_FORMAT_PCM, lambda shape: rng.randint(-0x80000000, 0x80000000, shape).astype(numpy.int32)),
+		(32, WAVE_FORMAT_IEEE_FLOAT, lambda shape: rng.uniform(-1, 1, shape).astype(numpy.float32)),
+		(64, WAVE_FORMAT_IEEE_FLOAT, lambda shape: rng.uniform(-1, 1, shape)),
+	]
+	def fail(message):
+		print message
+		return False
+	try:
+		path = os.path.join(directory, "check.wav")
+		for (bits, audioFormat, make) in formats:
+			# an odd number of frames, so that 8 and 24 bit mono data chunks are padded
+			for channels in (1, 2):
+				name = "%d bit %s, %d channels" % (bits, "float" if audioFormat == WAVE_FORMAT_IEEE_FLOAT else "PCM", channels)
+				samples = make((1001, channels))
+				WriteWAV(path, samples, 22050, bits, audioFormat)
+				reader = WAVReader(path)
+				if (reader.NumChannels, reader.SampleRate, reader.BitsPerSample, len(reader)) != (channels, 22050, bits, 1001):
+					ok = fail("%s: read as %d channels at %d Hz, %d bits, %d frames" % (name, reader.NumChannels, reader.SampleRate, reader.BitsPerSample, len(reader)))
+					continue
+				read = reader.Samples()
+				if not numpy.array_equal(read, samples):
+					ok = fail("%s: samples differ" % name)
+				if bits != 24 and read.flags.owndata:
+					ok = fail("%s: samples were copied" % name)
+				if not numpy.array_equal(reader.Channel(channels - 1, 10, 5), samples[10:15, channels - 1]):
+					ok = fail("%s: channel differs" % name)
+				blocks = list(reader.Blocks(256, 100))
+				if len(blocks) != 8 or any([not numpy.array_equal(block, samples[100 * i:100 * i + 256]) for (i, block) in enumerate(blocks)]):
+					ok = fail("%s: blocks differ" % name)
+				padded = list(reader.Blocks(256, pad=True))
+				if len(padded) != 4 or not numpy.array_equal(padded[-1][:233], samples[768:]) or not (reader.ToFloat(padded[-1][233:]) == 0).all():
+					ok = fail("%s: padded blocks differ" % name)
+				if list(reader.Blocks(256, start=900, end=800, pad=True)) != [] or len(reader.Samples(2000, 5)) != 0:
+					ok = fail("%s: samples from past the end" % name)
+				try:
+					reader.Samples(10, -1)
+					ok = fail("%s: a negative count was taken" % name)
+				except ValueError:
+					pass
+				floats = reader.ToFloat(read)
+				if abs(floats).max() > 1:
+					ok = fail("%s: floats out of range" % name)
+				reader.close()
+		# a LIST chunk of odd length before the data, and WAVE_FORMAT_EXTENSIBLE
+		samples = make((100, 2)).astype(numpy.int16)
+		fmt = struct.pack("<HHIIHHHHIH14s", WAVE_FORMAT_EXTENSIBLE, 2, 8000, 32000, 4, 16, 22, 16, 3, WAVE_FORMAT_PCM, "\0\0\0\0\x10\0\x80\0\0\xaa\0\x38\x9b\x71")
+		body = "WAVE" + "fmt " + struct.pack("<I", len(fmt)) + fmt + "LIST" + struct.pack("<I", 3) + "abc\0" + "data" + struct.pack("<I", 400) + samples.tostring()
+		file = open(path, "wb")
+		file.write("RIFF" + struct.pack("<I", len(body)) + body)
+		file.close()
+		reader = WAVReader(path)
+		if reader.AudioFormat != WAVE_FORMAT_PCM or reader.SampleRate != 8000 or not numpy.array_equal(reader.Samples(), samples):
+			ok = fail("extensible format with a LIST chunk: read wrongly")
+		reader.close()
+		# a WAVWriter that hasn't been closed, so the lengths aren't filled in
+		file = open(path, "wb")
+		writer = WAVWriter(file, bufferSize=0)
+		writer.write(samples[:, 0].tostring())
+		file.flush()
+		reader = WAVReader(path)
+		if not numpy.array_equal(reader.Channel(0), samples[:, 0]):
+			ok = fail("unfinished file: read wrongly")
+		reader.close()
+		writer.close()
+		# a partial sample frame at the end, which close leaves out, after closing the file
+		file = open(path, "wb")
+		writer = WAVWriter(file, NumChannels=2, bufferSize=0, preallocateBytes=4096)
+		writer.write(samples.tostring() + "\1\2")
+		try:
+			writer.close()
+			ok = fail("partial frame: no error")
+		except ValueError:
+			pass
+		reader = WAVReader(path)
+		if not file.closed or os.path.getsize(path) != 44 + samples.nbytes or not numpy.array_equal(reader.Samples(), samples):
+			ok = fail("partial frame: file left open or read wrongly")
+		reader.close()
+	finally:
+		shutil.rmtree(directory)
+	return ok
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Prints the format, chunks and levels of WAV files.")
+	parser.add_argument("files", nargs="*")
+	parser.add_argument("--check", action="store_true", help="check reading back what WAVWriter writes in every format")
+	args = parser.parse_args()
+	if args.check:
+		ok = CheckRoundTrip()
+		print "check %s" % ("passed" if ok else "FAILED")
+		sys.exit(0 if ok else 1)
+	for path in args.files:
+		try:
+			reader = WAVReader(path)
+		except ValueError, e:
+			print "%s: %s" % (path, e)
+			continue
+		print "%s: format %d, %d channels, %d Hz, %d bits, %d frames (%.3f s)" % (path, reader.AudioFormat, reader.NumChannels,
+			reader.SampleRate, reader.BitsPerSample, len(reader), reader.Seconds())
+		print "  chunks: %s" % ", ".join(["%s at %d (%d bytes)" % (type, chunk["offset"], chunk["length"])
+			for (type, chunks) in sorted(reader.chunks.items()) for chunk in chunks])
+		# the peak and RMS level of each channel, a second at a time, so the file isn't all read into memory at once
+		peak = numpy.zeros(reader.NumChannels)
+		squares = numpy.zeros(reader.NumChannels)
+		for block in reader.Blocks(reader.SampleRate, pad=True):
+			floats = reader.ToFloat(block)
+			peak = numpy.maximum(peak, abs(floats).max(axis=0))
+			squares += (floats * floats).sum(axis=0)
+		rms = numpy.sqrt(squares / max(1, len(reader)))
+		print "  peak %s, RMS %s" % (", ".join(["%.4f" % level for level in peak]), ", ".join(["%.4f" % level for level in rms]))
+		reader.close()
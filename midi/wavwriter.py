@@ -1,15 +1,25 @@
 #!/usr/bin/python
 
-import struct
+import os, struct
 
 """An adapter that allows the client to write directly into the WAV data chunk, adding
-the necessary WAV headers."""
+the necessary WAV headers. write accepts a string or anything else supporting the buffer
+interface, such as an array of samples or a C contiguous NumPy array, as little endian sample
+data of the format given, with the channels interleaved. Writes of bufferSize bytes or more go straight to
+the file without being copied, while smaller ones (such as those of LE16, a sample at a time)
+are gathered into a buffer and written bufferSize bytes at a time.
+If preallocateBytes is given, that much space for the data is reserved in the file when it
+is created, so that it isn't fragmented as it grows; any that isn't used is released on close."""
 class WAVWriter:
-	def __init__(self, file, AudioFormat=1, NumChannels=1, SampleRate=44100, BitsPerSample=16):
+	def __init__(self, file, AudioFormat=1, NumChannels=1, SampleRate=44100, BitsPerSample=16, bufferSize=64*1024, preallocateBytes=0):
 		self.file = file
 		self.dataChunkSize = 0
-		BlockAlign=NumChannels*BitsPerSample/8
-		ByteRate=SampleRate*BitsPerSample/8
+		self.bufferSize = bufferSize
+		self.pending = bytearray()
+		self.preallocated = preallocateBytes > 0
+		BlockAlign=NumChannels*((BitsPerSample+7)/8)
+		ByteRate=SampleRate*BlockAlign
+		self.BlockAlign = BlockAlign
 		file.write("RIFF")
 		file.write("????") # DataChunkSize+36, fill this in later
 		file.write("WAVE")
@@ -23,14 +33,60 @@ class WAVWriter:
 			BitsPerSample))
 		file.write("data")
 		file.write("????") # DataChunkSize, fill this in later
-	
+		if self.preallocated:
+			file.flush()
+			# Python 2 has no os.posix_fallocate, so the file is only extended with ftruncate; that doesn't
+			# reserve the blocks on every filesystem, but is the best available
+			os.ftruncate(file.fileno(), 44 + preallocateBytes)
+
 	def write(self, buf):
-		self.file.write(buf)
-		self.dataChunkSize += len(buf)
+		flags = getattr(buf, "flags", None)
+		if flags != None and not flags["C_CONTIGUOUS"]:
+			# a strided or Fortran ordered NumPy array: its buffer, if it has one, isn't in interleaved sample order
+			raise ValueError("samples must be a C contiguous array; pass numpy.ascontiguousarray(samples)")
+		try:
+			buf = buffer(buf)
+			size = len(buf)
+		except TypeError:
+			# a memoryview, which buffer() doesn't take
+			buf = memoryview(buf)
+			size = buf.itemsize
+			for dimension in buf.shape:
+				size *= dimension
+		self.dataChunkSize += size
+		if size >= self.bufferSize:
+			self.flush()
+			self.file.write(buf)
+		else:
+			self.pending += buf
+			if len(self.pending) >= self.bufferSize:
+				self.flush()
+
+	"""Writes out any data held in the buffer."""
+	def flush(self):
+		if self.pending:
+			self.file.write(self.pending)
+			self.pending = bytearray()
 
+	"""Fills in the headers and closes the file. If the data ends part way through a sample frame, that frame
+	is left out, so the file is still a WAV file of the whole ones, and ValueError is raised once it is closed."""
 	def close(self):
-		self.file.seek(4, 0)
-		self.file.write(struct.pack("<I", self.dataChunkSize+36))
-		self.file.seek(40, 0)
-		self.file.write(struct.pack("<I", self.dataChunkSize))
-		self.file.close()
+		try:
+			self.flush()
+			partial = self.dataChunkSize % self.BlockAlign
+			dataChunkSize = self.dataChunkSize - partial
+			# chunks are padded to an even length, though the size recorded for the chunk excludes the padding
+			padding = dataChunkSize % 2
+			if partial != 0:
+				self.file.seek(44 + dataChunkSize, 0)
+			self.file.write("\0" * padding)
+			if self.preallocated or partial != 0:
+				self.file.truncate(44 + dataChunkSize + padding)
+			self.file.seek(4, 0)
+			self.file.write(struct.pack("<I", dataChunkSize+padding+36))
+			self.file.seek(40, 0)
+			self.file.write(struct.pack("<I", dataChunkSize))
+		finally:
+			self.file.close()
+		if partial != 0:
+			raise ValueError("%d bytes of data isn't a whole number of %d byte sample frames" % (self.dataChunkSize, self.BlockAlign))
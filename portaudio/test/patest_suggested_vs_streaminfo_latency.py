@@ -5,14 +5,21 @@ Run and graph the results of patest_suggested_vs_streaminfo_latency.c
 
 Requires matplotlib for plotting: http://matplotlib.sourceforge.net/
 
+The test is run by patest_suggested_vs_streaminfo_latency_sweep.py, once per
+frames per buffer value, each writing its own file in resultsDirName.
+Configurations already run are not run again, so delete that directory to
+measure afresh.
+
 """
 import os
 from pylab import *
 import numpy
 from matplotlib.backends.backend_pdf import PdfPages
+from patest_suggested_vs_streaminfo_latency_sweep import SweepConfig, runSweep, loadSweep
 
 testExeName = "PATest.exe" # rename to whatever the compiled patest_suggested_vs_streaminfo_latency.c binary is
-dataFileName = "patest_suggested_vs_streaminfo_latency.csv" # code below calls the exe to generate this file
+resultsDirName = "patest_suggested_vs_streaminfo_latency_results" # code below calls the exe to generate a file here per frames per buffer value
+jobs = 1 # runs of the exe at once; see patest_suggested_vs_streaminfo_latency_sweep.py before raising it
 
 inputDeviceIndex = -1 # -1 means default
 outputDeviceIndex = -1 # -1 means default
@@ -22,38 +29,6 @@ pdfFilenameSuffix = "_wmme"
 pdfFile = PdfPages("patest_suggested_vs_streaminfo_latency_" + str(sampleRate) + pdfFilenameSuffix +".pdf") #output this pdf file
 
 
-def loadCsvData( dataFileName ):
-    params= ""
-    inputDevice = ""
-    outputDevice = ""
-
-    startLines = file(dataFileName).readlines(1024)
-    for line in startLines:
-        if "output device" in line:
-            outputDevice = line.strip(" \t\n\r#")
-        if "input device" in line:
-            inputDevice = line.strip(" \t\n\r#")
-    params = startLines[0].strip(" \t\n\r#")
-
-    data = numpy.loadtxt(dataFileName, delimiter=",", skiprows=4).transpose()
-
-    class R(object): pass
-    result = R()
-    result.params = params
-    for s in params.split(','):
-        if "sample rate" in s:
-            result.sampleRate = s
-
-    result.inputDevice = inputDevice
-    result.outputDevice = outputDevice
-    result.suggestedLatency = data[0]
-    result.halfDuplexOutputLatency = data[1]
-    result.halfDuplexInputLatency = data[2]
-    result.fullDuplexOutputLatency = data[3]
-    result.fullDuplexInputLatency = data[4]
-    return result;
-
-
 def setFigureTitleAndAxisLabels( framesPerBufferString ):
     title("PortAudio suggested (requested) vs. resulting (reported) stream latency\n" + framesPerBufferString)
     ylabel("PaStreamInfo::{input,output}Latency (s)")
@@ -88,19 +63,24 @@ compositeTestFramesPerBufferValues.append( 882 )
 
 individualPlotFramesPerBufferValues = [0,64,128,256,512] #output separate plots for these
 
-isFirst = True    
+configs = [SweepConfig(inputDeviceIndex, outputDeviceIndex, sampleRate, framesPerBuffer) for framesPerBuffer in compositeTestFramesPerBufferValues]
+runSweep( testExeName, configs, resultsDirName, jobs )
+sweep = loadSweep( configs, resultsDirName )
 
-for framesPerBuffer in compositeTestFramesPerBufferValues:
-    commandString = testExeName + " " + str(inputDeviceIndex) + " " + str(outputDeviceIndex) + " " + str(sampleRate) + " " + str(framesPerBuffer) + ' > ' + dataFileName
-    print commandString
-    os.system(commandString)
+isFirst = True    
 
-    d = loadCsvData(dataFileName)
+for config in configs:
+    framesPerBuffer = config.framesPerBuffer
+    if config not in sweep.headers:
+        print "no results for frames per buffer %d" % framesPerBuffer
+        continue
+    d = sweep.where( framesPerBuffer=framesPerBuffer )
+    header = d.headers[config]
 
     if isFirst:
         figure(1) # title sheet
         gcf().text(0.1, 0.0,
-           "patest_suggested_vs_streaminfo_latency\n%s\n%s\n%s\n"%(d.inputDevice,d.outputDevice,d.sampleRate))
+           "patest_suggested_vs_streaminfo_latency\n%s\n%s\n%s\n"%(header["inputDevice"],header["outputDevice"],header["sampleRate"]))
         pdfFile.savefig()
         
         
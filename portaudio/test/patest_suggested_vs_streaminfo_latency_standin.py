@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+
+A stand-in for the patest_suggested_vs_streaminfo_latency.c binary, printing
+the same CSV without opening any audio device, for trying out
+patest_suggested_vs_streaminfo_latency_sweep.py.
+
+Usage: python patest_suggested_vs_streaminfo_latency_standin.py [options]
+           input-device-index output-device-index sample-rate frames-per-buffer
+
+The reported latencies are the suggested latency, raised to a minimum and
+rounded up to whole buffers, as a host API might. --fail and --hang make the
+given frames per buffer values fail part way through or never finish.
+
+"""
+import sys, time, math, argparse
+
+SUGGESTED_LATENCY_START_SECONDS = 0.0
+SUGGESTED_LATENCY_END_SECONDS = 2.0
+SUGGESTED_LATENCY_INCREMENT_SECONDS = 0.0005
+
+MIN_OUTPUT_LATENCY_SECONDS = 0.010
+MIN_INPUT_LATENCY_SECONDS = 0.005
+
+
+def standInLatency( suggestedLatency, minLatency, sampleRate, framesPerBuffer ):
+    if framesPerBuffer == 0:
+        framesPerBuffer = 256 # what a host API might choose for paFramesPerBufferUnspecified
+    bufferSeconds = float(framesPerBuffer) / sampleRate
+    return math.ceil( max(suggestedLatency, minLatency) / bufferSeconds - 1e-9 ) * bufferSeconds
+
+
+def suggestedLatencies():
+    # counted the same way as the C loop, so that the rounding matches
+    result = []
+    suggestedLatency = SUGGESTED_LATENCY_START_SECONDS
+    while suggestedLatency <= SUGGESTED_LATENCY_END_SECONDS:
+        result.append( suggestedLatency )
+        suggestedLatency += SUGGESTED_LATENCY_INCREMENT_SECONDS
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser( description="Stand-in for patest_suggested_vs_streaminfo_latency." )
+    parser.add_argument( "--host-api", default="Stand-in", help="host API name to report" )
+    parser.add_argument( "--delay", type=float, default=0.0, help="seconds to take, as opening the streams would" )
+    parser.add_argument( "--fail", default="", help="comma separated frames per buffer values to fail part way through" )
+    parser.add_argument( "--hang", default="", help="comma separated frames per buffer values never to finish" )
+    parser.add_argument( "args", nargs="*", type=int )
+    args = parser.parse_args()
+    (inputDevice, outputDevice, sampleRate, framesPerBuffer) = (args.args + [-1, -1, 44100, 2][len(args.args):])[:4]
+    fail = [int(s) for s in args.fail.split(",") if s]
+    hang = [int(s) for s in args.hang.split(",") if s]
+
+    print "# sample rate=%f, frames per buffer=%d" % (float(sampleRate), framesPerBuffer)
+    print "# using input device id %d (Stand-in input %d, %s)" % (max(inputDevice, 0), max(inputDevice, 0), args.host_api)
+    print "# using output device id %d (Stand-in output %d, %s)" % (max(outputDevice, 1), max(outputDevice, 1), args.host_api)
+    print "# suggested latency, half duplex PaStreamInfo::outputLatency, half duplex PaStreamInfo::inputLatency, full duplex PaStreamInfo::outputLatency, full duplex PaStreamInfo::inputLatency"
+    sys.stdout.flush()
+    time.sleep( args.delay )
+    if framesPerBuffer in hang:
+        while True:
+            time.sleep( 1 )
+    latencies = suggestedLatencies()
+    for (i, suggestedLatency) in enumerate(latencies):
+        if framesPerBuffer in fail and i == len(latencies) / 2:
+            sys.stdout.write( "%f, " % suggestedLatency )
+            sys.stdout.flush()
+            sys.stderr.write( "An error occured while using the portaudio stream\nError number: -9996\nError message: Invalid device\n" )
+            return -9996
+        outputLatency = standInLatency( suggestedLatency, MIN_OUTPUT_LATENCY_SECONDS, sampleRate, framesPerBuffer )
+        inputLatency = standInLatency( suggestedLatency, MIN_INPUT_LATENCY_SECONDS, sampleRate, framesPerBuffer )
+        sys.stdout.write( "%f, %f,%f,%f,%f\n" % (suggestedLatency, outputLatency, inputLatency, outputLatency, inputLatency) )
+    print "# Test finished."
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
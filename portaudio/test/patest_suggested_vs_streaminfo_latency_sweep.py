@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+"""
+
+Run patest_suggested_vs_streaminfo_latency.c over a sweep of configurations
+and load the results, for patest_suggested_vs_streaminfo_latency.py to graph.
+
+Each configuration (input device, output device, sample rate, frames per
+buffer) is run as a process of its own, writing a CSV file of its own in the
+results directory. The file is only given its name once the test has
+finished, so the files there are the configurations already done: running
+the sweep again only runs those missing, and a failed or hung run loses
+nothing but itself (its output and errors are kept beside it, to look at).
+
+Configurations are run one at a time unless --jobs says otherwise. Running
+several at once is only safe where the host API lets each stream have a
+buffer size of its own: Core Audio's and JACK's buffer sizes are set for a
+whole device or server, so runs at once would change each other's latencies
+(and exclusive APIs such as ASIO fail to open the device at all).
+
+Try it without audio hardware with --check, which runs the sweep against
+patest_suggested_vs_streaminfo_latency_standin.py.
+
+"""
+import os, sys, time, glob, shlex, shutil, argparse, tempfile, subprocess, collections
+import numpy
+
+resultsDirName = "patest_suggested_vs_streaminfo_latency_results"
+
+latencyColumns = ["suggestedLatency", "halfDuplexOutputLatency", "halfDuplexInputLatency", "fullDuplexOutputLatency", "fullDuplexInputLatency"]
+
+SweepConfig = collections.namedtuple( "SweepConfig", "inputDevice outputDevice sampleRate framesPerBuffer" )
+
+
+def resultFileName( config ):
+    return "latency_in%d_out%d_sr%d_fpb%d.csv" % config
+
+
+def testCommandLine( testCommand, config ):
+    return shlex.split(testCommand, posix=(os.name != "nt")) + [str(x) for x in config]
+
+
+def readHeader( lines ):
+    header = {"params": "", "inputDevice": "", "outputDevice": "", "sampleRate": ""}
+    header["params"] = lines[0].strip(" \t\n\r#")
+    for line in lines:
+        if not line.startswith("#"):
+            break
+        if "output device" in line:
+            header["outputDevice"] = line.strip(" \t\n\r#")
+        if "input device" in line:
+            header["inputDevice"] = line.strip(" \t\n\r#")
+    for s in header["params"].split(','):
+        if "sample rate" in s:
+            header["sampleRate"] = s
+    return header
+
+
+def readResultFile( path ):
+    f = open(path)
+    lines = f.readlines()
+    f.close()
+    dataLines = [line for line in lines if line.strip() and not line.startswith("#")]
+    data = numpy.fromstring(" ".join(dataLines).replace(",", " "), sep=" ")
+    return (readHeader(lines), data.reshape(-1, len(latencyColumns)))
+
+
+def isFinished( path ):
+    f = open(path)
+    lines = f.readlines()
+    f.close()
+    return len(lines) > 0 and lines[-1].startswith("# Test finished.")
+
+
+def runSweep( testCommand, configs, resultsDir=resultsDirName, jobs=1, timeoutSeconds=300, log=sys.stdout ):
+    """Runs the test for each of configs without a result in resultsDir, jobs at a time (see the module
+    docstring before raising it). Returns a dict from each config to "cached", "done" or "failed"."""
+    if not os.path.isdir(resultsDir):
+        os.makedirs(resultsDir)
+    status = {}
+    pending = []
+    for config in configs:
+        if os.path.exists(os.path.join(resultsDir, resultFileName(config))):
+            status[config] = "cached"
+        else:
+            pending.append(config)
+    print >>log, "%d of %d configurations already run" % (len(configs) - len(pending), len(configs))
+    running = []
+    while pending or running:
+        while pending and len(running) < jobs:
+            config = pending.pop(0)
+            resultPath = os.path.join(resultsDir, resultFileName(config))
+            output = open(resultPath + ".partial", "w")
+            errors = open(resultPath + ".log", "w")
+            print >>log, "running %s" % " ".join(testCommandLine(testCommand, config))
+            try:
+                process = subprocess.Popen(testCommandLine(testCommand, config), stdout=output, stderr=errors)
+            except OSError, e:
+                print >>errors, e
+                process = None
+            output.close()
+            errors.close()
+            running.append( (config, process, time.time()) )
+        time.sleep( 0.02 )
+        for (config, process, started) in list(running):
+            if process is not None and process.poll() is None:
+                if time.time() - started < timeoutSeconds:
+                    continue
+                process.kill()
+                process.wait()
+                f = open(os.path.join(resultsDir, resultFileName(config)) + ".log", "a")
+                print >>f, "killed after %d seconds" % timeoutSeconds
+                f.close()
+            running.remove( (config, process, started) )
+            resultPath = os.path.join(resultsDir, resultFileName(config))
+            if process is not None and process.returncode == 0 and isFinished(resultPath + ".partial"):
+                os.rename(resultPath + ".partial", resultPath)
+                os.remove(resultPath + ".log")
+                status[config] = "done"
+            else:
+                status[config] = "failed"
+                print >>log, "failed: %s (see %s.log)" % (resultFileName(config), resultPath)
+    return status
+
+
+class LatencySweep(object):
+    """The results of a sweep, as arrays with a row for each suggested latency of each configuration loaded:
+    the fields of SweepConfig, the columns of the CSV (latencyColumns), and, by config, the CSV headers."""
+
+    def __init__( self, columns, headers ):
+        self.columns = columns
+        self.headers = headers
+        for (name, values) in columns.items():
+            setattr(self, name, values)
+
+    def __len__( self ):
+        return len(self.suggestedLatency)
+
+    def where( self, **fields ):
+        """Returns the rows whose fields (of SweepConfig) have the given values."""
+        mask = numpy.ones(len(self), dtype=bool)
+        for (name, value) in fields.items():
+            mask &= self.columns[name] == value
+        configs = set( [c for c in self.headers if all(getattr(c, name) == value for (name, value) in fields.items())] )
+        return LatencySweep( dict((name, values[mask]) for (name, values) in self.columns.items()),
+                             dict((c, h) for (c, h) in self.headers.items() if c in configs) )
+
+
+def loadSweep( configs, resultsDir=resultsDirName ):
+    """Loads the results of those of configs that have been run into a LatencySweep, parsing the numbers of
+    every file in one go."""
+    headers = {}
+    texts = []
+    counts = []
+    loaded = []
+    for config in configs:
+        path = os.path.join(resultsDir, resultFileName(config))
+        if not os.path.exists(path):
+            continue
+        f = open(path)
+        lines = f.readlines()
+        f.close()
+        dataLines = [line for line in lines if line.strip() and not line.startswith("#")]
+        headers[config] = readHeader(lines)
+        texts.append( " ".join(dataLines) )
+        counts.append( len(dataLines) )
+        loaded.append( config )
+    data = numpy.fromstring(" ".join(texts).replace(",", " "), sep=" ").reshape(-1, len(latencyColumns))
+    columns = {}
+    for (i, name) in enumerate(latencyColumns):
+        columns[name] = data[:, i]
+    for (i, name) in enumerate(SweepConfig._fields):
+        columns[name] = numpy.repeat( numpy.array([c[i] for c in loaded], dtype=int), counts )
+    return LatencySweep( columns, headers )
+
+
+def check():
+    """Runs sweeps against the stand-in: failing and hanging runs, a rerun filling the gaps, runs one at a
+    time by default and in parallel when asked, and the loaded results. Prints any failures and returns whether all passed."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, here)
+    import patest_suggested_vs_streaminfo_latency_standin as standin
+    standInCommand = '"%s" "%s"' % (sys.executable, os.path.join(here, "patest_suggested_vs_streaminfo_latency_standin.py"))
+    ok = [True]
+    def expect( condition, message ):
+        if not condition:
+            print "FAILED: " + message
+            ok[0] = False
+    quiet = open(os.devnull, "w")
+    resultsDir = tempfile.mkdtemp()
+    try:
+        configs = [SweepConfig(-1, -1, rate, fpb) for rate in (44100, 48000) for fpb in (0, 64, 256)]
+        # one fails part way through and one hangs
+        status = runSweep(standInCommand + " --host-api MME --fail 64 --hang 256", configs, resultsDir, timeoutSeconds=2, log=quiet)
+        expect( sorted(status.values()) == ["done"] * 2 + ["failed"] * 4, "first sweep: %s" % status )
+        expect( len(glob.glob(os.path.join(resultsDir, "*.csv"))) == 2, "only finished runs have results" )
+        expect( os.path.exists(os.path.join(resultsDir, resultFileName(configs[1])) + ".log"), "a failed run's errors are kept" )
+        # the rerun only runs those that failed, in parallel as asked
+        started = time.time()
+        status = runSweep(standInCommand + " --host-api MME --delay 0.5", configs, resultsDir, jobs=4, log=quiet)
+        elapsed = time.time() - started
+        expect( sorted(status.values()) == ["cached"] * 2 + ["done"] * 4, "rerun: %s" % status )
+        expect( elapsed < 4 * 0.5 * 0.75, "rerun in parallel: %.2f s" % elapsed )
+        # without --jobs, whatever the host API, they run one at a time
+        serialDir = os.path.join(resultsDir, "serial")
+        started = time.time()
+        status = runSweep(standInCommand + " --host-api MME --delay 0.3", configs[:4], serialDir, log=quiet)
+        elapsed = time.time() - started
+        expect( sorted(status.values()) == ["done"] * 4, "serial sweep: %s" % status )
+        expect( elapsed >= 4 * 0.3, "runs one at a time by default: %.2f s" % elapsed )
+        # everything loads into one set of columns, which match what was printed
+        sweep = loadSweep(configs + [SweepConfig(-1, -1, 96000, 0)], resultsDir)
+        latencies = standin.suggestedLatencies()
+        expect( len(sweep) == len(configs) * len(latencies), "loaded %d rows" % len(sweep) )
+        for config in configs:
+            rows = sweep.where(sampleRate=config.sampleRate, framesPerBuffer=config.framesPerBuffer)
+            expected = numpy.array([standin.standInLatency(s, standin.MIN_OUTPUT_LATENCY_SECONDS, config.sampleRate, config.framesPerBuffer) for s in latencies])
+            expect( len(rows) == len(latencies) and numpy.allclose(rows.halfDuplexOutputLatency, expected, atol=1e-6)
+                and numpy.allclose(rows.fullDuplexOutputLatency, expected, atol=1e-6), "%s loaded wrongly" % (config,) )
+            expect( rows.headers.keys() == [config] and "MME" in rows.headers[config]["outputDevice"], "%s header" % (config,) )
+        (header, data) = readResultFile(os.path.join(resultsDir, resultFileName(configs[0])))
+        expect( numpy.array_equal(data, numpy.column_stack([sweep.where(**configs[0]._asdict()).columns[name] for name in latencyColumns])), "readResultFile" )
+    finally:
+        quiet.close()
+        shutil.rmtree(resultsDir)
+    return ok[0]
+
+
+def main():
+    parser = argparse.ArgumentParser( description="Runs patest_suggested_vs_streaminfo_latency over frames per buffer values and sample rates." )
+    parser.add_argument( "--exe", default="PATest.exe", help="command running the compiled patest_suggested_vs_streaminfo_latency.c" )
+    parser.add_argument( "--input-device", type=int, default=-1, help="-1 means default" )
+    parser.add_argument( "--output-device", type=int, default=-1, help="-1 means default" )
+    parser.add_argument( "--sample-rates", default="44100", help="comma separated" )
+    parser.add_argument( "--frames-per-buffer", default="0,2,4,8,16,32,64,128,256,512,1024", help="comma separated" )
+    parser.add_argument( "--results", default=resultsDirName, help="directory of result files" )
+    parser.add_argument( "--jobs", type=int, default=1, help="runs at once (default: 1; more only where the host API gives each stream its own buffer size, not Core Audio, JACK or ASIO)" )
+    parser.add_argument( "--timeout", type=float, default=300, help="seconds before a run is given up on" )
+    parser.add_argument( "--check", action="store_true", help="try the sweep out against the stand-in" )
+    args = parser.parse_args()
+    if args.check:
+        ok = check()
+        print "check %s" % ("passed" if ok else "FAILED")
+        return 0 if ok else 1
+    configs = [SweepConfig(args.input_device, args.output_device, int(rate), int(fpb))
+               for rate in args.sample_rates.split(",") for fpb in args.frames_per_buffer.split(",")]
+    status = runSweep(args.exe, configs, args.results, args.jobs, args.timeout)
+    failed = [c for c in configs if status[c] == "failed"]
+    sweep = loadSweep(configs, args.results)
+    print "%d rows from %d configurations, %d failed" % (len(sweep), len(sweep.headers), len(failed))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit( main() )